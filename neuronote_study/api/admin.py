@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import *
+from .deletion import delete_notes, delete_pdfs, delete_users
 
 @admin.register(uploadPDF)
 class UploadPDFAdmin(admin.ModelAdmin):
@@ -11,8 +12,7 @@ class UploadPDFAdmin(admin.ModelAdmin):
     list_per_page = 25
 
     def delete_queryset(self, request, queryset):
-        for obj in queryset:
-            obj.delete()
+        delete_pdfs(queryset)
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -24,8 +24,7 @@ class UserAdmin(admin.ModelAdmin):
     list_per_page = 25
 
     def delete_queryset(self, request, queryset):
-        for obj in queryset:
-            obj.delete()
+        delete_users(queryset)
 
 @admin.register(note)
 class NoteAdmin(admin.ModelAdmin):
@@ -37,8 +36,7 @@ class NoteAdmin(admin.ModelAdmin):
     list_per_page = 25
 
     def delete_queryset(self, request, queryset):
-        for obj in queryset:
-            obj.delete()
+        delete_notes(queryset)
 
 @admin.register(flashcard)
 class FlashcardAdmin(admin.ModelAdmin):
@@ -63,7 +61,7 @@ class ChatMessageAdmin(admin.ModelAdmin):
 
 @admin.register(notebook_page)
 class NotebookPageAdmin(admin.ModelAdmin):
-    list_display = ('page_title', 'page_number', 'user', 'created_at')
+    list_display = ('page_title', 'rank', 'user', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('page_title',)
     readonly_fields = ('created_at',)
@@ -90,3 +88,13 @@ class NotebookNoteAdmin(admin.ModelAdmin):
         except Exception as e:
             self.message_user(request, f"Error deleting notebook notes: {str(e)}", level='error')
 
+
+
+@admin.register(background_job)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'user', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind', 'created_at')
+    search_fields = ('kind', 'error')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+    ordering = ('-created_at',)
+    list_per_page = 25
@@ -0,0 +1,119 @@
+import logging
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .models import (
+    User, chat_message, chat_summary, flashcard, flashcard_answer, note, note_chunk,
+    notebook_note, notebook_page, uploadPDF
+)
+
+logger = logging.getLogger(__name__)
+
+# Deleting through Django's collector loads every dependent row into memory, and
+# because the note foreign keys have no database constraint the database cannot
+# cascade for us either. These functions delete a batch of notes (or PDFs, or
+# users) at a time with one DELETE per dependent table, so memory stays flat and
+# the number of statements grows with the batch count rather than the row count.
+
+BATCH_SIZE = 1000
+
+NOTE_DEPENDENTS = [
+    (flashcard_answer, 'flashcard_answer__note_id__in'),
+    (flashcard, 'note_id__in'),
+    (chat_message, 'note_id__in'),
+    (chat_summary, 'note_id__in'),
+    (note_chunk, 'note_id__in'),
+    (notebook_note, 'note_id__in'),
+]
+
+
+def _raw_delete(model, **filters):
+    # A plain DELETE ... WHERE, without collecting the rows or sending signals (none are connected)
+    queryset = model._base_manager.filter(**filters)
+    return queryset._raw_delete(queryset.db)
+
+
+def _count(counts, model, deleted):
+    if deleted:
+        counts[model._meta.label] = counts.get(model._meta.label, 0) + deleted
+
+
+def _batches(queryset):
+    # Each batch is deleted before the next is read, so re-slicing the same queryset moves on
+    while True:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:BATCH_SIZE])
+        if not ids:
+            return
+        yield ids
+
+
+def _delete_note_rows(notes, counts):
+    pdf_ids = set()
+    for ids in _batches(notes):
+        pdf_ids.update(note.objects.filter(id__in=ids).values_list('note_key_id', flat=True))
+        for model, lookup in NOTE_DEPENDENTS:
+            _count(counts, model, _raw_delete(model, **{lookup: ids}))
+        _count(counts, note, _raw_delete(note, id__in=ids))
+    return pdf_ids
+
+
+def _delete_pdf_rows(pdfs, counts):
+    for ids in _batches(pdfs):
+        _delete_note_rows(note.objects.filter(note_key_id__in=ids), counts)
+        names = list(uploadPDF.objects.filter(id__in=ids).exclude(pdf_file='').values_list('pdf_file', flat=True).distinct())
+        _count(counts, uploadPDF, _raw_delete(uploadPDF, id__in=ids))
+        # Stored files are shared by identical uploads; see remove_unreferenced_files
+        transaction.on_commit(lambda names=names: remove_unreferenced_files(names))
+
+
+def remove_unreferenced_files(names):
+    """Delete the stored files that no upload refers to any more."""
+    referenced = set(uploadPDF.objects.filter(pdf_file__in=names).values_list('pdf_file', flat=True))
+    for name in set(names) - referenced:
+        try:
+            default_storage.delete(name)
+        except OSError as e:
+            logger.warning(f"Could not remove {name}: {str(e)}")
+
+
+def _result(counts):
+    return sum(counts.values()), counts
+
+
+def delete_notes(notes):
+    """Delete `notes` (a note queryset) with their flashcards, chat and notebook notes.
+
+    PDFs left without any note are deleted as well. Returns (total, {model label: count})
+    like QuerySet.delete().
+    """
+    counts = {}
+    with transaction.atomic():
+        pdf_ids = _delete_note_rows(notes, counts)
+        _delete_pdf_rows(uploadPDF.objects.filter(id__in=pdf_ids, pdf_notes__isnull=True), counts)
+    return _result(counts)
+
+
+def delete_pdfs(pdfs):
+    """Delete `pdfs` (an uploadPDF queryset) with their notes; their files go once the transaction commits."""
+    counts = {}
+    with transaction.atomic():
+        _delete_pdf_rows(pdfs, counts)
+    return _result(counts)
+
+
+def delete_users(users):
+    """Delete `users` (a User queryset) with everything they own."""
+    counts = {}
+    with transaction.atomic():
+        for ids in _batches(users):
+            _delete_note_rows(note.objects.filter(user_id__in=ids), counts)
+            _delete_pdf_rows(uploadPDF.objects.filter(user_id__in=ids), counts)
+            _count(counts, notebook_note, _raw_delete(notebook_note, notebook_page__user_id__in=ids))
+            _count(counts, notebook_page, _raw_delete(notebook_page, user_id__in=ids))
+            # What is left (tokens, jobs, request records, admin log entries) is small, so
+            # Django's collector handles it, including relations added by other apps
+            deleted, by_model = User.objects.filter(id__in=ids).delete()
+            for label, count in by_model.items():
+                counts[label] = counts.get(label, 0) + count
+    return _result(counts)
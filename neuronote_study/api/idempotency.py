@@ -0,0 +1,180 @@
+import functools
+import hashlib
+import json
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import idempotency_record
+from .storage import content_hash
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+_finished = 0
+_finished_lock = threading.Lock()
+
+
+def _fingerprint_value(value):
+    if isinstance(value, UploadedFile):
+        # By content, so another file of the same name and size is another request. The digest
+        # is kept on the file, and storing the upload reuses it
+        return f'file:{value.name}:{content_hash(value)[0]}'
+    return str(value)
+
+
+def request_hash(endpoint, data, url_kwargs=None):
+    # Form and multipart bodies are QueryDicts; JSON bodies are plain dicts
+    payload = dict(data.lists()) if hasattr(data, 'lists') else data
+    return hashlib.sha256(json.dumps(
+        {'endpoint': endpoint, 'data': payload, 'kwargs': url_kwargs or {}},
+        sort_keys=True,
+        default=_fingerprint_value
+    ).encode('utf-8')).hexdigest()
+
+
+def _error(message, code):
+    return Response({'status': 'error', 'message': message}, status=code)
+
+
+def begin(user, key, endpoint, fingerprint):
+    """Claim `key` for this request.
+
+    Returns None when the caller should run the request, or the Response to send instead:
+    the stored one for a replay, or an error for a key that is in use or belongs to another request.
+    """
+    now = timezone.now()
+    fields = {
+        'endpoint': endpoint,
+        'request_hash': fingerprint,
+        'status': idempotency_record.STATUS_RUNNING,
+        'locked_until': now + timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS),
+        'response_status': None,
+        'response': None,
+        'expires_at': now + timedelta(hours=settings.IDEMPOTENCY_RETENTION_HOURS),
+    }
+    try:
+        with transaction.atomic():
+            idempotency_record.objects.create(user=user, key=key, **fields)
+        return None
+    except IntegrityError:
+        pass
+
+    # Expired records and requests whose worker died are claimed again
+    if idempotency_record.objects.filter(user=user, key=key).filter(
+        Q(expires_at__lt=now) |
+        Q(status=idempotency_record.STATUS_RUNNING, locked_until__lt=now, request_hash=fingerprint)
+    ).update(**fields):
+        return None
+
+    record = idempotency_record.objects.filter(user=user, key=key).first()
+    if record is None:
+        # Deleted after a failure between our INSERT and SELECT; the client can simply retry
+        return _error('A request with this Idempotency-Key just failed, please retry', status.HTTP_409_CONFLICT)
+    if record.request_hash != fingerprint:
+        return _error('This Idempotency-Key was already used for a different request', status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status == idempotency_record.STATUS_RUNNING:
+        return _error('A request with this Idempotency-Key is still being processed', status.HTTP_409_CONFLICT)
+
+    response = Response(record.response, status=record.response_status)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def response_data(response):
+    # DRF responses keep their data; the async views return JsonResponses
+    if hasattr(response, 'data'):
+        return response.data
+    return json.loads(response.content)
+
+
+def json_response(response):
+    """The DRF `response` (a replay or an error) as a JsonResponse, for the async views."""
+    converted = JsonResponse(response.data, status=response.status_code, safe=False)
+    for header, value in response.items():
+        if header.lower() != 'content-type':
+            converted[header] = value
+    return converted
+
+
+def complete(user, key, response):
+    # Responses are stored unless the server failed, in which case the key is released for a retry
+    records = idempotency_record.objects.filter(user=user, key=key, status=idempotency_record.STATUS_RUNNING)
+    if response is not None and response.status_code < 500:
+        records.update(status=idempotency_record.STATUS_DONE, response_status=response.status_code, response=response_data(response))
+    else:
+        records.delete()
+
+    global _finished
+    with _finished_lock:
+        _finished += 1
+        prune_now = _finished % settings.IDEMPOTENCY_PRUNE_EVERY == 0
+    if prune_now:
+        prune()
+
+
+def prune():
+    return idempotency_record.objects.filter(expires_at__lt=timezone.now()).delete()[0]
+
+
+def idempotent(endpoint):
+    """Honour an Idempotency-Key header on a view's post(): a retry with the same key gets the original response."""
+    def decorator(post):
+        @functools.wraps(post)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key or not request.user.is_authenticated:
+                return post(view, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _error(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters', status.HTTP_400_BAD_REQUEST)
+
+            replay = begin(request.user, key, endpoint, request_hash(endpoint, request.data, kwargs))
+            if replay is not None:
+                return replay
+
+            response = None
+            try:
+                response = post(view, request, *args, **kwargs)
+                return response
+            finally:
+                complete(request.user, key, response)
+        return wrapper
+    return decorator
+
+
+def aidempotent(endpoint):
+    """idempotent() for the async views, which are called as view(request, user, data) and return JsonResponses.
+
+    Uses the same records and endpoint names, so a retry may go to either version of a view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, user, data, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return await view(request, user, data, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return json_response(_error(f'{HEADER} must be at most {MAX_KEY_LENGTH} characters', status.HTTP_400_BAD_REQUEST))
+
+            replay = await sync_to_async(begin)(user, key, endpoint, request_hash(endpoint, data, kwargs))
+            if replay is not None:
+                return json_response(replay)
+
+            response = None
+            try:
+                response = await view(request, user, data, **kwargs)
+                return response
+            finally:
+                # Also when the client disconnected and the view was cancelled, so the key is released
+                await sync_to_async(complete)(user, key, response)
+        return wrapper
+    return decorator
@@ -0,0 +1,238 @@
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import background_job
+
+logger = logging.getLogger(__name__)
+
+# Maps a job kind to the dotted path of the function that runs it.
+# Handlers take the claimed job and return a JSON-serialisable result.
+JOB_HANDLERS = {
+    'process_pdf': 'openAI_api.tasks.process_pdf_job',
+    'generate_decks': 'openAI_api.tasks.generate_decks_job',
+    'pregenerate_note': 'openAI_api.tasks.pregenerate_note_job',
+}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying the job cannot help."""
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_job(kind, payload=None, user=None, priority=0, max_attempts=None):
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+
+    job = background_job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        user=user,
+        priority=priority,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS
+    )
+
+    # Without a worker running (local development) the job runs in-process once the row is committed
+    if settings.JOB_RUN_EAGERLY:
+        transaction.on_commit(lambda: run_eagerly(job.id))
+
+    return job
+
+
+def run_eagerly(job_id):
+    job = claim_job(job_id, worker_id=f'eager:{default_worker_id()}')
+    if job is not None:
+        run_job(job)
+
+
+def _claimable(now):
+    # Queued jobs that are due, plus running jobs whose worker lost its lease
+    return background_job.objects.filter(
+        Q(status=background_job.STATUS_QUEUED, run_after__lte=now) |
+        Q(status=background_job.STATUS_RUNNING, lease_expires_at__lt=now)
+    )
+
+
+def _lease_fields(worker_id, now):
+    return {
+        'status': background_job.STATUS_RUNNING,
+        'locked_by': worker_id,
+        'lease_expires_at': now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+        'started_at': now,
+    }
+
+
+def claim_next_job(worker_id, kinds=None):
+    now = timezone.now()
+    candidates = _claimable(now).order_by('-priority', 'run_after', 'id')
+    if kinds:
+        candidates = candidates.filter(kind__in=kinds)
+
+    if connection.features.has_select_for_update_skip_locked:
+        # Postgres: rows locked by other workers are skipped rather than waited on
+        with transaction.atomic():
+            job = candidates.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            for field, value in _lease_fields(worker_id, now).items():
+                setattr(job, field, value)
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_by', 'lease_expires_at', 'started_at', 'attempts'])
+            return job
+
+    # SQLite has no row locks, so each candidate is claimed with a conditional UPDATE;
+    # the database serialises writers and only one worker sees a row count of 1
+    for job_id in candidates.values_list('id', flat=True)[:settings.JOB_CLAIM_BATCH_SIZE]:
+        job = claim_job(job_id, worker_id, now=now)
+        if job is not None:
+            return job
+    return None
+
+
+def claim_job(job_id, worker_id, now=None):
+    now = now or timezone.now()
+    claimed = _claimable(now).filter(id=job_id).update(
+        attempts=F('attempts') + 1,
+        **_lease_fields(worker_id, now)
+    )
+    if not claimed:
+        return None
+    return background_job.objects.get(id=job_id)
+
+
+def extend_lease(job):
+    # Long-running handlers call this so their lease does not expire mid-job
+    now = timezone.now()
+    return background_job.objects.filter(
+        id=job.id,
+        locked_by=job.locked_by,
+        status=background_job.STATUS_RUNNING
+    ).update(lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS)) == 1
+
+
+def report_progress(job, progress):
+    # Records progress and extends the lease; False means the lease was lost and the handler should stop
+    job.progress = progress
+    now = timezone.now()
+    return background_job.objects.filter(
+        id=job.id,
+        locked_by=job.locked_by,
+        status=background_job.STATUS_RUNNING
+    ).update(progress=progress, lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS)) == 1
+
+
+def cancel_job(job_id, user=None):
+    # A queued job is never claimed again; a running handler sees report_progress()
+    # return False at its next checkpoint, and its outcome is not recorded
+    jobs = background_job.objects.filter(
+        id=job_id,
+        status__in=[background_job.STATUS_QUEUED, background_job.STATUS_RUNNING]
+    )
+    if user is not None:
+        jobs = jobs.filter(user=user)
+    return jobs.update(
+        status=background_job.STATUS_CANCELLED,
+        locked_by=None,
+        lease_expires_at=None,
+        finished_at=timezone.now()
+    ) == 1
+
+
+def cancellation_check(job):
+    # For governor.cancel_when: handlers call it before every completion, from their
+    # thread pools too, so the job row is written at most every JOB_CANCEL_POLL_SECONDS.
+    # Each poll also extends the lease, so a long map-reduce keeps its job; the check
+    # turns true once the job is cancelled or its lease has passed to another worker
+    lock = threading.Lock()
+    state = {'checked_at': time.monotonic(), 'cancelled': False}
+
+    def check():
+        with lock:
+            now = time.monotonic()
+            if not state['cancelled'] and now - state['checked_at'] >= settings.JOB_CANCEL_POLL_SECONDS:
+                state['checked_at'] = now
+                state['cancelled'] = not extend_lease(job)
+            return state['cancelled']
+    return check
+
+
+def _finish(job, **fields):
+    # Only the lease holder may record the outcome; a worker whose lease was
+    # taken over by another one must not overwrite the newer attempt
+    fields.setdefault('locked_by', None)
+    fields.setdefault('lease_expires_at', None)
+    return background_job.objects.filter(
+        id=job.id,
+        locked_by=job.locked_by,
+        status=background_job.STATUS_RUNNING
+    ).update(**fields) == 1
+
+
+def run_job(job):
+    if job.attempts > job.max_attempts:
+        _finish(job, status=background_job.STATUS_FAILED, error='Maximum attempts exceeded', finished_at=timezone.now())
+        return
+
+    try:
+        handler = import_string(JOB_HANDLERS[job.kind])
+        result = handler(job)
+    except Exception as e:
+        retry = not isinstance(e, PermanentJobError) and job.attempts < job.max_attempts
+        logger.error(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {str(e)}")
+        logger.debug(traceback.format_exc())
+        if retry:
+            backoff = settings.JOB_RETRY_BACKOFF_SECONDS * (2 ** (job.attempts - 1))
+            _finish(job, status=background_job.STATUS_QUEUED, error=str(e),
+                    run_after=timezone.now() + timedelta(seconds=backoff))
+        else:
+            _finish(job, status=background_job.STATUS_FAILED, error=str(e), finished_at=timezone.now())
+        return
+
+    _finish(job, status=background_job.STATUS_SUCCEEDED, result=result, error=None, finished_at=timezone.now())
+
+
+def work(worker_id=None, kinds=None, burst=False, poll_interval=None, max_jobs=None):
+    worker_id = worker_id or default_worker_id()
+    poll_interval = poll_interval if poll_interval is not None else settings.JOB_POLL_INTERVAL_SECONDS
+    processed = 0
+
+    while max_jobs is None or processed < max_jobs:
+        job = claim_next_job(worker_id, kinds=kinds)
+        if job is None:
+            if burst:
+                break
+            time.sleep(poll_interval)
+            continue
+        logger.info(f"Worker {worker_id} running job {job.id} ({job.kind})")
+        run_job(job)
+        processed += 1
+
+    return processed
+
+
+def serialize_job(job):
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'progress': job.progress,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from api.models import chat_message, flashcard, note, notebook_note, notebook_page
+from api.notebook_pages import pages_in_order
+
+
+class Command(BaseCommand):
+    help = ('Runs EXPLAIN on the hot list queries and checks that each uses the index added for it. '
+            'On PostgreSQL sequential scans are disabled by default, because on a small database the planner '
+            'rightly prefers them; pass --allow-seqscan against production-sized data')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow-seqscan', action='store_true')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only failing ones')
+
+    def sample_ids(self):
+        # The busiest user and note give realistic plans; 0 still plans correctly on an empty database
+        user_id = note.objects.values('user_id').annotate(n=Count('id')).order_by('-n').values_list('user_id', flat=True).first() or 0
+        note_id = chat_message.objects.values('note_id').annotate(n=Count('id')).order_by('-n').values_list('note_id', flat=True).first() or 0
+        page_id = notebook_note.objects.values_list('notebook_page_id', flat=True).first() or 0
+        return user_id, note_id, page_id
+
+    def checks(self):
+        user_id, note_id, page_id = self.sample_ids()
+        return [
+            ('notes list', 'note_user_created_idx',
+             note.objects.filter(user_id=user_id).order_by('-created_at', '-id')[:50]),
+            ('flashcard deck', 'flashcard_user_note_idx',
+             flashcard.objects.filter(user_id=user_id, note_id=note_id).order_by('-created_at', '-id')[:50]),
+            ('chat history', 'chat_message_note_created_idx',
+             chat_message.objects.filter(note_id=note_id).order_by('created_at')),
+            ('notebook sidebar notes', 'notebook_note_page_sidebar_idx',
+             notebook_note.objects.filter(notebook_page_id=page_id, sidebar=True)),
+            ('notebook pages in order', 'notebook_page_user_rank_idx',
+             pages_in_order(user_id)),
+            ('notebook page by number', 'notebook_page_user_pos_idx',
+             notebook_page.objects.filter(user_id=user_id, position=5)),
+        ]
+
+    def handle(self, *args, **options):
+        missing = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['allow_seqscan']:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for label, index_name, queryset in self.checks():
+                plan = queryset.explain()
+                used = index_name in plan
+                if used:
+                    self.stdout.write(self.style.SUCCESS(f'{label}: uses {index_name}'))
+                else:
+                    missing.append(label)
+                    self.stdout.write(self.style.ERROR(f'{label}: does not use {index_name}'))
+                if options['verbose_plans'] or not used:
+                    self.stdout.write(f'    {str(queryset.query)}')
+                    for line in plan.splitlines():
+                        self.stdout.write(f'    {line}')
+
+        if missing:
+            raise CommandError(f"Query plans not using their index: {', '.join(missing)}")
@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from api.deletion import delete_notes, delete_pdfs, delete_users
 from api.models import User, uploadPDF, note
 
 class Command(BaseCommand):
@@ -6,13 +7,13 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         # First delete all notes
-        note.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Successfully deleted all notes'))
-        
+        deleted, _ = delete_notes(note.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted all notes ({deleted} rows)'))
+
         # Then delete all PDFs
-        uploadPDF.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Successfully deleted all PDFs'))
-        
+        deleted, _ = delete_pdfs(uploadPDF.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted all PDFs ({deleted} rows)'))
+
         # Finally delete all users
-        User.objects.all().delete()
-        self.stdout.write(self.style.SUCCESS('Successfully deleted all users')) 
\ No newline at end of file
+        deleted, _ = delete_users(User.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'Successfully deleted all users ({deleted} rows)'))
@@ -0,0 +1,50 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.jobs import default_worker_id, work
+
+
+def _run_worker(worker_id, kinds, burst, poll_interval):
+    # Each process must open its own database connection
+    connections.close_all()
+    work(worker_id=worker_id, kinds=kinds, burst=burst, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Runs background job workers that claim queued jobs (PDF processing, etc.) from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes to run')
+        parser.add_argument('--kind', action='append', dest='kinds', help='Only run jobs of this kind (repeatable)')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Seconds to sleep when the queue is empty')
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        kinds = options['kinds']
+        burst = options['burst']
+        poll_interval = options['poll_interval']
+
+        if processes == 1:
+            processed = work(kinds=kinds, burst=burst, poll_interval=poll_interval)
+            self.stdout.write(self.style.SUCCESS(f'Worker finished after {processed} jobs'))
+            return
+
+        # Don't share the parent's connection with the children
+        connections.close_all()
+        workers = []
+        for index in range(processes):
+            worker_id = f'{default_worker_id()}-{index}'
+            process = multiprocessing.Process(target=_run_worker, args=(worker_id, kinds, burst, poll_interval))
+            process.start()
+            workers.append(process)
+        self.stdout.write(self.style.SUCCESS(f'Started {processes} job worker processes'))
+
+        try:
+            for process in workers:
+                process.join()
+        except KeyboardInterrupt:
+            for process in workers:
+                process.terminate()
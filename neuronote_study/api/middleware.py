@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+
+import django
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class QueryCountMiddleware:
+    """Reports the number of database queries a request made in response headers, when QUERY_COUNT_HEADERS is on.
+
+    Async views query from worker threads with their own connections, so only sync views are counted.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.get_response(request)
+        if not settings.QUERY_COUNT_HEADERS:
+            return self.get_response(request)
+
+        counter = QueryCounter()
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        # Streaming responses keep querying after this point; their headers only cover the view itself
+        response['X-DB-Query-Count'] = str(counter.count)
+        response['X-DB-Query-Time-Ms'] = f'{counter.duration * 1000:.1f}'
+        return response
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that can run in an async middleware chain.
+
+    A sync-only middleware makes Django run the whole chain, async views included, on a
+    thread per request, and a cancelled request could then not reach the view.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class CancelOnDisconnect:
+    """ASGI wrapper that cancels a request when its client disconnects before the response is complete.
+
+    Django 4.2 stops reading from the connection once it has the request body, so an async view
+    would keep awaiting OpenAI (and paying for it) after the student has navigated away.
+    Cancelling the request raises CancelledError in the view at its current await, which closes
+    the upstream request. Sync views run on a thread and finish regardless. Django 5.0 and later
+    do this themselves.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or django.VERSION >= (5, 0):
+            return await self.app(scope, receive, send)
+
+        body_read = asyncio.Event()
+        response_sent = False
+        disconnected = False
+
+        async def app_receive():
+            message = await receive()
+            if message['type'] != 'http.request' or not message.get('more_body'):
+                body_read.set()
+            return message
+
+        async def app_send(message):
+            nonlocal response_sent
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                # Servers report a disconnect once the response is complete; that one is not an abort
+                response_sent = True
+            await send(message)
+
+        handler = asyncio.ensure_future(self.app(scope, app_receive, send=app_send))
+
+        async def watch():
+            nonlocal disconnected
+            await body_read.wait()
+            message = await receive()
+            if message['type'] == 'http.disconnect' and not response_sent and not handler.done():
+                disconnected = True
+                logger.info(f"Client disconnected from {scope.get('path')}, cancelling the request")
+                handler.cancel()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
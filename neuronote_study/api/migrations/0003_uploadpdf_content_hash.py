@@ -0,0 +1,23 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_background_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadpdf',
+            name='byte_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadpdf',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_uploadpdf_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='extracted_text',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('page_count', models.IntegerField(default=0)),
+                ('byte_size', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Extracted Text',
+                'verbose_name_plural': 'Extracted Texts',
+            },
+        ),
+        migrations.CreateModel(
+            name='extracted_text_page',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_number', models.IntegerField()),
+                ('text', models.TextField(blank=True)),
+                ('byte_offset', models.BigIntegerField()),
+                ('byte_length', models.BigIntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pages', to='api.extracted_text')),
+            ],
+            options={
+                'ordering': ['page_number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='extracted_text_page',
+            constraint=models.UniqueConstraint(fields=('document', 'page_number'), name='unique_extracted_page'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_extracted_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='chunk_summary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_hash', models.CharField(max_length=64, unique=True)),
+                ('content_hash', models.CharField(blank=True, db_index=True, max_length=64, null=True)),
+                ('chunk_index', models.IntegerField(default=0)),
+                ('summary', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Chunk Summary',
+                'verbose_name_plural': 'Chunk Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_chunk_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='generation_metric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(max_length=64)),
+                ('mode', models.CharField(max_length=64)),
+                ('latency_ms', models.IntegerField()),
+                ('calls', models.IntegerField(default=0)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Generation Metric',
+                'verbose_name_plural': 'Generation Metrics',
+                'indexes': [models.Index(fields=['operation', 'mode'], name='metric_operation_mode_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_generation_metric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='llm_response_cache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('model', models.CharField(max_length=255)),
+                ('response', models.JSONField()),
+                ('size_bytes', models.IntegerField(default=0)),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'LLM Response Cache Entry',
+                'verbose_name_plural': 'LLM Response Cache Entries',
+                'indexes': [models.Index(fields=['last_used_at'], name='llm_cache_last_used_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 10:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_llm_response_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='chat_summary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary', models.TextField(blank=True, default='')),
+                ('summarized_through', models.IntegerField(default=0)),
+                ('summarized_messages', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('note', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='chat_summary', to='api.note')),
+            ],
+            options={
+                'verbose_name': 'Chat Summary',
+                'verbose_name_plural': 'Chat Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_chat_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='note_chunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.IntegerField()),
+                ('chunk_hash', models.CharField(max_length=64)),
+                ('source_hash', models.CharField(max_length=64)),
+                ('heading', models.CharField(blank=True, default='', max_length=255)),
+                ('text', models.TextField()),
+                ('vector', models.BinaryField()),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.note')),
+            ],
+            options={
+                'verbose_name': 'Note Chunk',
+                'verbose_name_plural': 'Note Chunks',
+                'ordering': ['chunk_index'],
+                'indexes': [models.Index(fields=['note', 'chunk_index'], name='note_chunk_position_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_note_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='background_job',
+            name='progress',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
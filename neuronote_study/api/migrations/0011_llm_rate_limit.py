@@ -0,0 +1,29 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_background_job_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='llm_rate_limit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True)),
+                ('request_allowance', models.FloatField()),
+                ('token_allowance', models.FloatField()),
+                ('refilled_at', models.FloatField()),
+                ('cooldown_until', models.FloatField(default=0)),
+                ('version', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'LLM Rate Limit',
+                'verbose_name_plural': 'LLM Rate Limits',
+            },
+        ),
+    ]
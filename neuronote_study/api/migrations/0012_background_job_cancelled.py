@@ -0,0 +1,18 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_llm_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='background_job',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='queued', max_length=16),
+        ),
+    ]
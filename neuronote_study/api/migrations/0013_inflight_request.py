@@ -0,0 +1,36 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:16
+
+from django.conf import settings
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_background_job_cancelled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='inflight_request',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flight_key', models.CharField(max_length=64, unique=True)),
+                ('endpoint', models.CharField(max_length=64)),
+                ('owner', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done')], default='running', max_length=16)),
+                ('lease_expires_at', models.DateTimeField()),
+                ('response_status', models.IntegerField(blank=True, null=True)),
+                ('response', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inflight_requests', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'In-flight Request',
+                'verbose_name_plural': 'In-flight Requests',
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:33
+
+import math
+
+from django.db import migrations, models
+
+from api.models import READING_WORDS_PER_MINUTE, note_preview
+
+
+def fill_text_stats(apps, schema_editor):
+    note = apps.get_model('api', 'note')
+    batch = []
+    for note_obj in note.objects.only('id', 'note_text').iterator(chunk_size=500):
+        note_obj.note_preview = note_preview(note_obj.note_text)
+        note_obj.word_count = len(note_obj.note_text.split())
+        note_obj.reading_time_minutes = math.ceil(note_obj.word_count / READING_WORDS_PER_MINUTE)
+        batch.append(note_obj)
+        if len(batch) == 500:
+            note.objects.bulk_update(batch, ['note_preview', 'word_count', 'reading_time_minutes'])
+            batch = []
+    note.objects.bulk_update(batch, ['note_preview', 'word_count', 'reading_time_minutes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_idempotency_record'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='note_preview',
+            field=models.CharField(blank=True, default='', max_length=241),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='reading_time_minutes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_text_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+# On PostgreSQL the indexes are built with CREATE INDEX CONCURRENTLY, so the tables
+# stay writable while they build; that cannot run inside a transaction, hence
+# atomic = False. Other databases get plain CREATE INDEX.
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0015_note_text_stats'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='chat_message',
+            index=models.Index(fields=['note', 'created_at'], name='chat_message_note_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='flashcard',
+            index=models.Index(fields=['user', 'note', '-created_at', '-id'], name='flashcard_user_note_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='note',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='note_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notebook_note',
+            index=models.Index(fields=['notebook_page', 'sidebar'], name='notebook_note_page_sidebar_idx'),
+        ),
+    ]
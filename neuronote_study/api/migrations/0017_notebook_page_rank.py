@@ -0,0 +1,86 @@
+# Generated by Django 4.2.20 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+RANK_STEP = 1 << 16
+
+
+def merge_duplicate_pages(apps, schema_editor):
+    # get_or_create could race and number two pages the same; the oldest one keeps its notes and theirs
+    notebook_page = apps.get_model('api', 'notebook_page')
+    notebook_note = apps.get_model('api', 'notebook_note')
+    duplicates = (
+        notebook_page.objects.values('user_id', 'page_number')
+        .annotate(count=models.Count('id'), keep=models.Min('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        extra = notebook_page.objects.filter(
+            user_id=duplicate['user_id'], page_number=duplicate['page_number']
+        ).exclude(id=duplicate['keep'])
+        notebook_note.objects.filter(notebook_page__in=extra).update(notebook_page_id=duplicate['keep'])
+        extra.delete()
+
+
+def ranks_from_page_numbers(apps, schema_editor):
+    # Same order as before, spaced out and numbered; titles that only repeated the
+    # number are cleared, since the number is now derived from the order
+    notebook_page = apps.get_model('api', 'notebook_page')
+    pages = notebook_page.objects.order_by('user_id', 'page_number', 'id').only('id', 'user_id', 'page_number', 'page_title')
+    batch, user_id, position = [], None, 0
+    for page in pages.iterator(chunk_size=1000):
+        if page.user_id != user_id:
+            user_id, position = page.user_id, 0
+        position += 1
+        page.rank = position * RANK_STEP
+        page.position = position
+        if page.page_title == f'Page {page.page_number}':
+            page.page_title = None
+        batch.append(page)
+        if len(batch) == 1000:
+            notebook_page.objects.bulk_update(batch, ['rank', 'position', 'page_title'])
+            batch = []
+    notebook_page.objects.bulk_update(batch, ['rank', 'position', 'page_title'])
+
+
+# Irreversible: merged duplicates are gone, and a cleared title cannot be told
+# apart from a page that never had one
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notebook_page',
+            name='rank',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='notebook_page',
+            name='page_number',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='notebook_page',
+            name='position',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(merge_duplicate_pages),
+        migrations.RunPython(ranks_from_page_numbers),
+        migrations.RemoveField(
+            model_name='notebook_page',
+            name='page_number',
+        ),
+        migrations.AddIndex(
+            model_name='notebook_page',
+            index=models.Index(fields=['user', 'rank', 'id'], name='notebook_page_user_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notebook_page',
+            index=models.Index(fields=['user', 'position'], name='notebook_page_user_pos_idx'),
+        ),
+    ]
@@ -1,9 +1,16 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+import math
 import random
+import re
 import string
 import uuid
 
+NOTE_PREVIEW_CHARS = 240
+READING_WORDS_PER_MINUTE = 200
+
 def generateRandomKey():
     # Use UUID for guaranteed uniqueness 
     return str(uuid.uuid4())
@@ -18,17 +25,19 @@ class User(AbstractUser):
         return self.username
 
     def delete(self, *args, **kwargs):
-        # First delete all notes
-        self.user_notes.all().delete()
-        # Then delete all PDFs
-        self.user_pdfs.all().delete()
-        # Finally delete the user
-        super().delete(*args, **kwargs)
+        # Notes, PDFs and everything under them go in bulk (see api/deletion.py)
+        from .deletion import delete_users
+        result = delete_users(User.objects.filter(pk=self.pk))
+        self.pk = None
+        return result
 
 class uploadPDF(models.Model):
     pdf_file = models.FileField(upload_to='pdf_files/')
     pdf_name = models.CharField(max_length=255, null=True, blank=True)
     pdf_key = models.CharField(max_length=36, default=generateRandomKey, unique=True)
+    # SHA-256 of the file contents; identical uploads share one stored file
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    byte_size = models.BigIntegerField(null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='user_pdfs')
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -40,14 +49,26 @@ class uploadPDF(models.Model):
         return self.pdf_file.name
     
     def delete(self, *args, **kwargs):
-        # Delete all related notes first
-        self.pdf_notes.all().delete()
-        # Then delete the PDF file and record
-        super().delete(*args, **kwargs)
+        # Its notes go too, and the stored file once no other upload shares it
+        from .deletion import delete_pdfs
+        result = delete_pdfs(uploadPDF.objects.filter(pk=self.pk))
+        self.pk = None
+        return result
+
+def note_preview(text, limit=NOTE_PREVIEW_CHARS):
+    # Plain text from the start of a markdown note, cut at a word boundary
+    plain = ' '.join(re.sub(r'[#*_`>|]+', ' ', text).split())
+    if len(plain) <= limit:
+        return plain
+    return plain[:limit].rsplit(' ', 1)[0] + '…'
 
 class note(models.Model):
     note_title = models.CharField(max_length=255, null=True, blank=True)
     note_text = models.TextField()
+    # Derived from note_text on save, so note lists never have to load the text itself
+    note_preview = models.CharField(max_length=NOTE_PREVIEW_CHARS + 1, blank=True, default='')
+    word_count = models.PositiveIntegerField(default=0)
+    reading_time_minutes = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_notes')
     note_key = models.ForeignKey(uploadPDF, on_delete=models.CASCADE, related_name='pdf_notes', db_constraint=False)
@@ -55,18 +76,105 @@ class note(models.Model):
     class Meta:
         verbose_name = 'Note'
         verbose_name_plural = 'Notes'
+        # Indexes here and below match the hot filters; see `manage.py check_query_plans`
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='note_user_created_idx')]
 
     def __str__(self):
         return self.note_title if self.note_title else self.note_text[:50]
 
+    def update_text_stats(self):
+        self.note_preview = note_preview(self.note_text)
+        self.word_count = len(self.note_text.split())
+        self.reading_time_minutes = math.ceil(self.word_count / READING_WORDS_PER_MINUTE)
+
+    def save(self, *args, **kwargs):
+        self.update_text_stats()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'note_text' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'note_preview', 'word_count', 'reading_time_minutes'}
+        super().save(*args, **kwargs)
+
     def delete(self, *args, **kwargs):
-        # Store reference to PDF before deletion
-        pdf = self.note_key
-        # Delete the note
-        super().delete(*args, **kwargs)
-        # Clean up any orphaned PDFs if needed
-        if pdf and not pdf.pdf_notes.exists():
-            pdf.delete()
+        # Also removes the PDF if this was its last note
+        from .deletion import delete_notes
+        result = delete_notes(note.objects.filter(pk=self.pk))
+        self.pk = None
+        return result
+
+class extracted_text(models.Model):
+    # Text extracted from a PDF, shared by every upload with the same contents
+    content_hash = models.CharField(max_length=64, unique=True)
+    page_count = models.IntegerField(default=0)
+    byte_size = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Extracted Text'
+        verbose_name_plural = 'Extracted Texts'
+
+    def __str__(self):
+        return f'{self.content_hash} ({self.page_count} pages)'
+
+class extracted_text_page(models.Model):
+    document = models.ForeignKey(extracted_text, on_delete=models.CASCADE, related_name='pages')
+    page_number = models.IntegerField()
+    text = models.TextField(blank=True)
+    # Position of the page within the UTF-8 encoded document text
+    byte_offset = models.BigIntegerField()
+    byte_length = models.BigIntegerField()
+
+    class Meta:
+        ordering = ['page_number']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'page_number'], name='unique_extracted_page'),
+        ]
+
+class chunk_summary(models.Model):
+    # Intermediate "map" summary of one chunk of a long document, keyed by chunk contents and prompt
+    chunk_hash = models.CharField(max_length=64, unique=True)
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    chunk_index = models.IntegerField(default=0)
+    summary = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Chunk Summary'
+        verbose_name_plural = 'Chunk Summaries'
+
+class generation_metric(models.Model):
+    # Latency and token usage of one generation, used to compare generation modes
+    operation = models.CharField(max_length=64)
+    mode = models.CharField(max_length=64)
+    latency_ms = models.IntegerField()
+    calls = models.IntegerField(default=0)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Generation Metric'
+        verbose_name_plural = 'Generation Metrics'
+        indexes = [
+            models.Index(fields=['operation', 'mode'], name='metric_operation_mode_idx'),
+        ]
+
+class llm_response_cache(models.Model):
+    # Persistent tier of the completion cache, keyed by a hash of model, messages and sampling parameters
+    cache_key = models.CharField(max_length=64, unique=True)
+    model = models.CharField(max_length=255)
+    response = models.JSONField()
+    size_bytes = models.IntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'LLM Response Cache Entry'
+        verbose_name_plural = 'LLM Response Cache Entries'
+        indexes = [
+            models.Index(fields=['last_used_at'], name='llm_cache_last_used_idx'),
+        ]
 
 class flashcard(models.Model):
     flashcard_title = models.CharField(max_length=255, null=True, blank=True)
@@ -75,6 +183,9 @@ class flashcard(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_flashcards')
     note = models.ForeignKey(note, on_delete=models.CASCADE, related_name='note_flashcards', db_constraint=False)
 
+    class Meta:
+        indexes = [models.Index(fields=['user', 'note', '-created_at', '-id'], name='flashcard_user_note_idx')]
+
 class flashcard_answer(models.Model):
     flashcard_answer = models.ForeignKey(flashcard, on_delete=models.CASCADE, related_name='flashcard_answers')
     answer_text = models.TextField()
@@ -87,9 +198,43 @@ class chat_message(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_chat_messages')
     note = models.ForeignKey(note, on_delete=models.CASCADE, related_name='note_chat_messages', db_constraint=False)
 
+    class Meta:
+        indexes = [models.Index(fields=['note', 'created_at'], name='chat_message_note_created_idx')]
+
+class note_chunk(models.Model):
+    # One passage of a note with its local hashing-vector embedding, for chat retrieval
+    note = models.ForeignKey(note, on_delete=models.CASCADE, related_name='chunks')
+    chunk_index = models.IntegerField()
+    chunk_hash = models.CharField(max_length=64)
+    source_hash = models.CharField(max_length=64)
+    heading = models.CharField(max_length=255, blank=True, default='')
+    text = models.TextField()
+    vector = models.BinaryField()
+
+    class Meta:
+        ordering = ['chunk_index']
+        indexes = [models.Index(fields=['note', 'chunk_index'], name='note_chunk_position_idx')]
+        verbose_name = 'Note Chunk'
+        verbose_name_plural = 'Note Chunks'
+
+class chat_summary(models.Model):
+    # Running summary of a note's conversation, covering every chat_message up to summarized_through
+    note = models.OneToOneField(note, on_delete=models.CASCADE, related_name='chat_summary')
+    summary = models.TextField(blank=True, default='')
+    summarized_through = models.IntegerField(default=0)
+    summarized_messages = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Chat Summary'
+        verbose_name_plural = 'Chat Summaries'
+
 class notebook_page(models.Model):
     page_title = models.CharField(max_length=255, null=True, blank=True)
-    page_number = models.IntegerField()
+    # Sparse sort key; the page number shown is the position in this order (see api/notebook_pages.py)
+    rank = models.BigIntegerField(default=0)
+    # That position as of the last renumbering; NULL once a write has made it stale
+    position = models.IntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_notebooks')
 
@@ -102,6 +247,10 @@ class notebook_page(models.Model):
     class Meta:
         verbose_name = 'Notebook Page'
         verbose_name_plural = 'Notebook Pages'
+        indexes = [
+            models.Index(fields=['user', 'rank', 'id'], name='notebook_page_user_rank_idx'),
+            models.Index(fields=['user', 'position'], name='notebook_page_user_pos_idx'),
+        ]
 
 class notebook_note(models.Model):
     notebook_page = models.ForeignKey(notebook_page, on_delete=models.CASCADE, related_name='notebook_notes')
@@ -116,4 +265,118 @@ class notebook_note(models.Model):
     class Meta:
         verbose_name = 'Notebook Note'
         verbose_name_plural = 'Notebook Notes'
+        indexes = [models.Index(fields=['notebook_page', 'sidebar'], name='notebook_note_page_sidebar_idx')]
+
+
+class background_job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'),
+        (STATUS_FAILED, 'Failed'),
+        (STATUS_CANCELLED, 'Cancelled'),
+    ]
+
+    kind = models.CharField(max_length=64)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    priority = models.IntegerField(default=0)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='user_jobs')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # Lease held by the worker currently running the job; an expired lease means the worker died
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    result = models.JSONField(null=True, blank=True)
+    # Handler-reported progress; kept across retries so a retried job can skip finished work
+    progress = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Background Job'
+        verbose_name_plural = 'Background Jobs'
+        indexes = [
+            models.Index(fields=['status', 'priority', 'run_after'], name='job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.id} ({self.status})'
+
+
+class llm_rate_limit(models.Model):
+    # Token buckets shared by every worker process (see openAI_api/governor.py).
+    # Allowances are refilled lazily from refilled_at; version guards compare-and-swap updates
+    name = models.CharField(max_length=64, unique=True)
+    request_allowance = models.FloatField()
+    token_allowance = models.FloatField()
+    refilled_at = models.FloatField()
+    cooldown_until = models.FloatField(default=0)
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'LLM Rate Limit'
+        verbose_name_plural = 'LLM Rate Limits'
+
+
+class inflight_request(models.Model):
+    # Single-flight leases for LLM-backed endpoints (see openAI_api/single_flight.py). The owner holds the
+    # lease while the request runs; its response is then kept until expires_at for duplicates to share
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+    ]
+
+    flight_key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inflight_requests')
+    endpoint = models.CharField(max_length=64)
+    owner = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    lease_expires_at = models.DateTimeField()
+    response_status = models.IntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'In-flight Request'
+        verbose_name_plural = 'In-flight Requests'
+
 
+class idempotency_record(models.Model):
+    # Stored responses for POSTs sent with an Idempotency-Key header (see api/idempotency.py).
+    # request_hash catches a key reused for a different request; locked_until frees a key whose worker died
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_records')
+    key = models.CharField(max_length=255)
+    endpoint = models.CharField(max_length=64)
+    request_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_RUNNING)
+    locked_until = models.DateTimeField()
+    response_status = models.IntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = 'Idempotency Record'
+        verbose_name_plural = 'Idempotency Records'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
@@ -0,0 +1,146 @@
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import User, notebook_page
+
+# Pages are ordered by a sparse `rank`; the page number a student sees is the
+# page's position in that order. Inserting, deleting or moving a page writes
+# only that page's row: a new rank goes halfway between its neighbours' ranks,
+# and only when two neighbours have run out of room between them are the
+# user's ranks spread out again.
+#
+# Positions are stored too, so a page is found by its number with an index
+# seek. A write leaves a NULL position behind (on the new or moved page, or on
+# the page after a deleted one), and the first read after it renumbers the
+# user's pages in one UPDATE.
+
+RANK_STEP = 1 << 16
+
+
+def pages_in_order(user):
+    return notebook_page.objects.filter(user=user).order_by('rank', 'id')
+
+
+def _numbered(user_id):
+    # Positions are current unless some page of the user's has none
+    if not notebook_page.objects.filter(user_id=user_id, position__isnull=True).exists():
+        return
+    with transaction.atomic():
+        _lock_pages(user_id)
+        if notebook_page.objects.filter(user_id=user_id, position__isnull=True).exists():
+            rebalance(user_id)
+
+
+def page_at(user, number):
+    if number < 1:
+        return None
+    _numbered(user.id)
+    return notebook_page.objects.filter(user=user, position=number).first()
+
+
+def page_number(page):
+    _numbered(page.user_id)
+    return notebook_page.objects.filter(id=page.id).values_list('position', flat=True).get()
+
+
+def page_title(page, number):
+    # Untitled pages are named after their current position
+    return page.page_title or f'Page {number}'
+
+
+def _lock_pages(user_id):
+    # Serialises page edits for one user, so two inserts cannot take the same gap. A write to the
+    # user's row is a row lock on PostgreSQL and MySQL and takes the database write lock on SQLite,
+    # where select_for_update does nothing; either way it comes before the ranks are read
+    User.objects.filter(id=user_id).update(id=F('id'))
+
+
+def _rank_at(pages, number):
+    """A rank that puts a page at position `number` of `pages` (after the last page when None
+    or past the end), or None when the neighbours at that position leave no room."""
+    ranks = pages.values_list('rank', flat=True)
+    if number is not None and number <= 1:
+        first = ranks.first()
+        # Ranks may go below zero, so moving to the front never needs a rebalance
+        return first - RANK_STEP if first is not None else RANK_STEP
+    if number is not None:
+        neighbours = list(ranks[number - 2:number])
+        if len(neighbours) == 2:
+            before, after = neighbours
+            return (before + after) // 2 if after - before >= 2 else None
+    last = ranks.last()
+    return last + RANK_STEP if last is not None else RANK_STEP
+
+
+def rebalance(user_id):
+    """Number the user's pages in their current order and spread their ranks RANK_STEP apart, with one UPDATE."""
+    quote = connection.ops.quote_name
+    table = quote(notebook_page._meta.db_table)
+    rank = quote('rank')
+    position = quote('position')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET {position} = ordered.number, {rank} = ordered.number * %s FROM ('
+            f'SELECT id, ROW_NUMBER() OVER (ORDER BY {rank}, id) AS number FROM {table} WHERE user_id = %s'
+            f') AS ordered WHERE {table}.id = ordered.id',
+            [RANK_STEP, user_id]
+        )
+
+
+def _place(user_id, pages, number):
+    rank = _rank_at(pages, number)
+    if rank is None:
+        rebalance(user_id)
+        rank = _rank_at(pages, number)
+    return rank
+
+
+def _insert(user, number, title):
+    # Callers hold _lock_pages(user.id); the new page has no position until the next read
+    return notebook_page.objects.create(user=user, rank=_place(user.id, pages_in_order(user), number), page_title=title)
+
+
+def insert_page(user, number=None, title=None):
+    """Create a page at position `number`, moving later pages down one (appended when None or past the end)."""
+    if title == f'Page {number}':
+        title = None
+    with transaction.atomic():
+        _lock_pages(user.id)
+        return _insert(user, number, title)
+
+
+def get_or_insert_page(user, number):
+    """The page at `number`. The page just past the last one is added; a number beyond that gives None."""
+    page = page_at(user, number)
+    if page is not None or number < 1:
+        return page
+    with transaction.atomic():
+        _lock_pages(user.id)
+        # Looked up again under the lock, so concurrent requests for the same missing page add it once
+        page = page_at(user, number)
+        if page is not None:
+            return page
+        if number > 1 and not notebook_page.objects.filter(user=user, position=number - 1).exists():
+            return None
+        return _insert(user, None, None)
+
+
+def move_page(page, number):
+    with transaction.atomic():
+        _lock_pages(page.user_id)
+        others = pages_in_order(page.user_id).exclude(id=page.id)
+        page.rank = _place(page.user_id, others, number)
+        page.position = None
+        notebook_page.objects.filter(id=page.id).update(rank=page.rank, position=None)
+    return page
+
+
+def delete_page(page):
+    """Delete the page and return the number it had; later pages move up one."""
+    with transaction.atomic():
+        _lock_pages(page.user_id)
+        number = page_number(page)
+        page.delete()
+        # The next page's stored position is now one too high
+        notebook_page.objects.filter(user_id=page.user_id, position=number + 1).update(position=None)
+    return number
@@ -0,0 +1,156 @@
+import contextlib
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+
+# Uploaded PDFs are stored once per distinct content under their SHA-256 digest,
+# sharded so no single directory grows too large. On the filesystem storage (the
+# default) files are moved or written into place directly; other backends (S3 and
+# the like) go through the storage API instead.
+PDF_STORE_PREFIX = 'pdf_files/sha256'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def blob_name(digest):
+    return f'{PDF_STORE_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}.pdf'
+
+
+def local_path(name):
+    """Path of the stored file `name` on this machine, or None when the storage backend keeps files elsewhere."""
+    if not isinstance(default_storage, FileSystemStorage):
+        return None
+    return default_storage.path(name)
+
+
+def _hash_chunks(chunks):
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        hasher.update(chunk)
+        size += len(chunk)
+    return hasher.hexdigest(), size
+
+
+def _hash_path(path):
+    with open(path, 'rb') as source:
+        return _hash_chunks(iter(lambda: source.read(HASH_CHUNK_SIZE), b''))
+
+
+def content_hash(uploaded_file):
+    """(sha256 digest, byte size) of an upload, read in chunks once and remembered on the file."""
+    if not hasattr(uploaded_file, '_content_hash'):
+        if hasattr(uploaded_file, 'temporary_file_path'):
+            uploaded_file._content_hash = _hash_path(uploaded_file.temporary_file_path())
+        else:
+            uploaded_file._content_hash = _hash_chunks(uploaded_file.chunks())
+    return uploaded_file._content_hash
+
+
+def _set_permissions(path):
+    if settings.FILE_UPLOAD_PERMISSIONS is not None:
+        os.chmod(path, settings.FILE_UPLOAD_PERMISSIONS)
+
+
+def _write_atomically(target, chunks):
+    # Write next to the target and rename so readers never see a partial file. The
+    # partial file's name is unique, since threads of one process may write the same target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    descriptor, partial = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.partial')
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(descriptor, 'wb') as destination:
+            for chunk in chunks:
+                hasher.update(chunk)
+                size += len(chunk)
+                destination.write(chunk)
+        _set_permissions(partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return hasher.hexdigest(), size
+
+
+def _save_to_storage(name, uploaded_file):
+    # Remote backends: upload unless the same content is already stored
+    if default_storage.exists(name):
+        return name
+    uploaded_file.seek(0)
+    # Two identical uploads racing here both upload, and the backend gives the second
+    # another name; it is still a complete copy, removed with its last upload
+    return default_storage.save(name, uploaded_file)
+
+
+def _store_temporary_file(uploaded_file):
+    # Large uploads are already on disk: hash them, then move them into place
+    temp_path = uploaded_file.temporary_file_path()
+    digest, size = content_hash(uploaded_file)
+    name = blob_name(digest)
+    target = local_path(name)
+
+    if target is None:
+        return _save_to_storage(name, uploaded_file), digest, size
+    if os.path.exists(target):
+        # Duplicate content, Django removes the temporary file at the end of the request
+        return name, digest, size
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.replace(temp_path, target)
+        _set_permissions(target)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # FILE_UPLOAD_TEMP_DIR is on another filesystem, fall back to a single copy
+        with open(temp_path, 'rb') as source:
+            _write_atomically(target, iter(lambda: source.read(HASH_CHUNK_SIZE), b''))
+    return name, digest, size
+
+
+def _store_in_memory_file(uploaded_file):
+    # Small uploads are already in memory, so hashing costs no I/O and duplicates are never written
+    digest, size = content_hash(uploaded_file)
+    name = blob_name(digest)
+    target = local_path(name)
+
+    if target is None:
+        return _save_to_storage(name, uploaded_file), digest, size
+    if not os.path.exists(target):
+        uploaded_file.seek(0)
+        _write_atomically(target, uploaded_file.chunks())
+    return name, digest, size
+
+
+def store_pdf(uploaded_file):
+    """Store an uploaded PDF by content, returning (storage name, sha256 digest, byte size)."""
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return _store_temporary_file(uploaded_file)
+    return _store_in_memory_file(uploaded_file)
+
+
+def hash_stored_file(field_file):
+    # Digest of a file stored before uploads were content-addressed
+    with field_file.open('rb') as source:
+        return _hash_chunks(source.chunks(HASH_CHUNK_SIZE))
+
+
+@contextlib.contextmanager
+def local_copy(name):
+    """A local path to the stored file `name`, for tools that need one (the PDF extractors).
+
+    Files on a remote backend are downloaded to a temporary file for the duration of the block.
+    """
+    path = local_path(name)
+    if path is not None:
+        yield path
+        return
+    with default_storage.open(name, 'rb') as source, tempfile.NamedTemporaryFile(suffix=os.path.splitext(name)[1]) as copy:
+        shutil.copyfileobj(source, copy, HASH_CHUNK_SIZE)
+        copy.flush()
+        yield copy.name
@@ -1,19 +1,139 @@
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
+from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.utils import timezone
 from datetime import timedelta
-from api.models import User, uploadPDF, note, flashcard, notebook_page, notebook_note
+from api.models import (
+    User, uploadPDF, note, flashcard, flashcard_answer, chat_message, notebook_page, notebook_note, background_job,
+    extracted_text_page, chunk_summary, generation_metric, llm_response_cache, chat_summary, note_chunk, llm_rate_limit,
+    inflight_request, idempotency_record
+)
+from rest_framework.authtoken.models import Token
+from api import idempotency, notebook_pages
+from api.jobs import cancel_job, cancellation_check, claim_next_job, enqueue_job, run_job
+from api.middleware import CancelOnDisconnect
+from api.storage import _write_atomically, hash_stored_file, local_copy, store_pdf
+from openAI_api import client as client_registry
+from openAI_api import extractors, governor, llm_cache, single_flight, tasks
+from openAI_api.completions import create_chat_completion
+from openAI_api.context import build_chat_context
+from openAI_api.flashcards import FlashcardFormatError, parse_flashcard_deck, save_flashcard_deck
+from openAI_api.fake_openai import FakeOpenAIServer
+from openAI_api.extractors import EXTRACTORS, extract_pages, split_page_ranges
+from openAI_api.management.commands.benchmark_extraction import build_sample_pdf
+from openAI_api.pagination import DEFAULT_PAGE_SIZE
+from openAI_api.retrieval import index_note, note_context, retrieve
+from openAI_api.streaming import achat_reply_events
+from openAI_api.summarize import chunk_pages, map_reduce_summary
+from openAI_api.tasks import schedule_note_pregeneration
+from openAI_api.text_cache import get_pdf_pages, get_pdf_text
+from openAI_api.tokens import estimate_message_tokens, estimate_tokens
+from openAI_api.util import generate_summary_and_title
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from asgiref.sync import sync_to_async
+from unittest import mock
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import httpx
+import openai
+import threading
+import time
+import json
 import os
+import shutil
+import tempfile
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import InMemoryStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from io import StringIO
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 
 User = get_user_model()
 
+class FakeCompletionClient:
+    """Stands in for openai.OpenAI, answering every completion from a callable."""
+
+    def __init__(self, reply=lambda kwargs: 'ok', fail_when=lambda kwargs: False):
+        self.calls = []
+        self.reply = reply
+        self.fail_when = fail_when
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.fail_when(kwargs):
+            raise RuntimeError('upstream error')
+        if kwargs.get('stream'):
+            return FakeStream(self.reply(kwargs), kwargs.get('model', 'test-model'))
+        return ChatCompletion.model_validate({
+            'id': f'chatcmpl-{len(self.calls)}',
+            'object': 'chat.completion',
+            'created': 0,
+            'model': kwargs.get('model', 'test-model'),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': self.reply(kwargs)}
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 5, 'total_tokens': 15}
+        })
+
+class FakeStream:
+    """Streams a reply word by word as chat.completion.chunk objects, ending with a usage chunk."""
+
+    def __init__(self, content, model):
+        self.closed = False
+        words = content.split(' ')
+        deltas = [word if index == 0 else ' ' + word for index, word in enumerate(words)]
+        self.chunks = [
+            ChatCompletionChunk.model_validate({
+                'id': 'chatcmpl-stream', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]
+            }) for delta in deltas
+        ]
+        self.chunks.append(ChatCompletionChunk.model_validate({
+            'id': 'chatcmpl-stream', 'object': 'chat.completion.chunk', 'created': 0, 'model': model, 'choices': [],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': len(deltas), 'total_tokens': 10 + len(deltas)}
+        }))
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+class AsyncFakeStream:
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def __aiter__(self):
+        for chunk in self.stream:
+            yield chunk
+
+    async def close(self):
+        self.stream.close()
+
 # User registration tests
+class AsyncFakeCompletionClient:
+    """FakeCompletionClient behind an async create(), standing in for openai.AsyncOpenAI."""
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        return self.fake._create(**kwargs)
+
 class RegistrationTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -233,6 +353,10 @@ class UsernameChangeTestCase(APITestCase):
 # PDF Upload & Processing tests
 class PDFUploadTestCase(APITestCase):
     def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+
         self.user = User.objects.create_user(
             username='testuser',
             email='testuser@example.com',
@@ -249,6 +373,8 @@ class PDFUploadTestCase(APITestCase):
 
     def tearDown(self):
         # Clean up test files
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
         if os.path.exists(self.test_pdf_path):
             os.remove(self.test_pdf_path)
         if os.path.exists('test_files'):
@@ -261,9 +387,105 @@ class PDFUploadTestCase(APITestCase):
                 {'pdf_file': pdf_file},
                 format='multipart'
             )
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         self.assertIn('message', response.data)
 
+        # Note generation is queued for this upload rather than run in the request
+        job = background_job.objects.get(id=response.data['job_id'])
+        self.assertEqual(job.kind, 'process_pdf')
+        self.assertEqual(job.status, background_job.STATUS_QUEUED)
+        self.assertEqual(job.payload['pdf_id'], uploadPDF.objects.get(user=self.user).id)
+
+    def test_retry_with_idempotency_key_replays_the_upload(self):
+        responses = []
+        for _ in range(2):
+            with open(self.test_pdf_path, 'rb') as pdf_file:
+                responses.append(self.client.post(self.upload_url, {'pdf_file': pdf_file}, format='multipart',
+                                                  headers={'Idempotency-Key': 'upload-1'}))
+        self.assertEqual(responses[1].status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(responses[1].data, responses[0].data)
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+        self.assertEqual(uploadPDF.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(background_job.objects.count(), 1)
+
+    def test_idempotency_key_reused_for_another_file_of_the_same_size(self):
+        with open(self.test_pdf_path, 'rb') as pdf_file:
+            self.client.post(self.upload_url, {'pdf_file': pdf_file}, format='multipart', headers={'Idempotency-Key': 'upload-1'})
+        with open(self.test_pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n%Test PDF CONTENT')
+        with open(self.test_pdf_path, 'rb') as pdf_file:
+            response = self.client.post(self.upload_url, {'pdf_file': pdf_file}, format='multipart', headers={'Idempotency-Key': 'upload-1'})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(uploadPDF.objects.filter(user=self.user).count(), 1)
+
+    def test_duplicate_upload_shares_stored_file(self):
+        responses = []
+        for _ in range(2):
+            with open(self.test_pdf_path, 'rb') as pdf_file:
+                responses.append(self.client.post(self.upload_url, {'pdf_file': pdf_file}, format='multipart'))
+        self.assertTrue(all(r.status_code == status.HTTP_202_ACCEPTED for r in responses))
+
+        first, second = uploadPDF.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(first.pdf_file.name, second.pdf_file.name)
+        self.assertEqual(first.byte_size, os.path.getsize(self.test_pdf_path))
+        self.assertTrue(first.pdf_file.name.endswith(f'{first.content_hash}.pdf'))
+        self.assertEqual(len(os.listdir(os.path.dirname(first.pdf_file.path))), 1)
+
+    def test_failed_insert_removes_the_stored_file(self):
+        with open(self.test_pdf_path, 'rb') as pdf_file, \
+                mock.patch('api.views.enqueue_job', side_effect=RuntimeError('queue unavailable')):
+            response = self.client.post(self.upload_url, {'pdf_file': pdf_file}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(uploadPDF.objects.exists())
+        stored = [files for _, _, files in os.walk(self.media_root) if files]
+        self.assertEqual(stored, [])
+
+    def test_concurrent_writes_of_one_file_use_separate_partial_files(self):
+        target = os.path.join(self.media_root, 'shared.pdf')
+        started, resume, errors = threading.Event(), threading.Event(), []
+
+        def slow_chunks():
+            yield b'%PDF-1.4 '
+            started.set()
+            resume.wait(5)
+            yield b'first'
+
+        def write_slowly():
+            try:
+                _write_atomically(target, slow_chunks())
+            except Exception as e:
+                errors.append(e)
+
+        # Another thread writes the same file while the first is half way through
+        writer = threading.Thread(target=write_slowly)
+        writer.start()
+        started.wait(5)
+        _write_atomically(target, [b'%PDF-1.4 second'])
+        resume.set()
+        writer.join()
+
+        self.assertEqual(errors, [])
+        with open(target, 'rb') as written:
+            self.assertEqual(written.read(), b'%PDF-1.4 first')
+        self.assertEqual(os.listdir(self.media_root), ['shared.pdf'])
+
+    def test_storage_without_local_paths(self):
+        # InMemoryStorage has no path(), like S3 and other remote backends
+        remote = InMemoryStorage()
+        content = b'%PDF-1.4\n%Remote PDF content'
+        with mock.patch('api.storage.default_storage', remote):
+            names = [store_pdf(SimpleUploadedFile('notes.pdf', content))[0] for _ in range(2)]
+            self.assertEqual(names[0], names[1])
+            self.assertEqual(remote.open(names[0]).read(), content)
+            with local_copy(names[0]) as path, open(path, 'rb') as copy:
+                self.assertEqual(copy.read(), content)
+
+            remote.save('legacy.pdf', ContentFile(content))
+            stored = uploadPDF(pdf_file='legacy.pdf', user=self.user)
+            stored.pdf_file.storage = remote
+            self.assertEqual(hash_stored_file(stored.pdf_file), (hashlib.sha256(content).hexdigest(), len(content)))
+
     def test_upload_pdf_no_file(self):
         response = self.client.post(self.upload_url, {}, format='multipart')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -279,6 +501,1207 @@ class PDFUploadTestCase(APITestCase):
             )
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
+# Background job tests
+class JobQueueTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='testuser@example.com',
+            password='testpassword'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            email='otheruser@example.com',
+            password='testpassword'
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_claim_is_exclusive(self):
+        job = enqueue_job('process_pdf', payload={'pdf_id': 1}, user=self.user)
+        claimed = claim_next_job('worker-1')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.status, background_job.STATUS_RUNNING)
+        self.assertEqual(claimed.attempts, 1)
+        # A second worker must not get the same job while the lease is held
+        self.assertIsNone(claim_next_job('worker-2'))
+
+    def test_expired_lease_is_reclaimed(self):
+        job = enqueue_job('process_pdf', payload={'pdf_id': 1}, user=self.user)
+        claim_next_job('worker-1')
+        background_job.objects.filter(id=job.id).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        reclaimed = claim_next_job('worker-2')
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.locked_by, 'worker-2')
+        self.assertEqual(reclaimed.attempts, 2)
+
+    @override_settings(JOB_CANCEL_POLL_SECONDS=0)
+    def test_completions_renew_the_lease_until_it_is_lost(self):
+        job = enqueue_job('process_pdf', payload={'pdf_id': 1}, user=self.user)
+        job = claim_next_job('worker-1')
+        background_job.objects.filter(id=job.id).update(lease_expires_at=timezone.now() + timedelta(seconds=1))
+        check = cancellation_check(job)
+        self.assertFalse(check())
+        job.refresh_from_db()
+        self.assertGreater(job.lease_expires_at, timezone.now() + timedelta(seconds=60))
+
+        # Once another worker holds the lease this one sends no more completions
+        background_job.objects.filter(id=job.id).update(locked_by='worker-2')
+        self.assertTrue(check())
+
+    def test_retry_reuses_the_note_of_an_earlier_attempt(self):
+        pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        job = enqueue_job('process_pdf', payload={'pdf_id': pdf.id}, user=self.user)
+        earlier = note.objects.create(note_title='Cells', note_text='Mitochondria make ATP.', user=self.user, note_key=pdf)
+        with mock.patch('openAI_api.tasks.create_note_from_pdf') as create:
+            run_job(claim_next_job('worker-1'))
+        create.assert_not_called()
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_SUCCEEDED)
+        self.assertEqual(job.result['note_id'], earlier.id)
+        self.assertEqual(note.objects.filter(note_key=pdf).count(), 1)
+        self.assertTrue(note_chunk.objects.filter(note=earlier).exists())
+
+    def test_missing_pdf_fails_without_retry(self):
+        job = enqueue_job('process_pdf', payload={'pdf_id': 999}, user=self.user)
+        run_job(claim_next_job('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_FAILED)
+        self.assertEqual(job.error, 'PDF not found')
+        self.assertIsNone(job.locked_by)
+
+    def test_job_status(self):
+        job = enqueue_job('process_pdf', payload={'pdf_id': 1}, user=self.user)
+        response = self.client.get(reverse('job-status', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['job']['status'], background_job.STATUS_QUEUED)
+
+        # Other users can't see the job
+        self.client.force_authenticate(user=self.other_user)
+        response = self.client.get(reverse('job-status', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+# Extracted text cache tests
+class ExtractedTextCacheTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='testuser@example.com',
+            password='testpassword'
+        )
+        self.other_user = User.objects.create_user(
+            username='otheruser',
+            email='otheruser@example.com',
+            password='testpassword'
+        )
+
+    def test_text_is_extracted_once_per_content_hash(self):
+        first = uploadPDF.objects.create(pdf_file='a.pdf', content_hash='ab' * 32, user=self.user)
+        duplicate = uploadPDF.objects.create(pdf_file='b.pdf', content_hash='ab' * 32, user=self.other_user)
+
+        with mock.patch('openAI_api.text_cache.extract_pages', return_value=['Page one', 'Pagé two']) as extract:
+            self.assertEqual(get_pdf_text(first), 'Page one\n\nPagé two\n\n')
+            self.assertEqual(get_pdf_pages(first), ['Page one', 'Pagé two'])
+            self.assertEqual(get_pdf_pages(duplicate), ['Page one', 'Pagé two'])
+        self.assertEqual(extract.call_count, 1)
+
+        pages = extracted_text_page.objects.filter(document__content_hash='ab' * 32)
+        self.assertEqual([page.byte_offset for page in pages], [0, len('Page one\n\n')])
+        self.assertEqual(pages[1].byte_length, len('Pagé two\n\n'.encode('utf-8')))
+
+    def test_empty_document_is_cached(self):
+        pdf = uploadPDF.objects.create(pdf_file='a.pdf', content_hash='cd' * 32, user=self.user)
+        with mock.patch('openAI_api.text_cache.extract_pages', return_value=[]) as extract:
+            self.assertEqual(get_pdf_text(pdf), '')
+            self.assertEqual(get_pdf_text(pdf), '')
+        self.assertEqual(extract.call_count, 1)
+
+# PDF extraction backend tests
+class PDFExtractionTestCase(APITestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.pdf_path = os.path.join(self.work_dir, 'sample.pdf')
+        build_sample_pdf(self.pdf_path, 3, lines_per_page=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_backends_extract_every_page(self):
+        for backend in EXTRACTORS:
+            pages = extract_pages(self.pdf_path, backend=backend, workers=1)
+            self.assertEqual(len(pages), 3, backend)
+            self.assertIn('p2 l1', pages[1], backend)
+
+    @override_settings(PDF_EXTRACTION_MIN_PAGES_PER_WORKER=1, PDF_EXTRACTION_WORKERS=2)
+    def test_pool_is_shared_and_never_replaced(self):
+        # Threads still holding the pool must be able to submit to it
+        pages = extract_pages(self.pdf_path, backend='pypdfium2', workers=2)
+        pool = extractors._get_pool()
+        self.assertEqual(extract_pages(self.pdf_path, backend='pypdfium2', workers=3), pages)
+        self.assertIs(extractors._get_pool(), pool)
+        self.assertEqual(pool.submit(len, 'abc').result(), 3)
+
+    def test_page_ranges_cover_document(self):
+        self.assertEqual(split_page_ranges(10, 4, 25), [(0, 10)])
+        self.assertEqual(split_page_ranges(100, 4, 25), [(0, 25), (25, 50), (50, 75), (75, 100)])
+        self.assertEqual(split_page_ranges(101, 2, 25), [(0, 51), (51, 101)])
+        self.assertEqual(split_page_ranges(0, 4, 25), [])
+
+# Map-reduce summarization tests
+class MapReduceSummaryTestCase(APITestCase):
+    def setUp(self):
+        llm_cache.memory_cache.clear()
+
+    def test_chunks_follow_page_boundaries(self):
+        pages = ['a' * 400, 'b' * 400, 'c' * 400]
+        chunks = chunk_pages(pages, budget=250)
+        self.assertEqual([(c['first_page'], c['last_page']) for c in chunks], [(1, 2), (3, 3)])
+
+    def test_oversized_page_splits_at_headings(self):
+        page = '1. Introduction\n' + 'x' * 300 + '\n2. Methods\n' + 'y' * 300 + '\n'
+        chunks = chunk_pages([page], budget=100)
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0]['text'].startswith('1. Introduction'))
+        self.assertTrue(chunks[1]['text'].startswith('2. Methods'))
+
+    def test_map_summaries_survive_failed_reduce(self):
+        pages = [f'Page {i} ' + 'z' * 400 for i in range(4)]
+        is_reduce = lambda kwargs: 'consecutive sections' in kwargs['messages'][1]['content']
+
+        failing = FakeCompletionClient(reply=lambda kwargs: 'chunk summary', fail_when=is_reduce)
+        with override_settings(SUMMARY_CHUNK_TOKENS=120, SUMMARY_MAP_CONCURRENCY=2):
+            with self.assertRaises(RuntimeError):
+                map_reduce_summary(failing, pages, content_hash='ef' * 32)
+            self.assertEqual(chunk_summary.objects.filter(content_hash='ef' * 32).count(), 4)
+
+            # The retry only pays for the reduce call
+            retry = FakeCompletionClient(reply=lambda kwargs: 'final notes')
+            self.assertEqual(map_reduce_summary(retry, pages, content_hash='ef' * 32), 'final notes')
+        self.assertEqual(len(retry.calls), 1)
+
+# Note generation mode tests
+class NoteGenerationModeTestCase(APITestCase):
+    def setUp(self):
+        llm_cache.memory_cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='testuser@example.com',
+            password='testpassword'
+        )
+        self.pdf = uploadPDF.objects.create(pdf_file='a.pdf', content_hash='12' * 32, user=self.user)
+
+    def generate(self, mode, reply):
+        fake = FakeCompletionClient(reply=reply)
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            with mock.patch('openAI_api.text_cache.extract_pages', return_value=['Cover page', 'Body text']):
+                result = generate_summary_and_title(self.pdf, mode=mode)
+        return result, fake
+
+    def test_structured_mode_makes_one_call(self):
+        result, fake = self.generate('structured', lambda kwargs: json.dumps({'title': 'Cells', 'summary': 'All about cells'}))
+        self.assertEqual(result, {'text': 'All about cells', 'title': 'Cells'})
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(fake.calls[0]['response_format'], {'type': 'json_object'})
+
+        metric = generation_metric.objects.get(operation='note')
+        self.assertEqual((metric.mode, metric.calls, metric.prompt_tokens), ('structured', 1, 10))
+
+    def test_derived_mode_titles_from_summary(self):
+        result, fake = self.generate('derived', lambda kwargs: 'Summary' if kwargs['max_tokens'] > 30 else 'Title')
+        self.assertEqual(result, {'text': 'Summary', 'title': 'Title'})
+        self.assertNotIn('Body text', fake.calls[1]['messages'][1]['content'])
+        self.assertEqual(generation_metric.objects.get(operation='note').calls, 2)
+
+    # The cache lookups would run on the worker threads, which SQLite's test transaction locks out
+    @override_settings(LLM_CACHE_ENABLED=False)
+    def test_concurrent_mode_uses_the_shared_client(self):
+        result, fake = self.generate('concurrent', lambda kwargs: 'Summary' if kwargs['max_tokens'] > 30 else 'Title')
+        self.assertEqual(result, {'text': 'Summary', 'title': 'Title'})
+        # Both calls go through the pooled sync client; no event loop (or async client) is created per note
+        self.assertEqual(len(fake.calls), 2)
+        self.assertEqual(generation_metric.objects.get(operation='note').mode, 'concurrent')
+
+# Completion cache tests
+class CompletionCacheTestCase(APITestCase):
+    def setUp(self):
+        llm_cache.memory_cache.clear()
+        self.messages = [{'role': 'user', 'content': 'Explain osmosis'}]
+
+    def complete(self, client, **kwargs):
+        return create_chat_completion(client, model='test-model', messages=self.messages, temperature=0.7, **kwargs)
+
+    def test_identical_prompts_hit_memory_then_db(self):
+        client = FakeCompletionClient(reply=lambda kwargs: 'Water moves across a membrane')
+        first = self.complete(client)
+        self.assertEqual(self.complete(client).choices[0].message.content, first.choices[0].message.content)
+        self.assertEqual(len(client.calls), 1)
+
+        # A fresh process only has the database tier
+        llm_cache.memory_cache.clear()
+        cached = self.complete(client)
+        self.assertEqual(len(client.calls), 1)
+        self.assertIsNone(cached.usage)
+        self.assertEqual(llm_response_cache.objects.get().hits, 1)
+
+    def test_key_covers_sampling_params_and_ignores_whitespace(self):
+        key = llm_cache.cache_key('m', [{'role': 'user', 'content': ' hi\r\n'}], {'temperature': 0.7, 'timeout': 5})
+        self.assertEqual(key, llm_cache.cache_key('m', [{'role': 'user', 'content': 'hi'}], {'temperature': 0.7}))
+        self.assertNotEqual(key, llm_cache.cache_key('m', [{'role': 'user', 'content': 'hi'}], {'temperature': 0.2}))
+
+    def test_opt_out_and_expiry(self):
+        client = FakeCompletionClient()
+        self.complete(client, cache=False)
+        self.complete(client, cache=False)
+        self.assertEqual(len(client.calls), 2)
+        self.assertEqual(llm_response_cache.objects.count(), 0)
+
+        self.complete(client)
+        llm_cache.memory_cache.clear()
+        llm_response_cache.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.complete(client)
+        self.assertEqual(len(client.calls), 4)
+
+    @override_settings(LLM_CACHE_DB_MAX_BYTES=0)
+    def test_prune_evicts_least_recently_used(self):
+        self.complete(FakeCompletionClient())
+        self.assertEqual(llm_cache.prune(), 1)
+        self.assertEqual(llm_response_cache.objects.count(), 0)
+
+# Shared OpenAI client tests
+class OpenAIClientRegistryTestCase(APITestCase):
+    def setUp(self):
+        client_registry._reset_after_fork()
+
+    def tearDown(self):
+        client_registry._reset_after_fork()
+
+    @override_settings(OPENAI_API_KEY='test-key', OPENAI_MAX_CONNECTIONS=7)
+    def test_client_is_shared_within_process(self):
+        client = client_registry.get_client()
+        self.assertIs(client_registry.get_client(), client)
+        self.assertEqual(client._client._transport._pool._max_connections, 7)
+
+    @override_settings(OPENAI_API_KEY='test-key')
+    def test_client_is_rebuilt_after_fork(self):
+        client = client_registry.get_client()
+        with mock.patch('openAI_api.client.os.getpid', return_value=-1):
+            self.assertIsNot(client_registry.get_client(), client)
+
+    @override_settings(OPENAI_API_KEY='test-key')
+    def test_async_client_is_shared_per_event_loop(self):
+        async def fetch_twice():
+            return client_registry.get_async_client(), client_registry.get_async_client()
+
+        first, second = asyncio.run(fetch_twice())
+        self.assertIs(first, second)
+        third, _ = asyncio.run(fetch_twice())
+        self.assertIsNot(first, third)
+
+class ChatStreamTestCase(APITestCase):
+    def setUp(self):
+        llm_cache.memory_cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life', user=self.user, note_key=self.pdf)
+        chat_message.objects.create(message='What is a cell?', role='user', user=self.user, note=self.note)
+        chat_message.objects.create(message='The unit of life.', role='assistant', user=self.user, note=self.note)
+        self.client.force_authenticate(user=self.user)
+
+    def read_events(self, response):
+        body = b''.join(response.streaming_content).decode()
+        events = []
+        for block in body.strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    def test_deltas_are_streamed_and_reply_persisted(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'Mitochondria make ATP')
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            response = self.client.post('/openai/send-message/stream/', {'message': 'What do mitochondria do?', 'note_id': self.note.id}, format='json')
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            events = self.read_events(response)
+
+        self.assertEqual(''.join(data['content'] for event, data in events if event == 'delta'), 'Mitochondria make ATP')
+        self.assertEqual(events[-1][0], 'done')
+        self.assertEqual(chat_message.objects.filter(note=self.note).order_by('-id').first().message, 'Mitochondria make ATP')
+        self.assertEqual(chat_message.objects.filter(note=self.note).count(), 4)
+
+        # History plus the new question, each sent once
+        sent = fake.calls[0]['messages']
+        self.assertEqual([m['role'] for m in sent], ['system', 'user', 'assistant', 'user'])
+        self.assertIn('Cells are the unit of life', sent[0]['content'])
+
+    def test_upstream_error_is_reported_and_nothing_persisted(self):
+        fake = FakeCompletionClient(fail_when=lambda kwargs: True)
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            response = self.client.post('/openai/send-message/stream/', {'message': 'Hi', 'note_id': self.note.id}, format='json')
+            events = self.read_events(response)
+
+        self.assertEqual(events[-1][0], 'error')
+        self.assertFalse(chat_message.objects.filter(note=self.note, role='assistant', message='').exists())
+        self.assertEqual(chat_message.objects.filter(note=self.note, role='assistant').count(), 1)
+
+    async def test_async_view_streams_with_token_auth(self):
+        token = await Token.objects.acreate(user=self.user)
+        async def create(**kwargs):
+            return AsyncFakeStream(FakeStream('Mitochondria make ATP', kwargs['model']))
+
+        fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with mock.patch('openAI_api.util.get_async_client', return_value=fake):
+            response = await self.async_client.post(
+                '/openai/send-message/stream-async/', {'message': 'What do mitochondria do?', 'note_id': self.note.id},
+                content_type='application/json', headers={'Authorization': f'Token {token.key}'}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            # An async iterator is sent chunk by chunk under ASGI; a sync one would be read to the end first
+            self.assertTrue(response.is_async)
+            body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        self.assertIn('event: done', body)
+        reply = await chat_message.objects.filter(note=self.note, role='assistant').order_by('-id').afirst()
+        self.assertEqual(reply.message, 'Mitochondria make ATP')
+
+    def test_other_users_note_is_not_found(self):
+        other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        self.client.force_authenticate(user=other)
+        response = self.client.post('/openai/send-message/stream/', {'message': 'Hi', 'note_id': self.note.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_client_disconnect_closes_upstream_and_keeps_partial_reply(self):
+        streams = []
+        def create(**kwargs):
+            streams.append(FakeStream('Mitochondria make ATP', kwargs['model']))
+            return streams[-1]
+
+        fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            response = self.client.post('/openai/send-message/stream/', {'message': 'What do mitochondria do?', 'note_id': self.note.id}, format='json')
+            events = iter(response.streaming_content)
+            next(events)
+            # What the server does when writing to a closed connection fails
+            response.close()
+
+        self.assertTrue(streams[0].closed)
+        reply = chat_message.objects.filter(note=self.note).order_by('-id').first()
+        self.assertEqual((reply.role, reply.message), ('assistant', 'Mitochondria'))
+
+    async def test_cancel_before_any_reply_removes_the_question(self):
+        question = await chat_message.objects.acreate(message='Still there?', role='user', user=self.user, note=self.note)
+        waiting = asyncio.Event()
+        async def deltas():
+            waiting.set()
+            await asyncio.Event().wait()
+            yield 'never'
+
+        events = achat_reply_events(deltas(), self.user, self.note, question)
+        task = asyncio.ensure_future(events.__anext__())
+        await waiting.wait()
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertFalse(await chat_message.objects.filter(id=question.id).aexists())
+        self.assertEqual(await chat_message.objects.filter(note=self.note).acount(), 2)
+
+class CancelOnDisconnectTestCase(APITestCase):
+    async def call(self, app, messages):
+        sent = []
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        await CancelOnDisconnect(app)({'type': 'http', 'path': '/openai/send-message/async/'}, receive, send)
+        return sent
+
+    async def test_disconnect_cancels_the_request(self):
+        cancelled = asyncio.Event()
+        async def app(scope, receive, send):
+            await receive()
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        sent = await self.call(app, [{'type': 'http.request', 'body': b'{}'}, {'type': 'http.disconnect'}])
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(sent, [])
+
+    async def test_disconnect_after_the_response_is_ignored(self):
+        async def app(scope, receive, send):
+            await receive()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+            # Finishing up (closing the response) after the client has the whole body
+            await asyncio.sleep(0.01)
+
+        sent = await self.call(app, [{'type': 'http.request', 'body': b'{}'}, {'type': 'http.disconnect'}])
+        self.assertEqual(sent[-1]['body'], b'ok')
+
+@override_settings(CHAT_CONTEXT_TOKENS={'default': 3000}, CHAT_RECENT_MESSAGES=6, CHAT_SUMMARY_BATCH_MESSAGES=4)
+class ChatContextTestCase(APITestCase):
+    def setUp(self):
+        llm_cache.memory_cache.clear()
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life. ' * 50, user=self.user, note_key=self.pdf)
+        self.client.force_authenticate(user=self.user)
+
+    def reply(self, kwargs):
+        if 'running summary' in kwargs['messages'][0]['content']:
+            return 'Summary: the student asked about organelles. ' * 5
+        return 'Mitochondria make ATP through oxidative phosphorylation. ' * 10
+
+    def test_prompt_size_stays_bounded_over_a_long_session(self):
+        fake = FakeCompletionClient(reply=self.reply)
+        sizes = []
+        with mock.patch('openAI_api.util.get_client', return_value=fake), mock.patch('openAI_api.context.get_client', return_value=fake):
+            for turn in range(100):
+                response = self.client.post('/openai/send-message/', {'message': f'Question {turn} about organelles?', 'note_id': self.note.id}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                chat_call = fake.calls[-1]
+                sizes.append(estimate_message_tokens(chat_call['messages']))
+
+        self.assertEqual(chat_message.objects.filter(note=self.note).count(), 200)
+        self.assertLessEqual(max(sizes), 3000)
+        # Late turns cost about the same as early ones once the summary takes over
+        self.assertLess(max(sizes[50:]), max(sizes[:10]) * 1.5)
+
+        summary = chat_summary.objects.get(note=self.note)
+        self.assertGreater(summary.summarized_messages, 180)
+        last_prompt = fake.calls[-1]['messages']
+        self.assertIn('Summary of the earlier conversation', last_prompt[0]['content'])
+        self.assertEqual(last_prompt[-1]['content'], 'Question 99 about organelles?')
+        self.assertLessEqual(len(last_prompt), 2 + 6 + 4)
+
+    def test_short_conversations_are_sent_verbatim(self):
+        for index in range(4):
+            chat_message.objects.create(message=f'message {index}', role='user' if index % 2 == 0 else 'assistant', user=self.user, note=self.note)
+        messages = build_chat_context(self.note, 'next question')
+        self.assertEqual([m['content'] for m in messages[1:]], ['message 0', 'message 1', 'message 2', 'message 3', 'next question'])
+        self.assertFalse(chat_summary.objects.get(note=self.note).summary)
+
+class NoteRetrievalTestCase(APITestCase):
+    SECTIONS = {
+        'Photosynthesis': 'Chloroplasts capture light energy. Chlorophyll absorbs red and blue light and the Calvin cycle fixes carbon dioxide into glucose.',
+        'Cellular Respiration': 'Mitochondria oxidise glucose. Glycolysis, the Krebs cycle and oxidative phosphorylation produce ATP for the cell.',
+        'DNA Replication': 'Helicase unwinds the double helix and DNA polymerase copies each strand, proofreading as it goes.',
+        'Protein Synthesis': 'Ribosomes translate messenger RNA codons into amino acid chains with the help of transfer RNA.',
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Biology', note_text=self.note_text(), user=self.user, note_key=self.pdf)
+
+    def note_text(self, sections=None):
+        # Padded so the note is well over the full-text threshold
+        return '\n\n'.join(f'### {heading}\n' + ' '.join([body] * 16) for heading, body in (sections or self.SECTIONS).items())
+
+    def test_question_retrieves_matching_passages(self):
+        index_note(self.note)
+        passages = retrieve(self.note, 'How do mitochondria make ATP?', k=1)
+        self.assertEqual([chunk.heading for chunk in passages], ['Cellular Respiration'])
+
+        context = note_context(self.note, 'How do mitochondria make ATP?', token_budget=400)
+        self.assertIn('Title: Biology', context)
+        self.assertIn('- DNA Replication', context)
+        self.assertIn('oxidative phosphorylation', context)
+        self.assertNotIn('Calvin cycle', context)
+        self.assertLess(estimate_tokens(context), estimate_tokens(self.note.note_text) / 2)
+
+    def test_index_is_updated_incrementally(self):
+        self.assertEqual(index_note(self.note), note_chunk.objects.filter(note=self.note).count())
+        self.assertEqual(index_note(self.note), 0)
+
+        sections = dict(self.SECTIONS, **{'DNA Replication': 'Okazaki fragments are joined by ligase on the lagging strand.'})
+        self.note.note_text = self.note_text(sections)
+        self.note.save()
+        # Only the rewritten section is embedded again
+        self.assertEqual(index_note(self.note), note_chunk.objects.filter(note=self.note, heading='DNA Replication').count())
+        self.assertEqual(retrieve(self.note, 'What joins Okazaki fragments?', k=1)[0].heading, 'DNA Replication')
+
+    def test_chat_prompt_uses_server_side_note(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'Glycolysis comes first.')
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            response = self.client.post('/openai/send-message/', {
+                'message': 'Which step of cellular respiration comes first?', 'note_id': self.note.id, 'note_text': 'ignored'
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        system_prompt = fake.calls[0]['messages'][0]['content']
+        self.assertIn('Glycolysis', system_prompt)
+        self.assertNotIn('ignored', system_prompt)
+        self.assertTrue(note_chunk.objects.filter(note=self.note).exists())
+
+    def test_other_users_cannot_chat_over_the_note(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'Glycolysis comes first.')
+        other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        self.client.force_authenticate(user=other)
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            response = self.client.post('/openai/send-message/', {
+                'message': 'Which step of cellular respiration comes first?', 'note_id': self.note.id
+            }, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(fake.calls, [])
+        self.assertFalse(chat_message.objects.filter(note=self.note).exists())
+
+class FlashcardDeckTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life.', user=self.user, note_key=self.pdf)
+        self.client.force_authenticate(user=self.user)
+
+    def deck_reply(self, kwargs):
+        count = int(kwargs['messages'][1]['content'].split()[1])
+        return json.dumps({'flashcards': [
+            {'question': f'Question {i}?', 'options': [f'Option {i}-{j}' for j in range(5)], 'correct_index': i % 5}
+            for i in range(count)
+        ]})
+
+    def test_deck_is_one_completion_and_bulk_inserted(self):
+        fake = FakeCompletionClient(reply=self.deck_reply)
+        with mock.patch('openAI_api.flashcards.get_client', return_value=fake):
+            response = self.client.post('/openai/generate-flashcard-deck/', {'note_id': self.note.id, 'count': 20}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(fake.calls[0]['response_format'], {'type': 'json_object'})
+        self.assertEqual(len(response.data['flashcards']), 20)
+        self.assertEqual(flashcard.objects.filter(note=self.note).count(), 20)
+        self.assertEqual(flashcard_answer.objects.filter(flashcard_answer__note=self.note).count(), 100)
+        self.assertEqual(flashcard_answer.objects.filter(flashcard_answer__note=self.note, is_correct=True).count(), 20)
+        card = response.data['flashcards'][3]
+        self.assertEqual([answer['is_correct'] for answer in card['answers']], [False, False, False, True, False])
+
+    def test_save_uses_two_inserts(self):
+        deck = parse_flashcard_deck(self.deck_reply({'messages': [{}, {'content': 'Generate 20 cards'}]}), 20)
+        # Savepoint, flashcard INSERT, answer INSERT, release
+        with self.assertNumQueries(4):
+            save_flashcard_deck(self.user, self.note, deck)
+
+    def test_deck_listing_query_count_does_not_grow_with_the_deck(self):
+        deck = parse_flashcard_deck(self.deck_reply({'messages': [{}, {'content': 'Generate 40 cards'}]}), 40)
+        save_flashcard_deck(self.user, self.note, deck)
+        # Cards, then every answer on them
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/openai/get-flashcards/{self.note.id}/')
+        self.assertEqual(len(response.data['flashcards']), 40)
+        self.assertIsNone(response.data['next_cursor'])
+        card = next(card for card in response.data['flashcards'] if card['question'] == 'Question 3?')
+        self.assertEqual([answer['text'] for answer in card['answers']], [f'Option 3-{j}' for j in range(5)])
+        self.assertEqual(card['note'], self.note.id)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/openai/get-flashcards/{self.note.id}/', {'limit': 15})
+        self.assertEqual(len(response.data['flashcards']), 15)
+
+        # Without ?limit= the page is still bounded
+        save_flashcard_deck(self.user, self.note, parse_flashcard_deck(self.deck_reply({'messages': [{}, {'content': 'Generate 20 cards'}]}), 20))
+        response = self.client.get(f'/openai/get-flashcards/{self.note.id}/')
+        self.assertEqual(len(response.data['flashcards']), DEFAULT_PAGE_SIZE)
+        self.assertIsNotNone(response.data['next_cursor'])
+
+    def test_deck_pages_by_cursor(self):
+        for batch in range(3):
+            deck = parse_flashcard_deck(self.deck_reply({'messages': [{}, {'content': 'Generate 4 cards'}]}), 4)
+            save_flashcard_deck(self.user, self.note, deck)
+        expected = list(flashcard.objects.filter(note=self.note).order_by('-created_at', '-id').values_list('id', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 5, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(f'/openai/get-flashcards/{self.note.id}/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen += [card['id'] for card in response.data['flashcards']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        # Every card once and in order, across pages and batches
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(f'/openai/get-flashcards/{self.note.id}/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f'/openai/get-flashcards/{self.note.id}/', {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_malformed_cards_are_rejected(self):
+        content = json.dumps({'flashcards': [
+            {'question': 'Good?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 2},
+            {'question': 'Too few options?', 'options': ['a', 'b'], 'correct_index': 0},
+            {'question': 'Index out of range?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 5},
+            {'question': 'Boolean index?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': True},
+            {'question': 'Duplicate options?', 'options': ['a', 'a', 'c', 'd', 'e'], 'correct_index': 0},
+            {'question': '', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 0},
+        ]})
+        self.assertEqual([card['question'] for card in parse_flashcard_deck(content, 10)], ['Good?'])
+        with self.assertRaises(FlashcardFormatError):
+            parse_flashcard_deck('A. *4\nB. 5', 1)
+        with self.assertRaises(FlashcardFormatError):
+            parse_flashcard_deck(json.dumps({'flashcards': [{'question': 'Bad', 'options': []}]}), 1)
+
+    def test_single_card_endpoint_goes_through_the_deck(self):
+        fake = FakeCompletionClient(reply=self.deck_reply)
+        with mock.patch('openAI_api.flashcards.get_client', return_value=fake):
+            response = self.client.post('/openai/generate-flashcards/', {'note_id': self.note.id}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(response.data['flashcard']['question'], 'Question 0?')
+        self.assertEqual(len(response.data['flashcard']['answers']), 5)
+
+class NoteListTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='cells.pdf', user=self.user)
+        self.notes = [
+            note.objects.create(note_title=f'Cells {index}', note_text='## Cells\n**Mitochondria** make ATP. ' + 'word ' * 450, user=self.user, note_key=self.pdf)
+            for index in range(7)
+        ]
+        self.client.force_authenticate(user=self.user)
+
+    def test_text_stats_are_kept_up_to_date(self):
+        note_obj = self.notes[0]
+        self.assertTrue(note_obj.note_preview.startswith('Cells Mitochondria make ATP. word word'))
+        self.assertLessEqual(len(note_obj.note_preview), 241)
+        self.assertEqual((note_obj.word_count, note_obj.reading_time_minutes), (455, 3))
+
+        note_obj.note_text = 'Short note.'
+        note_obj.save(update_fields=['note_text'])
+        note_obj.refresh_from_db()
+        self.assertEqual((note_obj.note_preview, note_obj.word_count, note_obj.reading_time_minutes), ('Short note.', 2, 1))
+
+    def test_list_is_one_query_without_the_text(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/openai/notes/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['notes']), 7)
+        listed = response.data['notes'][0]
+        self.assertNotIn('note_text', listed)
+        self.assertEqual((listed['note_id'], listed['pdf_name'], listed['word_count']), (self.notes[-1].id, 'cells.pdf', 455))
+
+    def test_list_pages_by_cursor(self):
+        response = self.client.get('/openai/notes/', {'limit': 5})
+        self.assertEqual([n['note_id'] for n in response.data['notes']], [n.id for n in reversed(self.notes[2:])])
+        response = self.client.get('/openai/notes/', {'limit': 5, 'cursor': response.data['next_cursor']})
+        self.assertEqual([n['note_id'] for n in response.data['notes']], [self.notes[1].id, self.notes[0].id])
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_list_is_bounded_by_default(self):
+        note.objects.bulk_create([
+            note(note_title=f'Note {index}', note_text='Text', user=self.user, note_key=self.notes[0].note_key) for index in range(DEFAULT_PAGE_SIZE)
+        ])
+        response = self.client.get('/openai/notes/')
+        self.assertEqual(len(response.data['notes']), DEFAULT_PAGE_SIZE)
+        response = self.client.get('/openai/notes/', {'cursor': response.data['next_cursor']})
+        self.assertEqual(len(response.data['notes']), 7)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_detail_has_the_text(self):
+        response = self.client.get(f'/openai/notes/{self.notes[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['note']['note_text'], self.notes[0].note_text)
+        self.assertEqual(response.data['note']['pdf_id'], self.pdf.pdf_key)
+
+        other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        self.client.force_authenticate(user=other)
+        response = self.client.get(f'/openai/notes/{self.notes[0].id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+@override_settings(LLM_CACHE_ENABLED=False)
+class AsyncViewsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.token = Token.objects.create(user=self.user)
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life.', user=self.user, note_key=self.pdf)
+
+    def post(self, path, data, **headers):
+        return self.async_client.post(path, data, content_type='application/json',
+                                      headers={'Authorization': f'Token {self.token.key}', **headers})
+
+    async def test_send_message(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'A cell is the unit of life.')
+        with mock.patch('openAI_api.util.get_async_client', return_value=AsyncFakeCompletionClient(fake)):
+            response = await self.post('/openai/send-message/async/', {'note_id': self.note.id, 'message': 'What is a cell?'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {'status': 'success', 'message': 'A cell is the unit of life.'})
+        roles = [role async for role in chat_message.objects.filter(note=self.note).order_by('id').values_list('role', flat=True)]
+        self.assertEqual(roles, ['user', 'assistant'])
+
+    async def test_generate_flashcards(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: json.dumps({'flashcards': [
+            {'question': 'What is the unit of life?', 'options': ['Cell', 'Atom', 'Organ', 'Tissue', 'Gene'], 'correct_index': 0}
+        ]}))
+        with mock.patch('openAI_api.flashcards.get_async_client', return_value=AsyncFakeCompletionClient(fake)):
+            response = await self.post('/openai/generate-flashcards/async/', {'note_id': self.note.id})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['flashcard']['question'], 'What is the unit of life?')
+        self.assertEqual(await flashcard_answer.objects.filter(flashcard_answer__note=self.note).acount(), 5)
+
+    async def test_create_note(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'Cells' if kwargs['max_tokens'] == 30 else 'Cells are the unit of life.')
+        with mock.patch('openAI_api.util.get_pdf_text', return_value='Cells are the unit of life.'), \
+                mock.patch('openAI_api.util.get_async_client', return_value=AsyncFakeCompletionClient(fake)):
+            response = await self.post('/openai/create-note/async/', {'pdf_key': self.pdf.pdf_key})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = json.loads(response.content)
+        self.assertEqual((data['note_title'], data['note_text']), ('Cells', 'Cells are the unit of life.'))
+        # Summary and title requested together
+        self.assertEqual(len(fake.calls), 2)
+        self.assertTrue(await note_chunk.objects.filter(note_id=data['note_id']).aexists())
+        self.assertTrue(await generation_metric.objects.filter(operation='note', mode='concurrent').aexists())
+
+    @override_settings(SINGLE_FLIGHT_ENABLED=False)
+    async def test_idempotency_key_replays_across_sync_and_async_views(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'A cell is the unit of life.')
+        body = {'note_id': self.note.id, 'message': 'What is a cell?'}
+        with mock.patch('openAI_api.util.get_async_client', return_value=AsyncFakeCompletionClient(fake)):
+            first = await self.post('/openai/send-message/async/', body, **{'Idempotency-Key': 'key-1'})
+            replay = await self.post('/openai/send-message/async/', body, **{'Idempotency-Key': 'key-1'})
+            reused = await self.post('/openai/send-message/async/', {**body, 'message': 'What is DNA?'}, **{'Idempotency-Key': 'key-1'})
+
+        self.assertEqual(json.loads(replay.content), json.loads(first.content))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(await chat_message.objects.filter(note=self.note).acount(), 2)
+
+        # The sync view shares the records
+        self.client.force_authenticate(user=self.user)
+        response = await sync_to_async(self.client.post)('/openai/send-message/', body, format='json', headers={'Idempotency-Key': 'key-1'})
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+    @override_settings(SINGLE_FLIGHT_WAIT_SECONDS=5, SINGLE_FLIGHT_POLL_SECONDS=0.05)
+    async def test_concurrent_duplicates_share_one_completion(self):
+        fake = FakeCompletionClient(reply=lambda kwargs: 'A cell is the unit of life.')
+        release = asyncio.Event()
+
+        class SlowClient(AsyncFakeCompletionClient):
+            async def _create(self, **kwargs):
+                await release.wait()
+                return await super()._create(**kwargs)
+
+        body = {'note_id': self.note.id, 'message': 'What is a cell?'}
+        with mock.patch('openAI_api.util.get_async_client', return_value=SlowClient(fake)):
+            requests = [asyncio.ensure_future(self.post('/openai/send-message/async/', body)) for _ in range(2)]
+            await asyncio.sleep(0.3)
+            release.set()
+            first, second = await asyncio.gather(*requests)
+
+        self.assertEqual(json.loads(first.content), json.loads(second.content))
+        self.assertEqual(sorted(response.get('X-Single-Flight', '') for response in (first, second)), ['', 'shared'])
+        self.assertEqual(len(fake.calls), 1)
+
+    async def test_requires_token(self):
+        response = await self.async_client.post('/openai/send-message/async/', {'note_id': self.note.id, 'message': 'Hi'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+# Without the completion cache, so every call that is not coalesced reaches the client
+@override_settings(LLM_CACHE_ENABLED=False)
+class SingleFlightTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life.', user=self.user, note_key=self.pdf)
+        self.client.force_authenticate(user=self.user)
+        self.body = {'note_id': self.note.id, 'message': 'What is a cell?'}
+        self.key = single_flight.flight_key(self.user.id, 'send-message', self.body)
+
+    def send(self, fake):
+        with mock.patch('openAI_api.util.get_client', return_value=fake):
+            return self.client.post('/openai/send-message/', self.body, format='json')
+
+    def test_waiting_duplicate_shares_the_response(self):
+        # Another worker process is running the same request, and finishes while this one waits
+        self.assertTrue(single_flight.try_lead(self.key, self.user, 'send-message', 'other-worker'))
+        leader_response = Response({'status': 'success', 'message': 'A cell is the unit of life.'})
+
+        def leader_finishes(seconds):
+            single_flight.finish(self.key, 'other-worker', leader_response)
+
+        fake = FakeCompletionClient(reply=lambda kwargs: 'A cell is the unit of life.')
+        with mock.patch.object(single_flight.time, 'sleep', side_effect=leader_finishes):
+            shared = self.send(fake)
+        self.assertEqual(shared.data, leader_response.data)
+        self.assertEqual(shared['X-Single-Flight'], 'shared')
+        self.assertEqual(fake.calls, [])
+
+        # The same request sent after the flight finished is a repeat, and runs
+        repeat = self.send(fake)
+        self.assertEqual(repeat.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Single-Flight', repeat)
+        self.assertEqual(len(fake.calls), 1)
+        self.send(fake)
+        self.assertEqual(len(fake.calls), 2)
+
+    def test_failures_are_not_shared(self):
+        fake = FakeCompletionClient(fail_when=lambda kwargs: True)
+        self.assertEqual(self.send(fake).status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(inflight_request.objects.exists())
+        self.send(fake)
+        self.assertEqual(len(fake.calls), 2)
+
+    @override_settings(SINGLE_FLIGHT_SYNC_WAIT_SECONDS=0.3, SINGLE_FLIGHT_POLL_SECONDS=0.05)
+    def test_waits_for_the_leader_then_takes_over_its_lease(self):
+        # Another worker process is running the same request
+        self.assertTrue(single_flight.try_lead(self.key, self.user, 'send-message', 'other-worker'))
+        fake = FakeCompletionClient()
+        response = self.send(fake)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(fake.calls, [])
+
+        # The other worker died, so its lease is taken over
+        inflight_request.objects.update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.send(fake).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(fake.calls), 1)
+
+    def test_other_users_do_not_share(self):
+        other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        self.assertNotEqual(single_flight.flight_key(other.id, 'send-message', self.body), self.key)
+        self.assertNotEqual(single_flight.flight_key(self.user.id, 'generate-flashcards', self.body), self.key)
+        # Different Idempotency-Keys mark deliberately separate requests
+        self.assertNotEqual(single_flight.flight_key(self.user.id, 'send-message', self.body, idempotency_key='key-1'), self.key)
+
+@override_settings(LLM_CACHE_ENABLED=False, SINGLE_FLIGHT_ENABLED=False)
+class IdempotencyKeyTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='Cells are the unit of life.', user=self.user, note_key=self.pdf)
+        self.client.force_authenticate(user=self.user)
+        self.fake = FakeCompletionClient(reply=lambda kwargs: 'A cell is the unit of life.')
+
+    def send(self, message, key):
+        with mock.patch('openAI_api.util.get_client', return_value=self.fake):
+            return self.client.post('/openai/send-message/', {'note_id': self.note.id, 'message': message},
+                                    format='json', headers={'Idempotency-Key': key})
+
+    def test_replay_returns_the_stored_response(self):
+        first = self.send('What is a cell?', 'key-1')
+        replay = self.send('What is a cell?', 'key-1')
+        self.assertEqual(replay.status_code, status.HTTP_200_OK)
+        self.assertEqual(replay.data, first.data)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(self.fake.calls), 1)
+        self.assertEqual(chat_message.objects.filter(note=self.note).count(), 2)
+
+        # A new key is a new request
+        self.send('What is a cell?', 'key-2')
+        self.assertEqual(len(self.fake.calls), 2)
+
+    def test_key_reused_for_another_request(self):
+        self.send('What is a cell?', 'key-1')
+        response = self.send('What is DNA?', 'key-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(len(self.fake.calls), 1)
+
+    def test_key_in_progress_and_released_after_failure(self):
+        fingerprint = idempotency.request_hash('send-message', {'note_id': self.note.id, 'message': 'What is a cell?'})
+        self.assertIsNone(idempotency.begin(self.user, 'key-1', 'send-message', fingerprint))
+        self.assertEqual(self.send('What is a cell?', 'key-1').status_code, status.HTTP_409_CONFLICT)
+
+        # The first attempt's worker died; once its lock lapses the retry runs
+        idempotency_record.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.fake.fail_when = lambda kwargs: True
+        self.assertEqual(self.send('What is a cell?', 'key-1').status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(idempotency_record.objects.exists())
+
+        self.fake.fail_when = lambda kwargs: False
+        self.assertEqual(self.send('What is a cell?', 'key-1').status_code, status.HTTP_200_OK)
+
+    def test_expired_records_are_pruned(self):
+        self.send('What is a cell?', 'key-1')
+        idempotency_record.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(idempotency.prune(), 1)
+
+class DeckGenerationJobTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.notes = [
+            note.objects.create(note_title=title, note_text=f'{title} notes', user=self.user, note_key=self.pdf)
+            for title in ('Cells', 'Genetics', 'Ecology')
+        ]
+        self.page = notebook_page.objects.create(page_title='Biology', user=self.user)
+        for note_obj in self.notes[:2]:
+            notebook_note.objects.create(notebook_page=self.page, note=note_obj, text=note_obj.note_title)
+        self.client.force_authenticate(user=self.user)
+
+    def deck_reply(self, kwargs):
+        return json.dumps({'flashcards': [
+            {'question': f'Question {i}?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 0} for i in range(3)
+        ]})
+
+    def test_notebook_page_decks_survive_partial_failure(self):
+        response = self.client.post('/openai/generate-decks/', {'notebook_page_id': self.page.id, 'count': 3}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['note_count'], 2)
+        job = background_job.objects.get(id=response.data['job_id'])
+
+        broken = {'Genetics notes'}
+        fake = FakeCompletionClient(
+            reply=self.deck_reply,
+            fail_when=lambda kwargs: any(text in kwargs['messages'][1]['content'] for text in broken)
+        )
+        with mock.patch('openAI_api.flashcards.get_client', return_value=fake):
+            run_job(claim_next_job('worker-1'))
+            job.refresh_from_db()
+            # The successful deck is kept and the job is queued for a retry
+            self.assertEqual(job.status, background_job.STATUS_QUEUED)
+            self.assertEqual(job.progress['completed'], [self.notes[0].id])
+            self.assertIn(str(self.notes[1].id), job.progress['failed'])
+            self.assertEqual(flashcard.objects.filter(note=self.notes[0]).count(), 3)
+
+            broken.clear()
+            background_job.objects.filter(id=job.id).update(run_after=timezone.now())
+            run_job(claim_next_job('worker-1'))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_SUCCEEDED)
+        self.assertEqual(job.result['completed'], [self.notes[0].id, self.notes[1].id])
+        self.assertEqual(job.result['cards'], 6)
+        # Only the failed note was generated again, and the note off the page never was
+        self.assertEqual(len(fake.calls), 3)
+        self.assertEqual(flashcard.objects.filter(note=self.notes[0]).count(), 3)
+        self.assertFalse(flashcard.objects.filter(note=self.notes[2]).exists())
+
+    def test_only_own_notes_are_queued(self):
+        other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        self.client.force_authenticate(user=other)
+        response = self.client.post('/openai/generate-decks/', {'note_ids': [n.id for n in self.notes]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(background_job.objects.exists())
+
+@override_settings(NOTE_PREGENERATION=True, NOTE_PREGENERATION_DECK_SIZE=3)
+class NotePregenerationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.pdf = uploadPDF.objects.create(pdf_file='test.pdf', pdf_name='test.pdf', user=self.user)
+        self.note = note.objects.create(note_title='Cells', note_text='## Cells\nMitochondria make ATP.', user=self.user, note_key=self.pdf)
+        self.client.force_authenticate(user=self.user)
+        self.fake = FakeCompletionClient(reply=lambda kwargs: json.dumps({'flashcards': [
+            {'question': f'Question {i}?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 0} for i in range(3)
+        ]}))
+
+    def run_next_job(self):
+        with mock.patch('openAI_api.flashcards.get_client', return_value=self.fake):
+            run_job(claim_next_job('worker-1'))
+
+    def test_builds_index_and_starter_deck_once(self):
+        job = schedule_note_pregeneration(self.note)
+        # Queued behind jobs users are waiting on
+        enqueue_job('process_pdf', payload={'pdf_id': self.pdf.id}, user=self.user)
+        self.assertNotEqual(claim_next_job('worker-1').kind, 'pregenerate_note')
+
+        self.run_next_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_SUCCEEDED)
+        self.assertEqual(job.result, {'chat_index': 'ready', 'starter_deck': 3})
+        self.assertTrue(note_chunk.objects.filter(note=self.note).exists())
+
+        # A deck already exists, so a second run makes no completion
+        schedule_note_pregeneration(self.note)
+        self.run_next_job()
+        self.assertEqual(len(self.fake.calls), 1)
+        self.assertEqual(flashcard.objects.filter(note=self.note).count(), 3)
+
+    def test_cancel(self):
+        job = schedule_note_pregeneration(self.note)
+        response = self.client.post(reverse('cancel-job', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['job']['status'], background_job.STATUS_CANCELLED)
+        self.assertIsNone(claim_next_job('worker-1'))
+
+        response = self.client.post(reverse('cancel-job', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_cancel_while_running_discards_the_deck(self):
+        job = schedule_note_pregeneration(self.note)
+
+        def reply(kwargs):
+            cancel_job(job.id)
+            return json.dumps({'flashcards': [{'question': 'Q?', 'options': ['a', 'b', 'c', 'd', 'e'], 'correct_index': 0}]})
+
+        self.fake.reply = reply
+        self.run_next_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_CANCELLED)
+        self.assertIsNone(job.result)
+        self.assertFalse(flashcard.objects.filter(note=self.note).exists())
+
+    @override_settings(JOB_CANCEL_POLL_SECONDS=0)
+    def test_cancel_before_the_deck_completion_is_sent(self):
+        job = schedule_note_pregeneration(self.note)
+        real_report_progress = tasks.report_progress
+
+        def report_progress(running_job, progress):
+            recorded = real_report_progress(running_job, progress)
+            if 'chat_index' in progress:
+                # Cancelled just after the last check between steps
+                cancel_job(job.id)
+            return recorded
+
+        with mock.patch('openAI_api.tasks.report_progress', side_effect=report_progress):
+            self.run_next_job()
+        job.refresh_from_db()
+        self.assertEqual(job.status, background_job.STATUS_CANCELLED)
+        self.assertEqual(self.fake.calls, [])
+        self.assertFalse(flashcard.objects.filter(note=self.note).exists())
+
+@override_settings(GOVERNOR_REQUESTS_PER_MINUTE=10, GOVERNOR_TOKENS_PER_MINUTE=1000, GOVERNOR_BULK_RESERVE=0.5,
+                   GOVERNOR_NOTES_RESERVE=0.2, GOVERNOR_MAX_CONCURRENCY=4, GOVERNOR_BACKEND='local')
+class GovernorTestCase(APITestCase):
+    def setUp(self):
+        governor.reset_governor()
+        self.addCleanup(governor.reset_governor)
+
+    def test_cancelled_work_sends_no_completion(self):
+        fake = FakeCompletionClient()
+        with governor.cancel_when(lambda: True), self.assertRaises(governor.RequestCancelled):
+            create_chat_completion(fake, cache=False, model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'Hi'}])
+        self.assertEqual(fake.calls, [])
+
+    def test_reserve_keeps_capacity_for_chat(self):
+        store = governor.LocalBucketStore()
+        now = 1000.0
+        bulk = [store.try_acquire(10, 0.5, now) for _ in range(6)]
+        # Half of the 10 requests per minute are held back from bulk work
+        self.assertEqual(bulk[:5], [0] * 5)
+        self.assertGreater(bulk[5], 0)
+        self.assertEqual(store.try_acquire(10, 0.0, now), 0)
+        # Capacity refills over time
+        self.assertEqual(store.try_acquire(10, 0.5, now + 12), 0)
+
+    def test_database_store_is_shared_and_cools_down(self):
+        store = governor.DatabaseBucketStore()
+        now = time.time()
+        self.assertEqual(store.try_acquire(100, 0.0, now), 0)
+        row = llm_rate_limit.objects.get()
+        self.assertEqual(row.version, 1)
+        self.assertAlmostEqual(row.token_allowance, 900)
+        self.assertGreater(store.try_acquire(950, 0.0, now), 0)
+
+        store.cool_down(now + 30)
+        self.assertAlmostEqual(store.try_acquire(1, 0.0, now + 1), 29)
+
+    def test_priority_then_fair_share_order(self):
+        gov = governor.Governor(governor.LocalBucketStore())
+        gov.window = 1.0
+        gov.acquire(governor.PRIORITY_BULK, 'holder', 1)
+        order = []
+
+        def call(priority, user_id):
+            gov.acquire(priority, user_id, 1)
+            order.append(user_id)
+            gov.release(0.1)
+
+        threads = []
+        for priority, user_id in [(governor.PRIORITY_BULK, 'a'), (governor.PRIORITY_BULK, 'a'),
+                                  (governor.PRIORITY_BULK, 'b'), (governor.PRIORITY_INTERACTIVE, 'chat')]:
+            threads.append(threading.Thread(target=call, args=(priority, user_id)))
+            threads[-1].start()
+            while len(gov._waiters) < len(threads):
+                time.sleep(0.01)
+
+        gov.release(0.1)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ['chat', 'a', 'b', 'a'])
+
+    @override_settings(GOVERNOR_MAX_CONCURRENCY=1, GOVERNOR_MAX_WAIT_SECONDS=3)
+    def test_async_callers_wait_for_each_other_without_blocking_the_loop(self):
+        kwargs = {'model': 'test-model', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+        async def call():
+            async with governor.agoverned(kwargs):
+                await asyncio.sleep(0.2)
+
+        async def both():
+            await asyncio.gather(call(), call())
+
+        started = time.monotonic()
+        asyncio.run(both())
+        # The second caller waits for the first one's slot, not for GOVERNOR_MAX_WAIT_SECONDS
+        self.assertLess(time.monotonic() - started, 1.5)
+        self.assertEqual(governor.get_governor().in_flight, 0)
+
+    def test_rate_limit_halves_window_and_pauses(self):
+        request = httpx.Request('POST', 'https://api.openai.com/v1/chat/completions')
+        error = openai.RateLimitError('rate limited', response=httpx.Response(429, headers={'retry-after': '7'}, request=request), body=None)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=mock.Mock(side_effect=error))))
+
+        with self.assertRaises(openai.RateLimitError):
+            create_chat_completion(client, cache=False, model='test-model', messages=[{'role': 'user', 'content': 'hi'}])
+
+        gov = governor.get_governor()
+        self.assertEqual(gov.window, 2.0)
+        self.assertEqual(gov.in_flight, 0)
+        self.assertGreater(gov.store.try_acquire(1, 0.0, time.time()), 6)
+
+    def test_success_grows_window_and_charges_real_usage(self):
+        gov = governor.Governor(governor.LocalBucketStore())
+        gov.window = 2.0
+        gov.acquire(governor.PRIORITY_NOTES, 'a', 100)
+        gov.release(0.5, estimated_tokens=100, used_tokens=300)
+        self.assertEqual(gov.window, 2.5)
+        self.assertEqual(gov._token_debt, 200)
+
+        gov.acquire(governor.PRIORITY_NOTES, 'a', 100)
+        gov.release(60)
+        # Slow responses shrink the window
+        self.assertEqual(gov.window, 2.0)
+
+class FakeOpenAIServerTestCase(APITestCase):
+    def setUp(self):
+        self.server = FakeOpenAIServer(('127.0.0.1', 0), latency='fixed:0', tokens_per_second=1e6, seed=1)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.client_ = openai.OpenAI(api_key='fake-key', base_url=self.server.base_url, max_retries=0)
+
+    def test_completions_match_the_openai_shapes(self):
+        response = self.client_.chat.completions.create(
+            model='test-model',
+            messages=[{'role': 'user', 'content': 'Generate 3 multiple choice flashcards as JSON {"flashcards": [...]}'}],
+            response_format={'type': 'json_object'},
+        )
+        self.assertEqual(len(parse_flashcard_deck(response.choices[0].message.content, 5)), 3)
+        self.assertGreater(response.usage.total_tokens, 0)
+
+        stream = self.client_.chat.completions.create(
+            model='test-model', messages=[{'role': 'user', 'content': 'hi'}], max_tokens=20, stream=True,
+        )
+        text = ''.join(chunk.choices[0].delta.content or '' for chunk in stream if chunk.choices)
+        self.assertTrue(text.startswith('Cells are the basic unit of life.'))
+
+    def test_injected_rate_limits(self):
+        self.server.error_rate = 1.0
+        with self.assertRaises(openai.RateLimitError) as caught:
+            self.client_.chat.completions.create(model='test-model', messages=[{'role': 'user', 'content': 'hi'}])
+        self.assertEqual(caught.exception.response.headers['retry-after'], '1')
+        self.assertEqual(self.server.stats['rate_limited'], 1)
+
+    @override_settings(QUERY_COUNT_HEADERS=True)
+    def test_query_count_headers(self):
+        user = User.objects.create_user(username='counted', email='counted@example.com', password='testpassword')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(reverse('user'))
+        self.assertGreaterEqual(int(response['X-DB-Query-Count']), 1)
+        self.assertIn('X-DB-Query-Time-Ms', response)
+
 # Notes and Flashcards tests
 class NotesTestCase(APITestCase):
     def setUp(self):
@@ -348,6 +1771,75 @@ class NotesTestCase(APITestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+class DeletionTestCase(APITestCase):
+    BLOB = 'pdf_files/sha256/ab/cd/abcd.pdf'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.other = User.objects.create_user(username='otheruser', email='otheruser@example.com', password='testpassword')
+        Token.objects.create(user=self.user)
+        self.page = notebook_page.objects.create(user=self.user, rank=notebook_pages.RANK_STEP)
+        # Two uploads of the same file share one stored blob
+        self.pdf = uploadPDF.objects.create(pdf_file=self.BLOB, pdf_name='a.pdf', user=self.user)
+        self.other_pdf = uploadPDF.objects.create(pdf_file=self.BLOB, pdf_name='a.pdf', user=self.other)
+        self.other_note = self.make_note(self.other, self.other_pdf)
+
+    def make_note(self, user, pdf):
+        note_obj = note.objects.create(note_title='Cells', note_text='Cells are the unit of life.', user=user, note_key=pdf)
+        card = flashcard.objects.create(flashcard_question='What is a cell?', user=user, note=note_obj)
+        flashcard_answer.objects.create(flashcard_answer=card, answer_text='A unit of life', is_correct=True)
+        chat_message.objects.create(message='Hi', role='user', user=user, note=note_obj)
+        chat_summary.objects.create(note=note_obj)
+        note_chunk.objects.create(note=note_obj, chunk_index=0, chunk_hash='h', source_hash='s', text='Cells', vector=b'')
+        if user == self.user:
+            notebook_note.objects.create(notebook_page=self.page, note=note_obj, text='Cells')
+        return note_obj
+
+    def assert_only_other_user_left(self):
+        for model in (note, flashcard, flashcard_answer, chat_message, chat_summary, note_chunk):
+            self.assertEqual(model.objects.count(), 1, model.__name__)
+        self.assertFalse(notebook_note.objects.exists())
+
+    def test_note_delete_removes_dependents_and_the_last_notes_pdf(self):
+        first, second = self.make_note(self.user, self.pdf), self.make_note(self.user, self.pdf)
+        first.delete()
+        self.assertTrue(uploadPDF.objects.filter(id=self.pdf.id).exists())
+        self.assertEqual(flashcard.objects.filter(note=second).count(), 1)
+
+        response = self.client.delete(reverse('delete-note', kwargs={'note_id': second.id}), HTTP_AUTHORIZATION=f'Token {self.user.auth_token.key}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(uploadPDF.objects.filter(id=self.pdf.id).exists())
+        self.assert_only_other_user_left()
+
+    def test_account_deletion_takes_the_same_queries_for_any_number_of_notes(self):
+        def queries_to_delete(user, note_count):
+            for _ in range(note_count):
+                self.make_note(user, uploadPDF.objects.create(pdf_file=self.BLOB, user=user))
+            with CaptureQueriesContext(connection) as queries:
+                user.delete()
+            return len(queries)
+
+        few = queries_to_delete(self.user, 2)
+        self.assert_only_other_user_left()
+        self.assertFalse(notebook_page.objects.filter(user_id=self.user.id).exists())
+        self.assertFalse(Token.objects.exists())
+
+        crowded = User.objects.create_user(username='crowded', email='crowded@example.com', password='testpassword')
+        self.page = notebook_page.objects.create(user=crowded)
+        self.assertEqual(queries_to_delete(crowded, 25), few)
+        self.assert_only_other_user_left()
+
+    def test_shared_file_is_removed_with_its_last_upload(self):
+        with mock.patch('api.deletion.default_storage') as storage:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.pdf.delete()
+            storage.delete.assert_not_called()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.other_pdf.delete()
+            storage.delete.assert_called_once_with(self.BLOB)
+        self.assertFalse(note.objects.exists())
+
 # Notebook tests
 class NotebookTestCase(APITestCase):
     def setUp(self):
@@ -374,7 +1866,7 @@ class NotebookTestCase(APITestCase):
         # Create test notebook page
         self.notebook_page = notebook_page.objects.create(
             user=self.user,
-            page_number=1,
+            rank=notebook_pages.RANK_STEP,
             page_title='Test Page'
         )
 
@@ -391,6 +1883,100 @@ class NotebookTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(notebook_page.objects.count(), 2)
 
+    def page_list(self):
+        return [(page['page_number'], page['page_title']) for page in self.client.get(reverse('notebook-pages')).data['pages']]
+
+    def test_insert_delete_and_move_write_one_row(self):
+        for number in (2, 3, 4):
+            self.client.post(reverse('create-notebook-page'), {'page_title': f'Page {number}', 'page_number': number}, format='json')
+        # Inserted before the current page 2
+        with self.assertNumQueries(5):  # lock, neighbour ranks, savepoint, INSERT, release
+            response = self.client.post(reverse('create-notebook-page'), {'page_title': 'Inserted', 'page_number': 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.page_list(), [(1, 'Test Page'), (2, 'Inserted'), (3, 'Page 3'), (4, 'Page 4'), (5, 'Page 5')])
+
+        inserted = notebook_page.objects.get(page_title='Inserted')
+        response = self.client.post(reverse('move-notebook-page', kwargs={'page_id': inserted.id}), {'page_number': 5}, format='json')
+        self.assertEqual(response.data['page_number'], 5)
+        self.assertEqual(self.page_list(), [(1, 'Test Page'), (2, 'Page 2'), (3, 'Page 3'), (4, 'Page 4'), (5, 'Inserted')])
+
+        ranks = dict(notebook_page.objects.values_list('id', 'rank'))
+        response = self.client.post(reverse('delete-notebook-page', kwargs={'page_id': self.notebook_page.id}))
+        self.assertEqual(response.data['deleted_page_number'], 1)
+        # Untitled pages are renumbered without any page's rank being updated
+        self.assertEqual(self.page_list(), [(1, 'Page 1'), (2, 'Page 2'), (3, 'Page 3'), (4, 'Inserted')])
+        self.assertTrue(all(ranks[page_id] == rank for page_id, rank in notebook_page.objects.values_list('id', 'rank')))
+
+    def test_pages_are_found_by_stored_position(self):
+        for title in ('Second', 'Third'):
+            self.client.post(reverse('create-notebook-page'), {'page_title': title}, format='json')
+        self.client.post(reverse('create-notebook-page'), {'page_title': 'Inserted', 'page_number': 2}, format='json')
+        # The first read after a write renumbers the pages once
+        with self.assertNumQueries(7):  # stale check, savepoint, lock, re-check, UPDATE, release, lookup
+            self.assertEqual(notebook_pages.page_at(self.user, 2).page_title, 'Inserted')
+        with self.assertNumQueries(2):  # stale check, lookup
+            self.assertEqual(notebook_pages.page_at(self.user, 3).page_title, 'Second')
+        self.assertEqual(list(notebook_pages.pages_in_order(self.user).values_list('position', flat=True)), [1, 2, 3, 4])
+
+        response = self.client.post(reverse('delete-notebook-page', kwargs={'page_id': self.notebook_page.id}))
+        self.assertEqual(response.data['deleted_page_number'], 1)
+        self.assertEqual(notebook_pages.page_at(self.user, 1).page_title, 'Inserted')
+        self.assertIsNone(notebook_pages.page_at(self.user, 4))
+
+    def test_only_the_next_page_is_added_on_demand(self):
+        response = self.client.get(reverse('sidebar-notebook-notes', kwargs={'page_number': 3}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse('create-notebook-note'), {
+            'page_number': 3, 'note': self.note.id, 'text': 'Too far', 'sidebar': True
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(notebook_page.objects.filter(user=self.user).count(), 1)
+
+        response = self.client.get(reverse('sidebar-notebook-notes', kwargs={'page_number': 2}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.page_list(), [(1, 'Test Page'), (2, 'Page 2')])
+
+    def test_ranks_are_rebalanced_when_a_gap_runs_out(self):
+        self.client.post(reverse('create-notebook-page'), {'page_title': 'Last', 'page_number': 2}, format='json')
+        # Each insert halves the gap before "Last"; 16 of them use it up
+        for index in range(20):
+            self.client.post(reverse('create-notebook-page'), {'page_title': f'Insert {index}', 'page_number': 2}, format='json')
+        titles = [title for _, title in self.page_list()]
+        self.assertEqual(titles, ['Test Page'] + [f'Insert {index}' for index in reversed(range(20))] + ['Last'])
+        ranks = list(notebook_pages.pages_in_order(self.user).values_list('rank', flat=True))
+        self.assertEqual(len(set(ranks)), len(ranks))
+
+    def test_concurrent_requests_for_a_missing_page_add_it_once(self):
+        real_page_at = notebook_pages.page_at
+        calls = []
+
+        def page_at(user, number):
+            calls.append(number)
+            if len(calls) == 1:
+                # Another request adds the page between this one's lookup and its lock
+                notebook_pages.get_or_insert_page(user, number)
+                return None
+            return real_page_at(user, number)
+
+        with mock.patch.object(notebook_pages, 'page_at', side_effect=page_at):
+            page = notebook_pages.get_or_insert_page(self.user, 2)
+        self.assertEqual(notebook_page.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(notebook_pages.page_number(page), 2)
+
+    def test_move_rejects_invalid_positions(self):
+        url = reverse('move-notebook-page', kwargs={'page_id': self.notebook_page.id})
+        for value in ('two', 0):
+            response = self.client.post(url, {'page_number': value}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+        response = self.client.post(reverse('move-notebook-page', kwargs={'page_id': 999}), {'page_number': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_hot_queries_use_their_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('does not use', out.getvalue())
+
     def test_create_notebook_note(self):
         data = {
             'page_number': 1,
@@ -5,6 +5,8 @@ from django.contrib.auth import views as auth_views
 
 urlpatterns = [
     path('upload-pdf/', uploadPDFView.as_view(), name='upload-pdf'),
+    path('jobs/<int:job_id>/', jobStatusView.as_view(), name='job-status'),
+    path('jobs/<int:job_id>/cancel/', cancelJobView.as_view(), name='cancel-job'),
     path('get-user-pdfs/', getUserPDFsView.as_view(), name='get-user-pdfs'),
     path('register/', RegisterUserView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
@@ -22,6 +24,7 @@ urlpatterns = [
     path('create-notebook-page/', createNotebookPageView.as_view(), name='create-notebook-page'),
     path('notebook-pages/', getNotebookPagesView.as_view(), name='notebook-pages'),
     path('delete-notebook-page/<int:page_id>/', deleteNotebookPageView.as_view(), name='delete-notebook-page'),
+    path('move-notebook-page/<int:page_id>/', moveNotebookPageView.as_view(), name='move-notebook-page'),
     path('password-reset/', PasswordResetView.as_view(), name='api-password-reset'),
     path('change-password/', ChangePasswordView.as_view(), name='change-password'),
 ]
\ No newline at end of file
@@ -5,9 +5,13 @@ from rest_framework import status
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 import os
-from .models import uploadPDF, User, note, flashcard, notebook_page, notebook_note
+from .models import uploadPDF, User, note, flashcard, notebook_page, notebook_note, background_job
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from openAI_api.views import ProcessPDFsView
+from .idempotency import idempotent
+from .jobs import cancel_job, enqueue_job, serialize_job
+from . import notebook_pages
+from .deletion import remove_unreferenced_files
+from .storage import store_pdf
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
 from django.contrib.auth import authenticate
 from rest_framework.authtoken.models import Token
@@ -22,6 +26,7 @@ from django.utils.encoding import force_bytes
 from django.urls import reverse
 from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction
 from rest_framework.exceptions import AuthenticationFailed
 
 logger = logging.getLogger(__name__)
@@ -30,38 +35,40 @@ class uploadPDFView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
     
+    @idempotent('upload-pdf')
     def post(self, request):
         try:
             pdf_file = request.FILES.get('pdf_file')
             if not pdf_file:
                 return Response({"error": "No file uploaded"}, status=status.HTTP_400_BAD_REQUEST)
             
-            upload_dir = "media/uploads/"
-            os.makedirs(upload_dir, exist_ok=True)
-
-            file_path = os.path.join(upload_dir, pdf_file.name)
-            with open(file_path, 'wb+') as destination:
-                for chunk in pdf_file.chunks():
-                    destination.write(chunk)
+            # Write the file once into content-addressed storage
+            stored_name, content_hash, byte_size = store_pdf(pdf_file)
 
             # Adding the uploaded file to the django database with user association
-            new_upload = uploadPDF(pdf_file=pdf_file, pdf_name=pdf_file.name, user=request.user)
-            new_upload.save()
-            
-            # Process the PDF to generate notes
-            process_view = ProcessPDFsView()
-            process_response = process_view.post(request)
-            
-            if process_response.status_code != status.HTTP_200_OK:
-                return Response({
-                    "message": "File uploaded successfully but note generation failed",
-                    "error": process_response.data
-                }, status=status.HTTP_200_OK)
+            # and queueing note generation for exactly this upload
+            try:
+                with transaction.atomic():
+                    new_upload = uploadPDF(
+                        pdf_file=stored_name,
+                        pdf_name=pdf_file.name,
+                        content_hash=content_hash,
+                        byte_size=byte_size,
+                        user=request.user
+                    )
+                    new_upload.save()
+                    job = enqueue_job('process_pdf', payload={'pdf_id': new_upload.id}, user=request.user)
+            except Exception:
+                # Rolled back, so the stored file may have no upload at all; one shared with other uploads stays
+                remove_unreferenced_files([stored_name])
+                raise
             
             return Response({
-                "message": "File uploaded and processed successfully",
-                "note_generation": process_response.data
-            }, status=status.HTTP_200_OK)
+                "message": "File uploaded successfully, note generation queued",
+                "pdf_id": new_upload.pdf_key,
+                "job_id": job.id,
+                "status_url": reverse('job-status', kwargs={'job_id': job.id})
+            }, status=status.HTTP_202_ACCEPTED)
             
         except AuthenticationFailed:
             return Response(
@@ -73,6 +80,61 @@ class uploadPDFView(APIView):
                 "error": str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class jobStatusView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        try:
+            job = background_job.objects.get(id=job_id, user=request.user)
+            return Response({
+                'status': 'success',
+                'job': serialize_job(job)
+            }, status=status.HTTP_200_OK)
+        except AuthenticationFailed:
+            return Response(
+                {"error": "Invalid or expired token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        except background_job.DoesNotExist:
+            return Response({
+                'status': 'error',
+                'message': 'Job not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class cancelJobView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, job_id):
+        try:
+            job = background_job.objects.get(id=job_id, user=request.user)
+            if not cancel_job(job.id, user=request.user):
+                return Response({
+                    'status': 'error',
+                    'message': f'Job is already {job.status}'
+                }, status=status.HTTP_409_CONFLICT)
+            job.refresh_from_db()
+            return Response({
+                'status': 'success',
+                'job': serialize_job(job)
+            }, status=status.HTTP_200_OK)
+        except background_job.DoesNotExist:
+            return Response({
+                'status': 'error',
+                'message': 'Job not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class getUserPDFsView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
@@ -260,11 +322,8 @@ class DeleteNoteView(APIView):
         try:
             # Get the note and verify ownership
             note_obj = note.objects.get(id=note_id, user=request.user)
-            
-            # Delete associated flashcards first
-            flashcard.objects.filter(note=note_obj).delete()
-            
-            # Delete the note
+
+            # Deletes its flashcards, chat and notebook notes with it
             note_obj.delete()
             
             return Response({"message": "Note deleted successfully"}, status=status.HTTP_200_OK)
@@ -359,12 +418,13 @@ class createNotebookNoteView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Get or create the notebook page
-            notebook_page_obj, created = notebook_page.objects.get_or_create(
-                user=user,
-                page_number=page_number,
-                defaults={'page_title': f'Page {page_number}'}
-            )
+            # Get the notebook page, or add it when it is the next one
+            notebook_page_obj = notebook_pages.get_or_insert_page(user, page_number)
+            if notebook_page_obj is None:
+                return Response(
+                    {"error": f"Page {page_number} does not exist"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
 
             # Get the note object
             try:
@@ -415,12 +475,13 @@ class getSidebarNotebookNotesView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Get or create the notebook page
-            notebook_page_obj, created = notebook_page.objects.get_or_create(
-                user=user,
-                page_number=page_number,
-                defaults={'page_title': f'Page {page_number}'}
-            )
+            # Get the notebook page, or add it when it is the next one
+            notebook_page_obj = notebook_pages.get_or_insert_page(user, page_number)
+            if notebook_page_obj is None:
+                return Response(
+                    {"error": f"Page {page_number} does not exist"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
 
             # Get the notebook notes
             notebook_notes = notebook_note.objects.filter(
@@ -456,12 +517,8 @@ class getNotebookNotesView(APIView):
                 )
 
             # Get the notebook page and verify ownership
-            try:
-                notebook_page_obj = notebook_page.objects.get(
-                    user=user,
-                    page_number=page_number
-                )
-            except notebook_page.DoesNotExist:
+            notebook_page_obj = notebook_pages.page_at(user, page_number)
+            if notebook_page_obj is None:
                 return Response(
                     {"error": f"Page {page_number} does not exist or you don't have access to it"},
                     status=status.HTTP_404_NOT_FOUND
@@ -574,11 +631,12 @@ class createNotebookPageView(APIView):
             user = request.user
             page_title = request.data.get('page_title')
             page_number = request.data.get('page_number')
-            notebook_page_obj = notebook_page.objects.create(
-                user=user,
-                page_title=page_title,
-                page_number=page_number
-            )
+            try:
+                page_number = int(page_number) if page_number is not None else None
+            except (TypeError, ValueError):
+                return Response({'error': 'page_number must be a valid integer'}, status=status.HTTP_400_BAD_REQUEST)
+            # Inserted before the page now at that number, or appended when there is none
+            notebook_pages.insert_page(user, page_number, page_title)
             return Response({'message': 'Notebook page created successfully'}, status=status.HTTP_201_CREATED)
         except AuthenticationFailed:
             return Response(
@@ -595,19 +653,15 @@ class getNotebookPagesView(APIView):
     def get(self, request):
         try:
             user = request.user
-            # Get all pages for the user
-            pages = notebook_page.objects.filter(user=user).order_by('page_number')
-            total_pages = pages.count()
-            
-            # Serialize the pages
+            # Get all pages for the user, numbered by their order
             pages_data = [{
                 'id': page.id,
-                'page_number': page.page_number,
-                'page_title': page.page_title
-            } for page in pages]
-            
+                'page_number': number,
+                'page_title': notebook_pages.page_title(page, number)
+            } for number, page in enumerate(notebook_pages.pages_in_order(user), start=1)]
+
             return Response({
-                'total_pages': total_pages,
+                'total_pages': len(pages_data),
                 'pages': pages_data
             }, status=status.HTTP_200_OK)
         except AuthenticationFailed:
@@ -629,23 +683,8 @@ class deleteNotebookPageView(APIView):
         try:
             # Get the page to be deleted
             page_to_delete = notebook_page.objects.get(id=page_id, user=request.user)
-            deleted_page_number = page_to_delete.page_number
-            
-            # Delete the page
-            page_to_delete.delete()
-            
-            # Get all pages with numbers greater than the deleted page
-            pages_to_update = notebook_page.objects.filter(
-                user=request.user,
-                page_number__gt=deleted_page_number
-            ).order_by('page_number')
-            
-            # Update page numbers
-            for page in pages_to_update:
-                page.page_number -= 1
-                page.page_title = f'Page {page.page_number}'
-                page.save()
-            
+            deleted_page_number = notebook_pages.delete_page(page_to_delete)
+
             return Response({
                 'message': 'Page deleted successfully',
                 'deleted_page_number': deleted_page_number,
@@ -661,6 +700,36 @@ class deleteNotebookPageView(APIView):
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class moveNotebookPageView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, page_id):
+        try:
+            page_obj = notebook_page.objects.get(id=page_id, user=request.user)
+            try:
+                target = int(request.data.get('page_number'))
+            except (TypeError, ValueError):
+                return Response({'error': 'page_number must be a valid integer'}, status=status.HTTP_400_BAD_REQUEST)
+            if target < 1:
+                return Response({'error': 'page_number must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+
+            # A number past the end moves the page to the end
+            notebook_pages.move_page(page_obj, target)
+            return Response({
+                'message': 'Page moved successfully',
+                'page_number': notebook_pages.page_number(page_obj)
+            }, status=status.HTTP_200_OK)
+        except AuthenticationFailed:
+            return Response(
+                {"error": "Invalid or expired token"},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        except notebook_page.DoesNotExist:
+            return Response({'error': 'Page not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class PasswordResetView(APIView):
     permission_classes = [AllowAny]
     
@@ -12,6 +12,8 @@ const ChatBox = ({ selectedNote }) => {
     const [previousMessages, setPreviousMessages] = useState([]);
     const [isLoading, setIsLoading] = useState(false);
     const messagesEndRef = useRef(null);
+    // Aborting the request closes the connection, which stops the reply being generated on the server
+    const abortControllerRef = useRef(null);
 
     const formatMessage = (text) => {
         const parts = text.split(/(\*\*.*?\*\*)/g);
@@ -47,37 +49,79 @@ const ChatBox = ({ selectedNote }) => {
         try {
             setIsLoading(true);
             const token = localStorage.getItem('authToken');
-            const response = await axios.post(API_ENDPOINTS.SEND_MESSAGE, {
-                message: message,
-                note_id: selectedNote.note_id,
-                note_text: selectedNote.note_text
-            }, {
-                headers: {
-                    'Authorization': `Token ${token}`
-                }
-            });
-            
+            const sentMessage = message;
+            const controller = new AbortController();
+            abortControllerRef.current = controller;
+
             // Add the user message immediately
             const userMessage = {
-                message: message,
+                message: sentMessage,
                 role: 'user',
                 created_at: new Date().toISOString()
             };
             setPreviousMessages(prev => [...prev, userMessage]);
-            
-            // Add the assistant's response
+
+            // Clear the input field
+            setMessage('');
+
+            const response = await fetch(API_ENDPOINTS.SEND_MESSAGE_STREAM, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Token ${token}`
+                },
+                body: JSON.stringify({
+                    message: sentMessage,
+                    note_id: selectedNote.note_id
+                }),
+                signal: controller.signal
+            });
+            if (!response.ok) {
+                throw new Error(`Request failed with status ${response.status}`);
+            }
+
+            // Add an empty assistant message and grow it as deltas arrive
             const assistantMessage = {
-                message: response.data.message,
+                message: '',
                 role: 'assistant',
                 created_at: new Date().toISOString()
             };
             setPreviousMessages(prev => [...prev, assistantMessage]);
-            
-            // Clear the input field
-            setMessage('');
+            const appendToReply = (text) => {
+                setPreviousMessages(prev => {
+                    const last = prev[prev.length - 1];
+                    return [...prev.slice(0, -1), { ...last, message: last.message + text }];
+                });
+            };
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Server-sent events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const block = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    const event = block.match(/^event: (.*)$/m)?.[1];
+                    const data = JSON.parse(block.match(/^data: (.*)$/m)?.[1] || '{}');
+                    if (event === 'delta') {
+                        appendToReply(data.content);
+                    } else if (event === 'error') {
+                        throw new Error(data.message);
+                    }
+                }
+            }
         } catch (error) {
-            console.error('Error sending message:', error);
+            if (error.name !== 'AbortError') {
+                console.error('Error sending message:', error);
+            }
         } finally {
+            abortControllerRef.current = null;
             setIsLoading(false);
         }
     };
@@ -107,6 +151,8 @@ const ChatBox = ({ selectedNote }) => {
         if (selectedNote) {
             fetchMessages();
         }
+        // Stop a reply still streaming for the previous note, or when the chat is closed
+        return () => abortControllerRef.current?.abort();
     }, [selectedNote]);
 
     return (
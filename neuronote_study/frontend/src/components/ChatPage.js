@@ -2,8 +2,7 @@ import React, { useState, useEffect } from 'react';
 import { Box, CircularProgress, Typography, Fade } from '@mui/material';
 import ChatSidebar from './ChatSidebar';
 import ChatBox from './ChatBox';
-import axios from 'axios';
-import { API_ENDPOINTS, axiosConfig } from '../config';
+import { API_ENDPOINTS, fetchAllPages } from '../config';
 import { useTheme } from '@mui/material/styles';
 
 const ChatPage = () => {
@@ -18,8 +17,7 @@ const ChatPage = () => {
         const fetchNotes = async () => {
             try {
                 setLoading(true);
-                const response = await axios.get(`${API_ENDPOINTS.NOTES}`, axiosConfig);
-                setNotes(response.data.notes);
+                setNotes(await fetchAllPages(API_ENDPOINTS.NOTES, 'notes'));
                 setError(null);
             } catch (err) {
                 console.error("Error fetching notes:", err);
@@ -14,8 +14,7 @@ import {
     Fade,
     Zoom,
 } from "@mui/material";
-import axios from 'axios';
-import { API_ENDPOINTS } from '../config';
+import { API_ENDPOINTS, fetchAllPages } from '../config';
 import { useThemeContext } from '../context/ThemeContext';
 
 const Flashcard = () => {
@@ -29,8 +28,7 @@ const Flashcard = () => {
     useEffect(() => {
         const fetchFlashcards = async () => {
             try {
-                const response = await axios.get(`${API_ENDPOINTS.GET_FLASHCARDS}`);
-                setFlashcards(response.data.flashcards);
+                setFlashcards(await fetchAllPages(API_ENDPOINTS.GET_FLASHCARDS, 'flashcards', {}));
             } catch (error) {
                 console.error("Error fetching flashcards:", error);
             } finally {
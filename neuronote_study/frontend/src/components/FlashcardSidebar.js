@@ -14,8 +14,7 @@ import {
   Fade,
 } from "@mui/material";
 import MenuIcon from '@mui/icons-material/Menu';
-import { API_ENDPOINTS, axiosConfig } from "../config";
-import axios from 'axios';
+import { API_ENDPOINTS, fetchAllPages } from "../config";
 
 const FlashcardSidebar = ({ notes, selectedNote, onNoteSelect, isOpen, onToggle, refreshTrigger }) => {
   const theme = useTheme();
@@ -24,8 +23,7 @@ const FlashcardSidebar = ({ notes, selectedNote, onNoteSelect, isOpen, onToggle,
 
   const fetchFlashcards = async () => {
     try {
-      const response = await axios.get(`${API_ENDPOINTS.GET_FLASHCARDS}`, axiosConfig);
-      setFlashcards(response.data.flashcards || []);
+      setFlashcards(await fetchAllPages(API_ENDPOINTS.GET_FLASHCARDS, 'flashcards'));
     } catch (error) {
       console.error('Error fetching flashcards:', error);
       setFlashcards([]);
@@ -13,7 +13,7 @@ import {
 } from "@mui/material";
 import FlashcardSidebar from "./FlashcardSidebar";
 import axios from "axios";
-import { API_ENDPOINTS, axiosConfig } from "../config";
+import { API_ENDPOINTS, axiosConfig, fetchAllPages } from "../config";
 
 const Flashcards = () => {
   const theme = useTheme();
@@ -33,8 +33,7 @@ const Flashcards = () => {
     const fetchNotes = async () => {
       try {
         setLoading(true);
-        const response = await axios.get(`${API_ENDPOINTS.NOTES}`, axiosConfig);
-        setNotes(response.data.notes);
+        setNotes(await fetchAllPages(API_ENDPOINTS.NOTES, 'notes'));
         setError(null);
       } catch (err) {
         console.error("Error fetching notes:", err);
@@ -53,11 +52,7 @@ const Flashcards = () => {
       
       try {
         setLoading(true);
-        const response = await axios.get(
-          `${API_ENDPOINTS.GET_FLASHCARDS}${selectedNote.note_id}/`,
-          axiosConfig
-        );
-        setFlashcards(response.data.flashcards);
+        setFlashcards(await fetchAllPages(`${API_ENDPOINTS.GET_FLASHCARDS}${selectedNote.note_id}/`, 'flashcards'));
         setCurrentCardIndex(0);
         setShowAnswer(false);
         setError(null);
@@ -110,12 +105,12 @@ const Flashcards = () => {
     setIsGenerating(true);
     try {
       const response = await axios.post(
-        `${API_ENDPOINTS.GENERATE_FLASHCARDS}`,
-        { note_id: selectedNote.note_id },
+        `${API_ENDPOINTS.GENERATE_FLASHCARD_DECK}`,
+        { note_id: selectedNote.note_id, count: 10 },
         axiosConfig
       );
-      if (response.data.flashcard) {
-        setFlashcards([response.data.flashcard]);
+      if (response.data.flashcards?.length) {
+        setFlashcards(response.data.flashcards);
         setCurrentCardIndex(0);
         setRefreshTrigger(prev => prev + 1);
       }
@@ -344,7 +344,7 @@ const Note = ({ selectedNote }) => {
                 },
               },
             }}>
-              {formatNoteText(selectedNote.note_text)}
+              {formatNoteText(selectedNote.note_text ?? selectedNote.note_preview)}
             </Box>
           </Box>
         </Fade>
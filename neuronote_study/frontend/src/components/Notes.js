@@ -9,7 +9,7 @@ import {
 import NoteSidebar from "./NoteSidebar";
 import Note from "./Note";
 import axios from "axios";
-import { API_ENDPOINTS, axiosConfig } from "../config";
+import { API_ENDPOINTS, axiosConfig, fetchAllPages } from "../config";
 
 const Notes = () => {
   const [selectedNote, setSelectedNote] = useState(null);
@@ -22,8 +22,7 @@ const Notes = () => {
     const fetchNotes = async () => {
       try {
         setLoading(true);
-        const response = await axios.get(`${API_ENDPOINTS.NOTES}`, axiosConfig);
-        setNotes(response.data.notes);
+        setNotes(await fetchAllPages(API_ENDPOINTS.NOTES, 'notes'));
         setError(null);
       } catch (err) {
         console.error("Error fetching notes:", err);
@@ -36,6 +35,20 @@ const Notes = () => {
     fetchNotes();
   }, []);
 
+  // The list only has previews, so the full text is fetched when a note is opened
+  const handleNoteSelect = async (listedNote) => {
+    setSelectedNote(listedNote);
+    try {
+      const response = await axios.get(`${API_ENDPOINTS.NOTES}${listedNote.note_id}/`, axiosConfig);
+      setSelectedNote((current) =>
+        current?.note_id === listedNote.note_id ? response.data.note : current
+      );
+    } catch (err) {
+      console.error("Error fetching note:", err);
+      setError("Failed to load the note. Please try again later.");
+    }
+  };
+
   const handleNoteDelete = (noteId) => {
     setNotes(notes.filter(note => note.note_id !== noteId));
     if (selectedNote?.note_id === noteId) {
@@ -58,7 +71,7 @@ const Notes = () => {
       <NoteSidebar
         notes={notes}
         selectedNote={selectedNote}
-        onNoteSelect={setSelectedNote}
+        onNoteSelect={handleNoteSelect}
         isOpen={isSidebarOpen}
         onToggle={() => setIsSidebarOpen(!isSidebarOpen)}
         onNoteDelete={handleNoteDelete}
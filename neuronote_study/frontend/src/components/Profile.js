@@ -19,7 +19,7 @@ import {
 } from '@mui/material';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
-import { API_ENDPOINTS } from '../config';
+import { API_ENDPOINTS, fetchAllPages } from '../config';
 import DescriptionIcon from '@mui/icons-material/Description';
 import NoteIcon from '@mui/icons-material/Note';
 import SchoolIcon from '@mui/icons-material/School';
@@ -73,13 +73,13 @@ const Profile = () => {
     const fetchFlashcards = async () => {
         try {
             const token = localStorage.getItem('authToken');
-            const response = await axios.get(API_ENDPOINTS.GET_FLASHCARDS, {
+            const cards = await fetchAllPages(API_ENDPOINTS.GET_FLASHCARDS, 'flashcards', {
                 headers: {
                     'Authorization': `Token ${token}` 
                 }
             });
-            setFlashcards(response.data);
-            console.log(response.data);
+            setFlashcards({ flashcards: cards });
+            console.log(cards);
         } catch (error) {
             console.error('Error fetching flashcards:', error);
         }
@@ -88,13 +88,13 @@ const Profile = () => {
     const fetchNotes = async () => {
         try {
             const token = localStorage.getItem('authToken');
-            const response = await axios.get(API_ENDPOINTS.NOTES, {
+            const listed = await fetchAllPages(API_ENDPOINTS.NOTES, 'notes', {
                 headers: {
                     'Authorization': `Token ${token}` 
                 }
             });
-            setNotes(response.data);
-            console.log(response.data);
+            setNotes({ notes: listed });
+            console.log(listed);
         } catch (error) {
             console.error('Error fetching notes:', error);
         }
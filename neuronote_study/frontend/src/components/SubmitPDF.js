@@ -26,6 +26,8 @@ const SubmitPDF = () => {
   const dropAreaRef = useRef(null);
   const [isLoading, setIsLoading] = useState(false);
   const MAX_FILE_SIZE = 5 * 1024 * 1024;
+  const JOB_POLL_INTERVAL_MS = 2000;
+  const JOB_POLL_MAX_ATTEMPTS = 150;
 
   useEffect(() => {
     const token = localStorage.getItem("authToken");
@@ -87,6 +89,29 @@ const SubmitPDF = () => {
     }
   };
 
+  // Poll the background job until the note has been generated
+  const waitForJob = async (jobId, token) => {
+    if (!jobId) return;
+    for (let attempt = 0; attempt < JOB_POLL_MAX_ATTEMPTS; attempt++) {
+      const response = await axios.get(`${API_ENDPOINTS.JOB_STATUS}/${jobId}/`, {
+        ...axiosConfig,
+        headers: {
+          ...axiosConfig.headers,
+          "Authorization": `Token ${token}`
+        },
+      });
+      const job = response.data.job;
+      if (job.status === "succeeded") return;
+      if (job.status === "failed") {
+        throw new Error(job.error || "Note generation failed");
+      }
+      if (job.status === "cancelled") {
+        throw new Error("Note generation was cancelled");
+      }
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   // Handle file submission
   const handleSubmit = async () => {
     setIsLoading(true);
@@ -107,7 +132,7 @@ const SubmitPDF = () => {
     formData.append("pdf_file", file);
 
     try {
-      await axios.post(API_ENDPOINTS.UPLOAD_PDF, formData, {
+      const response = await axios.post(API_ENDPOINTS.UPLOAD_PDF, formData, {
         ...axiosConfig,
         headers: {
           ...axiosConfig.headers,
@@ -115,6 +140,8 @@ const SubmitPDF = () => {
           "Authorization": `Token ${token}`
         },
       });
+      // Note generation runs in the background, wait for the job to finish
+      await waitForJob(response.data.job_id, token);
       navigate("/notes");
     } catch (error) {
       console.error("Error:", error);
@@ -1,3 +1,5 @@
+import axios from "axios";
+
 // API Configuration
 export const API_BASE_URL = process.env.REACT_APP_API_URL || "";
 
@@ -5,10 +7,12 @@ export const API_BASE_URL = process.env.REACT_APP_API_URL || "";
 export const API_ENDPOINTS = {
   BASE_URL: API_BASE_URL,
   UPLOAD_PDF: `${API_BASE_URL}/api/upload-pdf/`,
+  JOB_STATUS: `${API_BASE_URL}/api/jobs`,
   REGISTER: `${API_BASE_URL}/api/register/`,
   NOTES: `${API_BASE_URL}/openai/notes/`,
   FLASHCARDS: `${API_BASE_URL}/openai/flashcards/`,
   GENERATE_FLASHCARDS: `${API_BASE_URL}/openai/generate-flashcards/`,
+  GENERATE_FLASHCARD_DECK: `${API_BASE_URL}/openai/generate-flashcard-deck/`,
   GET_FLASHCARDS: `${API_BASE_URL}/openai/get-flashcards/`,
   GET_USER_PDFS: `${API_BASE_URL}/api/get-user-pdfs/`,
   LOGOUT: `${API_BASE_URL}/api/logout/`,
@@ -17,6 +21,8 @@ export const API_ENDPOINTS = {
   PASSWORD_RESET: `${API_BASE_URL}/api/password-reset/`,
   GET_MESSAGES: `${API_BASE_URL}/openai/get-messages/`,
   SEND_MESSAGE: `${API_BASE_URL}/openai/send-message/`,
+  // The async view streams under ASGI (gunicorn + uvicorn); the sync one only streams under WSGI
+  SEND_MESSAGE_STREAM: `${API_BASE_URL}/openai/send-message/stream-async/`,
   CREATE_NOTEBOOK_NOTE: `${API_BASE_URL}/api/create-notebook-note/`,
   SIDEBAR_NOTEBOOK_NOTES: `${API_BASE_URL}/api/sidebar-notebook-notes`,
   NOTEBOOK_NOTES: `${API_BASE_URL}/api/notebook-notes`,
@@ -60,3 +66,18 @@ export const axiosFileConfig = {
     "Authorization": `Token ${getAuthToken()}`,
   },
 };
+
+// List endpoints return one page at a time; follow next_cursor to collect every item
+export const fetchAllPages = async (url, key, config = axiosConfig) => {
+  const items = [];
+  let cursor = null;
+  do {
+    const response = await axios.get(url, {
+      ...config,
+      params: { ...config.params, ...(cursor ? { cursor } : {}) },
+    });
+    items.push(...(response.data[key] || []));
+    cursor = response.data.next_cursor;
+  } while (cursor);
+  return items;
+};
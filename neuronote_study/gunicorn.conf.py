@@ -0,0 +1,20 @@
+"""
+Gunicorn config: serves the ASGI application with uvicorn workers, so the async
+views (openAI_api/async_views.py) keep a worker free while OpenAI answers.
+
+    gunicorn -c neuronote_study/gunicorn.conf.py
+
+Sync DRF views still work under ASGI; Django runs each one on a thread.
+"""
+
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'neuronote_study.asgi:application'
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Long note generations and chat streams hold a request open well past gunicorn's 30s default
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
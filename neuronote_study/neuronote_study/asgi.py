@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'neuronote_study.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.middleware import CancelOnDisconnect  # noqa: E402  (needs the app registry loaded)
+
+# Abandon the in-flight OpenAI call of an async view when its client goes away
+application = CancelOnDisconnect(django_application)
@@ -11,9 +11,11 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 import dj_database_url
+from corsheaders.defaults import default_headers
 
 # Load environment variables from .env file
 load_dotenv()
@@ -59,7 +61,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'api.middleware.StaticFilesMiddleware',
+    'api.middleware.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'neuronote_study.urls'
@@ -144,6 +147,10 @@ CORS_ALLOWED_ORIGINS = os.getenv('CORS_ALLOWED_ORIGINS', 'http://localhost:3000,
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Clients may retry expensive POSTs safely by sending an Idempotency-Key (see api/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
+
 # CSRF settings
 CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000').split(',')
 
@@ -175,3 +182,127 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# Background jobs (PDF -> note processing runs in `manage.py run_job_worker`)
+JOB_RUN_EAGERLY = os.getenv('JOB_RUN_EAGERLY', 'False') == 'True'
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BACKOFF_SECONDS = int(os.getenv('JOB_RETRY_BACKOFF_SECONDS', '10'))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', '1'))
+JOB_CLAIM_BATCH_SIZE = int(os.getenv('JOB_CLAIM_BATCH_SIZE', '10'))
+# How often a running job renews its lease (and so finds out it was cancelled) before sending another completion;
+# keep it well below JOB_LEASE_SECONDS
+JOB_CANCEL_POLL_SECONDS = float(os.getenv('JOB_CANCEL_POLL_SECONDS', '5'))
+
+# PDF text extraction: 'pdfplumber' or 'pypdfium2' (much faster), with page ranges spread over a process pool
+PDF_EXTRACTION_BACKEND = os.getenv('PDF_EXTRACTION_BACKEND', 'pdfplumber')
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_EXTRACTION_MIN_PAGES_PER_WORKER = int(os.getenv('PDF_EXTRACTION_MIN_PAGES_PER_WORKER', '25'))
+PDF_EXTRACTION_START_METHOD = os.getenv('PDF_EXTRACTION_START_METHOD', 'spawn')
+
+# OpenAI model used for notes, flashcards and chat
+OPENAI_CHAT_MODEL = os.getenv('OPENAI_CHAT_MODEL', 'gpt-4o-mini-2024-07-18')
+
+# Documents estimated above SUMMARY_SINGLE_PASS_TOKENS are summarised map-reduce style:
+# chunks of at most SUMMARY_CHUNK_TOKENS are summarised concurrently, then combined
+SUMMARY_SINGLE_PASS_TOKENS = int(os.getenv('SUMMARY_SINGLE_PASS_TOKENS', '24000'))
+SUMMARY_CHUNK_TOKENS = int(os.getenv('SUMMARY_CHUNK_TOKENS', '6000'))
+SUMMARY_MAP_MAX_TOKENS = int(os.getenv('SUMMARY_MAP_MAX_TOKENS', '500'))
+SUMMARY_MAP_CONCURRENCY = int(os.getenv('SUMMARY_MAP_CONCURRENCY', '4'))
+
+# How a note's summary and title are generated:
+#   sequential - two full-document completions, one after the other
+#   structured - one completion returning both as JSON
+#   derived    - summary first, then a title from the summary
+#   first_page - summary, then a title from the document's first page
+#   concurrent - both full-document completions in parallel on the shared client
+NOTE_GENERATION_MODE = os.getenv('NOTE_GENERATION_MODE', 'sequential')
+
+# OpenAI client, shared per worker process with a keep-alive connection pool
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Load testing: send every completion to the bundled fake API (`manage.py run_fake_openai`)
+OPENAI_USE_FAKE_SERVER = os.getenv('OPENAI_USE_FAKE_SERVER', 'False') == 'True'
+FAKE_OPENAI_PORT = int(os.getenv('FAKE_OPENAI_PORT', '8765'))
+if OPENAI_USE_FAKE_SERVER:
+    OPENAI_BASE_URL = f'http://127.0.0.1:{FAKE_OPENAI_PORT}/v1'
+    OPENAI_API_KEY = 'fake-key'
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv('OPENAI_KEEPALIVE_EXPIRY', '60'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv('OPENAI_CONNECT_TIMEOUT', '10'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+
+# Completion cache: an in-process LRU in front of the llm_response_cache table
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'True') == 'True'
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', '256'))
+LLM_CACHE_DB_MAX_BYTES = int(os.getenv('LLM_CACHE_DB_MAX_BYTES', str(200 * 1024 * 1024)))
+LLM_CACHE_PRUNE_EVERY = int(os.getenv('LLM_CACHE_PRUNE_EVERY', '100'))
+
+# Chat prompts are kept within an estimated input token budget, per model ('default' for the rest),
+# e.g. CHAT_CONTEXT_TOKENS='{"gpt-4o-mini-2024-07-18": 12000}'. The most recent CHAT_RECENT_MESSAGES
+# messages are sent verbatim; older ones are folded into a running summary, CHAT_SUMMARY_BATCH_MESSAGES at a time
+CHAT_CONTEXT_TOKENS = {'default': 6000, **json.loads(os.getenv('CHAT_CONTEXT_TOKENS', '{}'))}
+CHAT_NOTE_CONTEXT_TOKENS = int(os.getenv('CHAT_NOTE_CONTEXT_TOKENS', '3000'))
+CHAT_RECENT_MESSAGES = int(os.getenv('CHAT_RECENT_MESSAGES', '8'))
+CHAT_SUMMARY_BATCH_MESSAGES = int(os.getenv('CHAT_SUMMARY_BATCH_MESSAGES', '6'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '400'))
+
+# Chat retrieval: notes are split into passages of about RETRIEVAL_CHUNK_TOKENS, embedded locally as
+# RETRIEVAL_VECTOR_DIM-dimensional hashing vectors, and each question gets the best RETRIEVAL_TOP_K of them.
+# Notes under RETRIEVAL_FULL_TEXT_TOKENS are still sent whole
+RETRIEVAL_CHUNK_TOKENS = int(os.getenv('RETRIEVAL_CHUNK_TOKENS', '200'))
+RETRIEVAL_VECTOR_DIM = int(os.getenv('RETRIEVAL_VECTOR_DIM', '2048'))
+RETRIEVAL_TOP_K = int(os.getenv('RETRIEVAL_TOP_K', '6'))
+RETRIEVAL_FULL_TEXT_TOKENS = int(os.getenv('RETRIEVAL_FULL_TEXT_TOKENS', '1200'))
+
+# Largest deck generate-flashcard-deck/ produces in one completion
+FLASHCARD_MAX_DECK_SIZE = int(os.getenv('FLASHCARD_MAX_DECK_SIZE', '30'))
+# Bulk deck jobs (generate-decks/): concurrent completions per job and notes per job
+DECK_GENERATION_CONCURRENCY = int(os.getenv('DECK_GENERATION_CONCURRENCY', '4'))
+DECK_GENERATION_MAX_NOTES = int(os.getenv('DECK_GENERATION_MAX_NOTES', '100'))
+
+# Opt-in pre-generation: after a note is created, a low-priority job builds its chat
+# index and a starter flashcard deck so the first visit to either screen is a read
+NOTE_PREGENERATION = os.getenv('NOTE_PREGENERATION', 'False') == 'True'
+NOTE_PREGENERATION_DECK_SIZE = int(os.getenv('NOTE_PREGENERATION_DECK_SIZE', '10'))
+
+# Outbound OpenAI governor: shared requests/tokens per minute buckets ('database' shares them between
+# worker processes, 'local' keeps them per process), with a share of each held back from note generation
+# and a larger one from bulk jobs so chat always has capacity. GOVERNOR_MAX_CONCURRENCY caps the
+# per-process AIMD window of calls in flight
+GOVERNOR_ENABLED = os.getenv('GOVERNOR_ENABLED', 'True') == 'True'
+GOVERNOR_BACKEND = os.getenv('GOVERNOR_BACKEND', 'database' if os.getenv('DATABASE_URL') else 'local')
+GOVERNOR_REQUESTS_PER_MINUTE = int(os.getenv('GOVERNOR_REQUESTS_PER_MINUTE', '500'))
+GOVERNOR_TOKENS_PER_MINUTE = int(os.getenv('GOVERNOR_TOKENS_PER_MINUTE', '200000'))
+GOVERNOR_NOTES_RESERVE = float(os.getenv('GOVERNOR_NOTES_RESERVE', '0.2'))
+GOVERNOR_BULK_RESERVE = float(os.getenv('GOVERNOR_BULK_RESERVE', '0.5'))
+GOVERNOR_MAX_CONCURRENCY = int(os.getenv('GOVERNOR_MAX_CONCURRENCY', '16'))
+GOVERNOR_LATENCY_TARGET_SECONDS = float(os.getenv('GOVERNOR_LATENCY_TARGET_SECONDS', '20'))
+GOVERNOR_COOLDOWN_SECONDS = float(os.getenv('GOVERNOR_COOLDOWN_SECONDS', '5'))
+GOVERNOR_MAX_WAIT_SECONDS = float(os.getenv('GOVERNOR_MAX_WAIT_SECONDS', '120'))
+
+# Single-flight for LLM-backed endpoints: identical requests (same user, endpoint, body and Idempotency-Key)
+# arriving while one is running wait for its response, up to SINGLE_FLIGHT_WAIT_SECONDS in the async views and
+# SINGLE_FLIGHT_SYNC_WAIT_SECONDS in the sync ones, where a waiter blocks a worker (keep it well under
+# GUNICORN_TIMEOUT). The response is kept SINGLE_FLIGHT_RESULT_SECONDS for those waiters only; a request
+# arriving after the leader finished runs again. A leader that dies loses its lease after SINGLE_FLIGHT_LEASE_SECONDS
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'True') == 'True'
+SINGLE_FLIGHT_LEASE_SECONDS = int(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', '120'))
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_WAIT_SECONDS', '90'))
+SINGLE_FLIGHT_SYNC_WAIT_SECONDS = float(os.getenv('SINGLE_FLIGHT_SYNC_WAIT_SECONDS', '15'))
+SINGLE_FLIGHT_RESULT_SECONDS = int(os.getenv('SINGLE_FLIGHT_RESULT_SECONDS', '10'))
+SINGLE_FLIGHT_POLL_SECONDS = float(os.getenv('SINGLE_FLIGHT_POLL_SECONDS', '0.2'))
+SINGLE_FLIGHT_PRUNE_EVERY = int(os.getenv('SINGLE_FLIGHT_PRUNE_EVERY', '100'))
+
+# Idempotency-Key support on expensive POSTs: a replayed key returns the stored response for this long
+IDEMPOTENCY_RETENTION_HOURS = int(os.getenv('IDEMPOTENCY_RETENTION_HOURS', '24'))
+# A request still marked in progress after this long (its worker died) may be retried under the same key
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '300'))
+IDEMPOTENCY_PRUNE_EVERY = int(os.getenv('IDEMPOTENCY_PRUNE_EVERY', '100'))
+
+# Adds X-DB-Query-Count / X-DB-Query-Time-Ms headers to every response (used by `manage.py load_test`)
+QUERY_COUNT_HEADERS = os.getenv('QUERY_COUNT_HEADERS', 'False') == 'True'
@@ -0,0 +1,176 @@
+import asyncio
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework.authtoken.models import Token
+
+from api.idempotency import aidempotent
+from api.models import chat_message, note, uploadPDF
+from .context import build_chat_context
+from .flashcards import FlashcardFormatError, acreate_flashcard_deck
+from .governor import PRIORITY_INTERACTIVE, PRIORITY_NOTES, request_context
+from .single_flight import asingle_flight
+from .streaming import achat_reply_events, sse_response
+from .tasks import schedule_note_pregeneration
+from .util import PDFTextError, acreate_note_from_pdf, agenerate_assistant_chat_message, astream_assistant_chat_message
+
+# Native async views for ASGI deployments (neuronote_study/asgi.py). DRF views
+# are synchronous, so these authenticate the DRF token themselves. When the
+# client disconnects the request is cancelled (api/middleware.py), which
+# abandons the in-flight completion.
+
+
+async def authenticate_token(request):
+    keyword, _, key = request.headers.get('Authorization', '').partition(' ')
+    if keyword != 'Token' or not key:
+        return None
+    try:
+        token = await Token.objects.select_related('user').aget(key=key.strip())
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+async def authenticated_post(request):
+    """(user, JSON body, None) for an authenticated POST, or (None, None, error response)."""
+    if request.method != 'POST':
+        return None, None, HttpResponseNotAllowed(['POST'])
+
+    user = await authenticate_token(request)
+    if user is None:
+        return None, None, JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None, None, JsonResponse({'status': 'error', 'message': 'Invalid JSON body'}, status=400)
+    if not isinstance(data, dict):
+        return None, None, JsonResponse({'status': 'error', 'message': 'Invalid JSON body'}, status=400)
+    return user, data, None
+
+
+def post_view(view):
+    """Make `view(request, user, data)` a view for authenticated JSON POSTs."""
+    @functools.wraps(view)
+    async def wrapper(request, **kwargs):
+        user, data, error = await authenticated_post(request)
+        if error is not None:
+            return error
+        return await view(request, user, data, **kwargs)
+    return wrapper
+
+
+@post_view
+async def send_message_stream(request, user, data):
+    message = data.get('message')
+    note_id = data.get('note_id')
+    if not note_id or not message:
+        return JsonResponse({'status': 'error', 'message': 'Note ID and message are required'}, status=400)
+
+    try:
+        note_obj = await note.objects.aget(id=note_id, user=user)
+    except note.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Note not found'}, status=404)
+
+    with request_context(PRIORITY_INTERACTIVE, user.id):
+        messages = await sync_to_async(build_chat_context)(note_obj, message)
+        question = await chat_message.objects.acreate(message=message, role="user", user=user, note=note_obj)
+
+        deltas = astream_assistant_chat_message(messages)
+    return sse_response(achat_reply_events(deltas, user, note_obj, question))
+
+
+@post_view
+@aidempotent('send-message')
+@asingle_flight('send-message')
+async def send_message(request, user, data):
+    # Same contract as sendMessageView; the worker is free for other requests while OpenAI answers
+    message = data.get('message')
+    note_id = data.get('note_id')
+    if not note_id or not message:
+        return JsonResponse({'status': 'error', 'message': 'Note ID and message are required'}, status=400)
+
+    try:
+        note_obj = await note.objects.aget(id=note_id, user=user)
+    except note.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Note not found'}, status=404)
+
+    try:
+        with request_context(PRIORITY_INTERACTIVE, user.id):
+            messages = await sync_to_async(build_chat_context)(note_obj, message)
+            question = await chat_message.objects.acreate(message=message, role="user", user=user, note=note_obj)
+            try:
+                assistant_message = await agenerate_assistant_chat_message(messages)
+            except asyncio.CancelledError:
+                # The client disconnected and the completion was abandoned; an unanswered question is not kept
+                await question.adelete()
+                raise
+        await chat_message.objects.acreate(message=assistant_message, role="assistant", user=user, note=note_obj)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    return JsonResponse({'status': 'success', 'message': assistant_message})
+
+
+@post_view
+@aidempotent('generate-flashcards')
+@asingle_flight('generate-flashcards')
+async def generate_flashcards(request, user, data):
+    # Same contract as generateFlashcardsView
+    note_id = data.get('note_id')
+    if not note_id:
+        return JsonResponse({'status': 'error', 'message': 'Note ID is required'}, status=400)
+
+    try:
+        note_obj = await note.objects.aget(id=note_id, user=user)
+        with request_context(PRIORITY_NOTES, user.id):
+            new_flashcard = (await acreate_flashcard_deck(user, note_obj, 1))[0]
+    except note.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'Note not found'}, status=404)
+    except FlashcardFormatError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+    return JsonResponse({'status': 'success', 'flashcard': new_flashcard})
+
+
+@post_view
+@aidempotent('create-note')
+@asingle_flight('create-note')
+async def create_note(request, user, data):
+    # Same contract as createNoteView: generates the note for one of the user's uploaded PDFs.
+    # Unlike it, duplicates are coalesced and Idempotency-Key is honoured, as each one pays for a summary
+    pdf_key = data.get('pdf_key')
+    if not pdf_key:
+        return JsonResponse({'status': 'error', 'message': 'PDF key is required'}, status=400)
+
+    try:
+        pdf = await uploadPDF.objects.aget(pdf_key=pdf_key, user=user)
+    except uploadPDF.DoesNotExist:
+        return JsonResponse({'status': 'error', 'message': 'PDF not found'}, status=404)
+
+    try:
+        with request_context(PRIORITY_NOTES, user.id):
+            new_note = await acreate_note_from_pdf(pdf, user)
+    except PDFTextError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': f'Failed to generate summary or title: {str(e)}'}, status=500)
+
+    pregeneration_job = await sync_to_async(schedule_note_pregeneration)(new_note)
+    return JsonResponse({
+        'status': 'success',
+        'message': 'Note created successfully',
+        'note_id': new_note.id,
+        'note_text': new_note.note_text,
+        'note_title': new_note.note_title,
+        'pregeneration_job_id': pregeneration_job.id if pregeneration_job else None
+    }, status=201)
+
+
+# Token authenticated, so CSRF does not apply; csrf_exempt would wrap the views in sync functions in Django 4.2
+for view in (send_message_stream, send_message, generate_flashcards, create_note):
+    view.csrf_exempt = True
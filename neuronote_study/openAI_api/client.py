@@ -0,0 +1,86 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import openai
+from django.conf import settings
+
+# One OpenAI client per process (and one async client per event loop), so the
+# connection pool, TLS sessions and configuration are set up once per worker
+_lock = threading.Lock()
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+_owner_pid = os.getpid()
+
+
+def _reset_after_fork():
+    # Sockets inherited from the parent (e.g. gunicorn --preload) must not be shared
+    global _lock, _client, _async_clients, _owner_pid
+    _lock = threading.Lock()
+    _client = None
+    _async_clients = weakref.WeakKeyDictionary()
+    _owner_pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+    )
+
+
+def _timeout():
+    return httpx.Timeout(settings.OPENAI_TIMEOUT, connect=settings.OPENAI_CONNECT_TIMEOUT)
+
+
+def _client_options():
+    return {
+        'api_key': settings.OPENAI_API_KEY,
+        'base_url': settings.OPENAI_BASE_URL,
+        'timeout': _timeout(),
+        'max_retries': settings.OPENAI_MAX_RETRIES,
+    }
+
+
+def _check_pid():
+    # Fallback for platforms without os.register_at_fork
+    if _owner_pid != os.getpid():
+        _reset_after_fork()
+
+
+def get_client():
+    global _client
+    _check_pid()
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = openai.OpenAI(
+                    http_client=openai.DefaultHttpxClient(limits=_limits(), timeout=_timeout()),
+                    **_client_options()
+                )
+    return _client
+
+
+def get_async_client():
+    # httpx async pools are bound to the event loop they were created on
+    _check_pid()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        with _lock:
+            client = _async_clients.get(loop)
+            if client is None:
+                client = openai.AsyncOpenAI(
+                    http_client=openai.DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout()),
+                    **_client_options()
+                )
+                _async_clients[loop] = client
+    return client
+
@@ -0,0 +1,150 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from openai.types.chat import ChatCompletion
+
+from . import llm_cache
+from .governor import agoverned, current_request_context, governed
+
+
+def _use_cache(cache, kwargs):
+    return settings.LLM_CACHE_ENABLED and cache and not kwargs.get('stream')
+
+
+def _create(client, kwargs):
+    # Every request to OpenAI is admitted by the governor; cache hits never reach it
+    with governed(kwargs) as slot:
+        response = client.chat.completions.create(**kwargs)
+        slot.responded()
+        slot.record_usage(getattr(response, 'usage', None))
+    return response
+
+
+async def _acreate(client, kwargs):
+    async with agoverned(kwargs) as slot:
+        response = await client.chat.completions.create(**kwargs)
+        slot.responded()
+        slot.record_usage(getattr(response, 'usage', None))
+    return response
+
+
+def create_chat_completion(client, cache=True, **kwargs):
+    """Create a chat completion through the response cache.
+
+    Pass cache=False for calls that are expected to vary between identical
+    prompts (high temperature titles, new flashcards for the same note).
+    """
+    if not _use_cache(cache, kwargs):
+        return _create(client, kwargs)
+
+    key = llm_cache.cache_key(kwargs['model'], kwargs['messages'], kwargs)
+    cached = llm_cache.lookup(key)
+    if cached is not None:
+        return cached
+
+    response = _create(client, kwargs)
+    llm_cache.store(key, kwargs['model'], response)
+    return response
+
+
+async def acreate_chat_completion(client, cache=True, **kwargs):
+    if not _use_cache(cache, kwargs):
+        return await _acreate(client, kwargs)
+
+    key = llm_cache.cache_key(kwargs['model'], kwargs['messages'], kwargs)
+    cached = await sync_to_async(llm_cache.lookup)(key)
+    if cached is not None:
+        return cached
+
+    response = await _acreate(client, kwargs)
+    await sync_to_async(llm_cache.store)(key, kwargs['model'], response)
+    return response
+
+
+def _assembled_completion(model, content, usage):
+    # Rebuild a regular completion from streamed deltas so it can be cached like one
+    return ChatCompletion.model_validate({
+        'id': 'chatcmpl-stream',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': model,
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': usage.model_dump() if usage is not None else None,
+    })
+
+
+def stream_chat_completion(client, cache=True, **kwargs):
+    """Yield the content deltas of a chat completion as they arrive.
+
+    A cached response is replayed as a single delta; a completed stream is
+    stored in the cache like a regular completion.
+    """
+    # The generator runs later (after the view has returned), so the caller's priority is captured now
+    return _stream_chat_completion(client, cache, current_request_context(), kwargs)
+
+
+def _stream_chat_completion(client, cache, context, kwargs):
+    use_cache = _use_cache(cache, kwargs)
+    if use_cache:
+        key = llm_cache.cache_key(kwargs['model'], kwargs['messages'], kwargs)
+        cached = llm_cache.lookup(key)
+        if cached is not None:
+            yield cached.choices[0].message.content
+            return
+
+    parts = []
+    usage = None
+    # The governor slot is held until the stream is finished or abandoned
+    with governed(kwargs, context) as slot:
+        stream = client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **kwargs)
+        slot.responded()
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        yield choice.delta.content
+        finally:
+            # Closing the response also stops generation upstream if the consumer went away
+            stream.close()
+            slot.record_usage(usage)
+
+    if use_cache:
+        llm_cache.store(key, kwargs['model'], _assembled_completion(kwargs['model'], ''.join(parts), usage))
+
+
+def astream_chat_completion(client, cache=True, **kwargs):
+    return _astream_chat_completion(client, cache, current_request_context(), kwargs)
+
+
+async def _astream_chat_completion(client, cache, context, kwargs):
+    use_cache = _use_cache(cache, kwargs)
+    if use_cache:
+        key = llm_cache.cache_key(kwargs['model'], kwargs['messages'], kwargs)
+        cached = await sync_to_async(llm_cache.lookup)(key)
+        if cached is not None:
+            yield cached.choices[0].message.content
+            return
+
+    parts = []
+    usage = None
+    async with agoverned(kwargs, context) as slot:
+        stream = await client.chat.completions.create(stream=True, stream_options={'include_usage': True}, **kwargs)
+        slot.responded()
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    if choice.delta.content:
+                        parts.append(choice.delta.content)
+                        yield choice.delta.content
+        finally:
+            await stream.close()
+            slot.record_usage(usage)
+
+    if use_cache:
+        await sync_to_async(llm_cache.store)(key, kwargs['model'], _assembled_completion(kwargs['model'], ''.join(parts), usage))
@@ -0,0 +1,149 @@
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from api.models import chat_message, chat_summary
+from .client import get_client
+from .completions import create_chat_completion
+from .retrieval import note_context
+from .tokens import CHARS_PER_TOKEN, estimate_message_tokens, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def context_budget(model=None):
+    budgets = settings.CHAT_CONTEXT_TOKENS
+    return budgets.get(model or settings.OPENAI_CHAT_MODEL, budgets['default'])
+
+
+def truncate_to_tokens(text, tokens):
+    if estimate_tokens(text) <= tokens:
+        return text
+    return text[:tokens * CHARS_PER_TOKEN] + "\n[...]"
+
+
+def chat_system_message(note_text, summary=''):
+    content = f"""You are a helpful assistant discussing the following note:
+        
+        {note_text}
+
+        Please use this information to provide relevant and contextual responses. 
+        If the user's question is not related to the note content, you can still help but make it clear that you're going beyond the note's scope.
+        """
+    if summary:
+        content += f"\nSummary of the earlier conversation about this note:\n{summary}\n"
+    return {"role": "system", "content": content}
+
+
+def _as_messages(rows):
+    return [{'role': row.role, 'content': row.message} for row in rows]
+
+
+def _transcript_batches(rows):
+    # Keep each summarisation request within one chunk budget, however long the backlog is
+    budget = settings.SUMMARY_CHUNK_TOKENS
+    batch = []
+    batch_tokens = 0
+    for row in rows:
+        line = f"{row.role}: {truncate_to_tokens(row.message, budget // 2)}"
+        line_tokens = estimate_tokens(line)
+        if batch and batch_tokens + line_tokens > budget:
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append((row, line))
+        batch_tokens += line_tokens
+    if batch:
+        yield batch
+
+
+def fold_into_summary(summary_obj, rows, model=None, client=None):
+    """Merge `rows` (the oldest unsummarized messages, in order) into the note's running summary."""
+    model = model or settings.OPENAI_CHAT_MODEL
+    client = client or get_client()
+
+    for batch in _transcript_batches(rows):
+        transcript = "\n".join(line for _, line in batch)
+        response = create_chat_completion(
+            client,
+            cache=False,
+            model=model,
+            messages=[
+                {"role": "system", "content": "You maintain a running summary of a conversation between a student and a study assistant about one of the student's notes."},
+                {"role": "user", "content": f"Current summary:\n{summary_obj.summary or '(none yet)'}\n\nNew messages:\n{transcript}\n\nRewrite the summary so it also covers the new messages. Keep the questions asked, the answers given and anything the student said they struggle with. Be concise."}
+            ],
+            max_tokens=settings.CHAT_SUMMARY_MAX_TOKENS,
+            temperature=0.3
+        )
+        # Conditional update, so two concurrent turns cannot fold the same messages twice
+        updated = chat_summary.objects.filter(id=summary_obj.id, summarized_through=summary_obj.summarized_through).update(
+            summary=response.choices[0].message.content,
+            summarized_through=batch[-1][0].id,
+            summarized_messages=F('summarized_messages') + len(batch),
+            updated_at=timezone.now()
+        )
+        summary_obj.refresh_from_db()
+        if not updated:
+            break
+    return summary_obj
+
+
+def _get_summary(note_obj):
+    try:
+        return chat_summary.objects.get_or_create(note=note_obj)[0]
+    except IntegrityError:
+        return chat_summary.objects.get(note=note_obj)
+
+
+def build_chat_context(note_obj, new_message, model=None):
+    """Messages for the next chat turn, kept within the model's context budget.
+
+    The most recent messages are sent verbatim; older ones are folded into the
+    note's running chat_summary, a batch at a time, so the prompt size stays
+    roughly constant however long the conversation gets. Long notes contribute
+    only their title, outline and the passages relevant to the question. Call
+    this before the new user message is saved.
+    """
+    budget = context_budget(model)
+    summary_obj = _get_summary(note_obj)
+
+    unsummarized = list(chat_message.objects.filter(
+        note=note_obj, role__isnull=False, id__gt=summary_obj.summarized_through
+    ).order_by('id'))
+
+    # Follow-up questions ("and the second one?") are matched together with the previous question
+    previous_questions = [row.message for row in unsummarized if row.role == 'user'][-1:]
+    note_text = note_context(
+        note_obj, '\n'.join(previous_questions + [new_message]), min(settings.CHAT_NOTE_CONTEXT_TOKENS, budget // 2)
+    )
+
+    # Whatever the note and the new message leave over, minus room for the summary
+    fixed = estimate_message_tokens([chat_system_message(note_text), {'role': 'user', 'content': new_message}])
+    history_budget = max(0, budget - fixed - settings.CHAT_SUMMARY_MAX_TOKENS)
+
+    window = unsummarized[-settings.CHAT_RECENT_MESSAGES:] if settings.CHAT_RECENT_MESSAGES > 0 else []
+    while window and estimate_message_tokens(_as_messages(window)) > history_budget:
+        window = window[1:]
+    overflow = unsummarized[:len(unsummarized) - len(window)]
+    fits = estimate_message_tokens(_as_messages(unsummarized)) <= history_budget
+
+    if overflow and (len(overflow) >= settings.CHAT_SUMMARY_BATCH_MESSAGES or not fits):
+        try:
+            fold_into_summary(summary_obj, overflow, model)
+        except Exception:
+            logger.exception(f"Could not update the chat summary of note {note_obj.id}")
+            if fits:
+                window = unsummarized
+        window = [row for row in window if row.id > summary_obj.summarized_through]
+    else:
+        # Too few old messages to be worth a summary call yet; they still fit, so send them as they are
+        window = unsummarized
+
+    return (
+        [chat_system_message(note_text, summary_obj.summary)]
+        + _as_messages(window)
+        + [{"role": "user", "content": new_message}]
+    )
@@ -0,0 +1,126 @@
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+
+class PDFExtractor:
+    """Extracts plain text from a PDF, one string per page."""
+
+    name = None
+
+    def page_count(self, pdf_path):
+        raise NotImplementedError
+
+    def extract_range(self, pdf_path, start, stop):
+        raise NotImplementedError
+
+
+class PdfplumberExtractor(PDFExtractor):
+    # Layout-aware and slow; the original extraction engine
+    name = 'pdfplumber'
+
+    def page_count(self, pdf_path):
+        import pdfplumber
+
+        with pdfplumber.open(pdf_path) as pdf:
+            return len(pdf.pages)
+
+    def extract_range(self, pdf_path, start, stop):
+        import pdfplumber
+
+        with pdfplumber.open(pdf_path, pages=list(range(start + 1, stop + 1))) as pdf:
+            # extract_text() returns None for pages without a text layer
+            return [page.extract_text() or "" for page in pdf.pages]
+
+
+class PdfiumExtractor(PDFExtractor):
+    # Native PDFium text extraction, an order of magnitude faster than pdfplumber
+    name = 'pypdfium2'
+
+    def page_count(self, pdf_path):
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def extract_range(self, pdf_path, start, stop):
+        import pypdfium2
+
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        pages = []
+        try:
+            for index in range(start, stop):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range().replace("\r\n", "\n"))
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+        return pages
+
+
+EXTRACTORS = {
+    extractor.name: extractor for extractor in (PdfplumberExtractor, PdfiumExtractor)
+}
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_extractor(name=None):
+    name = name or settings.PDF_EXTRACTION_BACKEND
+    try:
+        return EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError(f'Unknown PDF extraction backend: {name}')
+
+
+def _get_pool():
+    # One pool of PDF_EXTRACTION_WORKERS processes per process, never replaced while it is in
+    # use: other request threads may be submitting to it. A pool inherited across fork is
+    # unusable, so the child builds its own
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context(settings.PDF_EXTRACTION_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=max(1, settings.PDF_EXTRACTION_WORKERS), mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _extract_range(backend, pdf_path, start, stop):
+    return EXTRACTORS[backend]().extract_range(pdf_path, start, stop)
+
+
+def split_page_ranges(page_count, workers, min_pages_per_worker):
+    # Contiguous page ranges, so each worker opens the document once
+    workers = max(1, min(workers, math.ceil(page_count / max(1, min_pages_per_worker))))
+    size = math.ceil(page_count / workers) if page_count else 0
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size or 1)]
+
+
+def extract_pages(pdf_path, backend=None, workers=None):
+    extractor = get_extractor(backend)
+    workers = workers if workers is not None else settings.PDF_EXTRACTION_WORKERS
+    page_count = extractor.page_count(pdf_path)
+    ranges = split_page_ranges(page_count, workers, settings.PDF_EXTRACTION_MIN_PAGES_PER_WORKER)
+
+    if len(ranges) <= 1:
+        return extractor.extract_range(pdf_path, 0, page_count)
+
+    # More ranges than pool processes simply queue
+    pool = _get_pool()
+    futures = [pool.submit(_extract_range, extractor.name, pdf_path, start, stop) for start, stop in ranges]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
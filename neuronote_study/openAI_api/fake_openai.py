@@ -0,0 +1,187 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .tokens import estimate_message_tokens, estimate_tokens
+
+# A stand-in for the OpenAI chat completions API, for load tests and local
+# development without network access or cost. Replies are canned but shaped
+# like the real ones, including the JSON formats the app asks for.
+
+FILLER = (
+    "Cells are the basic unit of life. Mitochondria produce ATP through oxidative phosphorylation, "
+    "while ribosomes translate messenger RNA into proteins. "
+)
+
+
+class LatencyModel:
+    """Time to the first byte of a response, in seconds.
+
+    Specs: "fixed:0.5", "uniform:0.2,1.5" or "lognormal:0.8,0.5" (median, sigma).
+    """
+
+    def __init__(self, spec='lognormal:0.8,0.5', rng=None):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(value) for value in params.split(',') if value]
+        self.rng = rng or random.Random()
+        if kind not in ('fixed', 'uniform', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution: {spec}')
+
+    def sample(self):
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return self.rng.uniform(*self.params[:2])
+        median, sigma = self.params[:2]
+        return self.rng.lognormvariate(math.log(median), sigma)
+
+
+def fake_content(body):
+    messages = body.get('messages') or []
+    prompt = messages[-1].get('content', '') if messages else ''
+    max_tokens = body.get('max_tokens') or body.get('max_completion_tokens') or 200
+
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        if 'flashcards' in prompt:
+            match = re.search(r'Generate (\d+)', prompt)
+            count = int(match.group(1)) if match else 1
+            return json.dumps({'flashcards': [
+                {
+                    'question': f'Which organelle is described in statement {index + 1}?',
+                    'options': ['Mitochondrion', 'Ribosome', 'Nucleus', 'Golgi apparatus', 'Lysosome'],
+                    'correct_index': index % 5,
+                } for index in range(count)
+            ]})
+        return json.dumps({'title': 'Cell Biology Basics', 'summary': (FILLER * 8).strip()})
+
+    # Plain text replies fill about half the allowed output
+    words = (FILLER * 40).split()
+    return ' '.join(words[:max(5, int(max_tokens * 0.75 / 2))])
+
+
+def completion_payload(body, content):
+    prompt_tokens = estimate_message_tokens(body.get('messages') or [])
+    completion_tokens = estimate_tokens(content)
+    return {
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'fake-model'),
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+    }
+
+
+def stream_chunks(body, content):
+    base = {'id': f'chatcmpl-{uuid.uuid4().hex}', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': body.get('model', 'fake-model')}
+    words = content.split(' ')
+    for index, word in enumerate(words):
+        delta = {'content': word if index == 0 else ' ' + word}
+        if index == 0:
+            delta['role'] = 'assistant'
+        yield dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': None}])
+    yield dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+    if (body.get('stream_options') or {}).get('include_usage'):
+        usage = completion_payload(body, content)['usage']
+        yield dict(base, choices=[], usage=usage)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeOpenAI/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+            return
+
+        self.server.count('requests')
+        if self.server.should_rate_limit():
+            self.server.count('rate_limited')
+            self._send_json(429, {'error': {'message': 'Rate limit reached (injected)', 'type': 'rate_limit_error', 'code': 'rate_limit_exceeded'}},
+                            headers={'Retry-After': str(self.server.retry_after)})
+            return
+
+        time.sleep(self.server.latency.sample())
+        content = fake_content(body)
+
+        if not body.get('stream'):
+            # Generation time for the whole reply, as the real API only answers once it is done
+            time.sleep(estimate_tokens(content) / self.server.tokens_per_second)
+            self._send_json(200, completion_payload(body, content))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for chunk in stream_chunks(body, content):
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+                delta = chunk['choices'][0]['delta'].get('content') if chunk['choices'] else None
+                if delta:
+                    time.sleep(estimate_tokens(delta) / self.server.tokens_per_second)
+            self.wfile.write(b'data: [DONE]\n\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-stream
+            self.server.count('disconnects')
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency='lognormal:0.8,0.5', error_rate=0.0, tokens_per_second=80.0,
+                 retry_after=1, seed=None, verbose=False):
+        super().__init__(address, FakeOpenAIHandler)
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.error_rate = error_rate
+        self.tokens_per_second = tokens_per_second
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.stats = {'requests': 0, 'rate_limited': 0, 'disconnects': 0}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def should_rate_limit(self):
+        with self._lock:
+            return self.rng.random() < self.error_rate
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
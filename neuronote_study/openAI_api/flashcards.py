@@ -0,0 +1,144 @@
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from api.models import flashcard, flashcard_answer
+from .client import get_async_client, get_client
+from .completions import acreate_chat_completion, create_chat_completion
+
+logger = logging.getLogger(__name__)
+
+OPTIONS_PER_CARD = 5
+# Output budget per card (question, five options, JSON punctuation)
+TOKENS_PER_CARD = 150
+
+
+class FlashcardFormatError(ValueError):
+    pass
+
+
+def deck_messages(note_text, count, existing_questions=()):
+    avoid = ''
+    if existing_questions:
+        avoid = "\n\nThe student already has these questions, do not repeat them:\n" + '\n'.join(f"- {question}" for question in existing_questions)
+    return [
+        {"role": "system", "content": "You are a multiple-choice quiz generator that writes study flashcards for a given text of summary notes. You reply with JSON only."},
+        {"role": "user", "content": f"""Generate {count} distinct multiple-choice flashcards for studying the following text. Only use what is provided in the text with small variations.
+
+Each flashcard has one question, exactly {OPTIONS_PER_CARD} answer options and exactly one correct option. Do not explain the answers.
+
+Reply with a JSON object in this exact shape:
+{{"flashcards": [{{"question": "<question text>", "options": ["<option>", "<option>", "<option>", "<option>", "<option>"], "correct_index": <0-{OPTIONS_PER_CARD - 1}>}}]}}
+
+Text:
+{note_text}{avoid}"""}
+    ]
+
+
+def _clean(value):
+    return value.strip() if isinstance(value, str) else ''
+
+
+def parse_flashcard_deck(content, count):
+    """Validate the model's JSON deck, dropping malformed cards; raises FlashcardFormatError if none are usable."""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        raise FlashcardFormatError("Flashcard response is not valid JSON")
+    cards = data.get('flashcards') if isinstance(data, dict) else None
+    if not isinstance(cards, list):
+        raise FlashcardFormatError("Flashcard response has no flashcards list")
+
+    deck = []
+    seen = set()
+    for card in cards:
+        if not isinstance(card, dict):
+            continue
+        question = _clean(card.get('question'))
+        options = card.get('options')
+        correct_index = card.get('correct_index')
+        if not question or question.lower() in seen or not isinstance(options, list) or len(options) != OPTIONS_PER_CARD:
+            continue
+        options = [_clean(option) for option in options]
+        # bool is an int subclass; "correct_index": true is not an index
+        if not all(options) or len({option.lower() for option in options}) != OPTIONS_PER_CARD:
+            continue
+        if isinstance(correct_index, bool) or not isinstance(correct_index, int) or not 0 <= correct_index < OPTIONS_PER_CARD:
+            continue
+        seen.add(question.lower())
+        deck.append({'question': question, 'options': options, 'correct_index': correct_index})
+
+    if len(deck) < len(cards):
+        logger.warning(f"Dropped {len(cards) - len(deck)} malformed flashcards")
+    if not deck:
+        raise FlashcardFormatError("Flashcard response contained no valid flashcards")
+    return deck[:count]
+
+
+def _deck_request(note_text, count, existing_questions):
+    return {
+        'cache': False,
+        'model': settings.OPENAI_CHAT_MODEL,
+        'messages': deck_messages(note_text, count, existing_questions),
+        'response_format': {"type": "json_object"},
+        'max_tokens': 100 + count * TOKENS_PER_CARD,
+        'temperature': 0.9,
+    }
+
+
+def generate_flashcard_deck(note_text, count, existing_questions=(), client=None):
+    """Generate up to `count` multiple-choice cards in a single structured completion."""
+    response = create_chat_completion(client or get_client(), **_deck_request(note_text, count, existing_questions))
+    return parse_flashcard_deck(response.choices[0].message.content, count)
+
+
+async def agenerate_flashcard_deck(note_text, count, existing_questions=(), client=None):
+    response = await acreate_chat_completion(client or get_async_client(), **_deck_request(note_text, count, existing_questions))
+    return parse_flashcard_deck(response.choices[0].message.content, count)
+
+
+def save_flashcard_deck(user, note_obj, deck):
+    # Two INSERTs for the whole deck; bulk_create sets primary keys on PostgreSQL and SQLite
+    with transaction.atomic():
+        cards = flashcard.objects.bulk_create([
+            flashcard(flashcard_title=note_obj.note_title, flashcard_question=card['question'], user=user, note=note_obj)
+            for card in deck
+        ])
+        flashcard_answer.objects.bulk_create([
+            flashcard_answer(flashcard_answer=card_obj, answer_text=option, is_correct=index == card['correct_index'])
+            for card_obj, card in zip(cards, deck)
+            for index, option in enumerate(card['options'])
+        ])
+    return [serialize_flashcard(card_obj, card) for card_obj, card in zip(cards, deck)]
+
+
+def serialize_flashcard(card_obj, card):
+    return {
+        'id': card_obj.id,
+        'title': card_obj.flashcard_title,
+        'question': card_obj.flashcard_question,
+        'answers': [{'text': option, 'is_correct': index == card['correct_index']} for index, option in enumerate(card['options'])]
+    }
+
+
+def _existing_questions(note_obj, limit):
+    return flashcard.objects.filter(note=note_obj).order_by('-created_at').values_list('flashcard_question', flat=True)[:limit]
+
+
+def existing_questions(note_obj, limit=50):
+    return list(_existing_questions(note_obj, limit))
+
+
+def create_flashcard_deck(user, note_obj, count, client=None):
+    deck = generate_flashcard_deck(note_obj.note_text, count, existing_questions(note_obj), client=client)
+    return save_flashcard_deck(user, note_obj, deck)
+
+
+async def acreate_flashcard_deck(user, note_obj, count, client=None):
+    avoid = [question async for question in _existing_questions(note_obj, 50)]
+    deck = await agenerate_flashcard_deck(note_obj.note_text, count, avoid, client=client)
+    # The two bulk INSERTs run in one transaction, which needs a sync connection
+    return await sync_to_async(save_flashcard_deck)(user, note_obj, deck)
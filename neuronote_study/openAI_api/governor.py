@@ -0,0 +1,369 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+import openai
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+
+from api.models import llm_rate_limit
+from .tokens import estimate_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Outbound OpenAI calls are admitted by priority class: chat before note
+# generation before bulk jobs. Lower classes may not dip into the share of the
+# shared per-minute budgets reserved for the classes above them.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTES = 1
+PRIORITY_BULK = 2
+
+_request_context = contextvars.ContextVar('llm_request_context', default=(PRIORITY_NOTES, None))
+_cancel_check = contextvars.ContextVar('llm_cancel_check', default=None)
+
+
+@contextlib.contextmanager
+def request_context(priority, user_id=None):
+    """Tag every completion made inside the block with a priority class and the user it is for."""
+    token = _request_context.set((priority, user_id))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+def current_request_context():
+    return _request_context.get()
+
+
+class RequestCancelled(Exception):
+    """The work a completion was for has been cancelled, so it is not sent."""
+
+
+@contextlib.contextmanager
+def cancel_when(check):
+    """Refuse every completion made inside the block (thread pools included) once `check()` is true."""
+    token = _cancel_check.set(check)
+    try:
+        yield
+    finally:
+        _cancel_check.reset(token)
+
+
+def _raise_if_cancelled():
+    check = _cancel_check.get()
+    if check is not None and check():
+        raise RequestCancelled('Cancelled before the completion was sent')
+
+
+class GovernorTimeout(Exception):
+    pass
+
+
+def _reserve(priority):
+    return {
+        PRIORITY_INTERACTIVE: 0.0,
+        PRIORITY_NOTES: settings.GOVERNOR_NOTES_RESERVE,
+        PRIORITY_BULK: settings.GOVERNOR_BULK_RESERVE,
+    }[priority]
+
+
+def _take(state, tokens, reserve, now):
+    """Refill the buckets in `state` and take one request and `tokens` tokens, keeping `reserve` of each untouched.
+
+    Returns (new_state, 0) on success, or (None, seconds to wait).
+    """
+    request_capacity = settings.GOVERNOR_REQUESTS_PER_MINUTE
+    token_capacity = settings.GOVERNOR_TOKENS_PER_MINUTE
+    if now < state['cooldown_until']:
+        return None, state['cooldown_until'] - now
+
+    elapsed = max(0.0, now - state['refilled_at'])
+    requests = min(request_capacity, state['request_allowance'] + elapsed * request_capacity / 60)
+    available_tokens = min(token_capacity, state['token_allowance'] + elapsed * token_capacity / 60)
+
+    # A prompt larger than the unreserved budget only has to wait for a full bucket, then runs into debt
+    needed_requests = reserve * request_capacity + 1
+    needed_tokens = reserve * token_capacity + min(tokens, (1 - reserve) * token_capacity)
+    wait = max(
+        (needed_requests - requests) * 60 / request_capacity,
+        (needed_tokens - available_tokens) * 60 / token_capacity,
+    )
+    if wait > 0:
+        return None, wait
+    return dict(state, request_allowance=requests - 1, token_allowance=available_tokens - tokens, refilled_at=now), 0
+
+
+class LocalBucketStore:
+    """Buckets in process memory, for single-process deployments and development."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def try_acquire(self, tokens, reserve, now):
+        with self._lock:
+            if self._state is None:
+                self._state = _full_state(now)
+            state, wait = _take(self._state, tokens, reserve, now)
+            if state is not None:
+                self._state = state
+            return wait
+
+    def cool_down(self, until):
+        with self._lock:
+            self._state = dict(self._state or _full_state(time.time()))
+            self._state['cooldown_until'] = max(self._state['cooldown_until'], until)
+
+
+class DatabaseBucketStore:
+    """Buckets in the llm_rate_limit table, shared by every worker process using the database."""
+
+    name = 'openai'
+    fields = ('request_allowance', 'token_allowance', 'refilled_at', 'cooldown_until', 'version')
+
+    def _row(self, now):
+        values = llm_rate_limit.objects.filter(name=self.name).values(*self.fields).first()
+        if values is None:
+            llm_rate_limit.objects.get_or_create(name=self.name, defaults=_full_state(now))
+            values = llm_rate_limit.objects.filter(name=self.name).values(*self.fields).first()
+        return values
+
+    def try_acquire(self, tokens, reserve, now):
+        # Compare-and-swap on version: a worker that loses the race re-reads and tries again
+        for _ in range(5):
+            state = self._row(now)
+            new_state, wait = _take(state, tokens, reserve, now)
+            if new_state is None:
+                return wait
+            version = new_state.pop('version')
+            if llm_rate_limit.objects.filter(name=self.name, version=version).update(version=version + 1, **new_state):
+                return 0
+        return 0.05
+
+    def cool_down(self, until):
+        llm_rate_limit.objects.filter(name=self.name, cooldown_until__lt=until).update(
+            cooldown_until=until, version=F('version') + 1
+        )
+
+
+def _full_state(now):
+    return {
+        'request_allowance': float(settings.GOVERNOR_REQUESTS_PER_MINUTE),
+        'token_allowance': float(settings.GOVERNOR_TOKENS_PER_MINUTE),
+        'refilled_at': now,
+        'cooldown_until': 0.0,
+    }
+
+
+class Governor:
+    """Admits outbound completions one at a time through the shared buckets.
+
+    Waiters in this process are served highest priority first, and within a
+    priority the user with the fewest admitted calls goes first, so one user's
+    bulk job cannot crowd out everybody else. The number of calls in flight is
+    an AIMD window: it grows by one per window of successful calls, and
+    shrinks on rate limit errors (halved) and slow responses.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._condition = threading.Condition()
+        self._waiters = {}
+        self._sequence = itertools.count()
+        self._served = Counter()
+        self._token_debt = 0
+        self.in_flight = 0
+        self.window = float(settings.GOVERNOR_MAX_CONCURRENCY)
+
+    def _head(self):
+        return min(self._waiters.values(), key=lambda waiter: (waiter[0], self._served[waiter[1]], waiter[2]))[2]
+
+    def acquire(self, priority, user_id, tokens, timeout=None):
+        timeout = timeout if timeout is not None else settings.GOVERNOR_MAX_WAIT_SECONDS
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            sequence = next(self._sequence)
+            self._waiters[sequence] = (priority, user_id, sequence)
+            # A new waiter may outrank the current head
+            self._condition.notify_all()
+
+        try:
+            while True:
+                with self._condition:
+                    while self._head() != sequence or self.in_flight >= int(self.window):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise GovernorTimeout(f'No OpenAI capacity within {timeout} seconds')
+                        self._condition.wait(remaining)
+                    cost = max(0, tokens + self._token_debt)
+
+                wait = self.store.try_acquire(cost, _reserve(priority), time.time())
+
+                with self._condition:
+                    if wait <= 0:
+                        self._token_debt = 0
+                        del self._waiters[sequence]
+                        self.in_flight += 1
+                        self._served[user_id] += 1
+                        self._condition.notify_all()
+                        return
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise GovernorTimeout(f'No OpenAI capacity within {timeout} seconds')
+                    self._condition.wait(min(wait, remaining))
+        except BaseException:
+            with self._condition:
+                self._waiters.pop(sequence, None)
+                self._condition.notify_all()
+            raise
+        finally:
+            with self._condition:
+                # Fair shares only matter between concurrent waiters
+                if not self._waiters:
+                    self._served.clear()
+
+    def release(self, latency, rate_limited=False, retry_after=None, estimated_tokens=0, used_tokens=None):
+        with self._condition:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                # Charged to the next call, so the token bucket tracks real usage
+                self._token_debt += used_tokens - estimated_tokens
+            if rate_limited:
+                self.window = max(1.0, self.window / 2)
+            elif latency > settings.GOVERNOR_LATENCY_TARGET_SECONDS:
+                self.window = max(1.0, self.window * 0.8)
+            else:
+                self.window = min(float(settings.GOVERNOR_MAX_CONCURRENCY), self.window + 1 / self.window)
+            self._condition.notify_all()
+
+        if rate_limited:
+            cooldown = retry_after if retry_after is not None else settings.GOVERNOR_COOLDOWN_SECONDS
+            logger.warning(f"OpenAI rate limit hit, pausing outbound calls for {cooldown:.1f}s")
+            self.store.cool_down(time.time() + cooldown)
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                store = DatabaseBucketStore() if settings.GOVERNOR_BACKEND == 'database' else LocalBucketStore()
+                _governor = Governor(store)
+    return _governor
+
+
+def reset_governor():
+    global _governor
+    with _governor_lock:
+        _governor = None
+
+
+class Slot:
+    def __init__(self, estimated_tokens):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens = None
+        self.latency = None
+        self._started = time.monotonic()
+
+    def responded(self):
+        # Latency is measured to the response headers, so long streams don't count as slow
+        if self.latency is None:
+            self.latency = time.monotonic() - self._started
+
+    def record_usage(self, usage):
+        if usage is not None:
+            self.used_tokens = usage.total_tokens
+
+
+def _estimate(kwargs):
+    return estimate_message_tokens(kwargs['messages']) + (kwargs.get('max_tokens') or kwargs.get('max_completion_tokens') or 0)
+
+
+def _retry_after(error):
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _release(governor, slot, error):
+    slot.responded()
+    rate_limited = isinstance(error, openai.RateLimitError)
+    governor.release(
+        slot.latency,
+        rate_limited=rate_limited,
+        retry_after=_retry_after(error) if rate_limited else None,
+        estimated_tokens=slot.estimated_tokens,
+        used_tokens=slot.used_tokens,
+    )
+
+
+@contextlib.contextmanager
+def governed(kwargs, context=None):
+    """Hold an admission slot for one completion request (`kwargs` as passed to create())."""
+    _raise_if_cancelled()
+    slot = Slot(_estimate(kwargs))
+    if not settings.GOVERNOR_ENABLED:
+        yield slot
+        return
+
+    governor = get_governor()
+    priority, user_id = context or _request_context.get()
+    governor.acquire(priority, user_id, slot.estimated_tokens)
+    slot._started = time.monotonic()
+    error = None
+    try:
+        yield slot
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _release(governor, slot, error)
+
+
+@contextlib.asynccontextmanager
+async def agoverned(kwargs, context=None):
+    if _cancel_check.get() is not None:
+        # Checks usually read the database
+        await sync_to_async(_raise_if_cancelled)()
+    slot = Slot(_estimate(kwargs))
+    if not settings.GOVERNOR_ENABLED:
+        yield slot
+        return
+
+    governor = get_governor()
+    priority, user_id = context or _request_context.get()
+    # acquire() blocks its thread until a slot frees up, so it must not take the shared
+    # thread_sensitive thread: the release that frees the slot (and every other
+    # sync_to_async call in the process) would queue behind it
+    acquire = asyncio.ensure_future(
+        sync_to_async(governor.acquire, thread_sensitive=False)(priority, user_id, slot.estimated_tokens)
+    )
+    try:
+        await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # The acquiring thread carries on; hand its slot straight back if it gets one
+        acquire.add_done_callback(
+            lambda done: done.cancelled() or done.exception() or _release(governor, slot, RequestCancelled())
+        )
+        raise
+    slot._started = time.monotonic()
+    error = None
+    try:
+        yield slot
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        await sync_to_async(_release, thread_sensitive=False)(governor, slot, error)
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+from openai.types.chat import ChatCompletion
+
+from api.models import llm_response_cache
+
+# Request parameters that change the completion; anything else (timeouts, headers) does not
+SAMPLING_PARAMS = (
+    'max_tokens', 'max_completion_tokens', 'temperature', 'top_p', 'n', 'stop', 'seed',
+    'presence_penalty', 'frequency_penalty', 'logit_bias', 'response_format', 'tools', 'tool_choice',
+)
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def cache_stats():
+    with _stats_lock:
+        snapshot = dict(stats)
+    lookups = snapshot.get('memory_hits', 0) + snapshot.get('db_hits', 0) + snapshot.get('misses', 0)
+    snapshot['hit_rate'] = (lookups - snapshot.get('misses', 0)) / lookups if lookups else 0.0
+    return snapshot
+
+
+def normalize_messages(messages):
+    normalized = []
+    for message in messages:
+        content = message.get('content') or ''
+        if isinstance(content, str):
+            content = content.replace('\r\n', '\n').strip()
+        entry = {'role': message['role'], 'content': content}
+        if message.get('name'):
+            entry['name'] = message['name']
+        normalized.append(entry)
+    return normalized
+
+
+def cache_key(model, messages, params):
+    payload = {
+        'model': model,
+        'messages': normalize_messages(messages),
+        'params': {name: params[name] for name in SAMPLING_PARAMS if params.get(name) is not None},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Bounded in-process cache with per-entry expiry."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+memory_cache = LRUCache(settings.LLM_CACHE_MEMORY_ENTRIES, settings.LLM_CACHE_TTL_SECONDS)
+
+
+def _as_cached(data):
+    # Cache hits cost no tokens, so they carry no usage
+    response = ChatCompletion.model_validate(data)
+    response.usage = None
+    return response
+
+
+def lookup(key):
+    data = memory_cache.get(key)
+    if data is not None:
+        _count('memory_hits')
+        return _as_cached(data)
+
+    now = timezone.now()
+    entry = llm_response_cache.objects.filter(cache_key=key, expires_at__gt=now).values_list('response', flat=True).first()
+    if entry is None:
+        _count('misses')
+        return None
+
+    _count('db_hits')
+    llm_response_cache.objects.filter(cache_key=key).update(hits=F('hits') + 1, last_used_at=now)
+    memory_cache.set(key, entry)
+    return _as_cached(entry)
+
+
+def store(key, model, response):
+    data = response.model_dump(mode='json')
+    memory_cache.set(key, data)
+    now = timezone.now()
+    try:
+        llm_response_cache.objects.update_or_create(
+            cache_key=key,
+            defaults={
+                'model': model,
+                'response': data,
+                'size_bytes': len(json.dumps(data)),
+                'last_used_at': now,
+                'expires_at': now + timedelta(seconds=settings.LLM_CACHE_TTL_SECONDS),
+            }
+        )
+    except IntegrityError:
+        # A concurrent request stored the same prompt first
+        pass
+    _count('stores')
+    if stats['stores'] % settings.LLM_CACHE_PRUNE_EVERY == 0:
+        prune()
+
+
+def prune():
+    """Drop expired entries, then least recently used ones until the table fits LLM_CACHE_DB_MAX_BYTES."""
+    deleted, _ = llm_response_cache.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    total = llm_response_cache.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+    excess = total - settings.LLM_CACHE_DB_MAX_BYTES
+    if excess <= 0:
+        return deleted
+
+    evict = []
+    for entry_id, size in llm_response_cache.objects.order_by('last_used_at').values_list('id', 'size_bytes').iterator():
+        evict.append(entry_id)
+        excess -= size
+        if excess <= 0:
+            break
+    for start in range(0, len(evict), 500):
+        deleted += llm_response_cache.objects.filter(id__in=evict[start:start + 500]).delete()[0]
+    return deleted
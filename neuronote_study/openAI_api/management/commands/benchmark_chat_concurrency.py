@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+
+from api.models import User, note, uploadPDF
+from openAI_api import client as client_registry
+from openAI_api.fake_openai import FakeOpenAIServer
+from openAI_api.metrics import percentile
+
+SYNC_PATH = '/openai/send-message/'
+ASYNC_PATH = '/openai/send-message/async/'
+
+
+class Command(BaseCommand):
+    help = ('Measures how many chat requests one process serves concurrently: the sync send-message view on a '
+            'fixed pool of worker threads (as under a threaded WSGI worker) against the async view under ASGI. '
+            'OpenAI is replaced by an in-process fake server with a fixed response time')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight from clients')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads for the sync view (gunicorn --threads)')
+        parser.add_argument('--latency', default='fixed:1.0', help='Fake OpenAI response time, see LatencyModel')
+        parser.add_argument('--mode', choices=['both', 'sync', 'async'], default='both')
+
+    def handle(self, *args, **options):
+        server = FakeOpenAIServer(('127.0.0.1', 0), latency=options['latency'], tokens_per_second=1e6)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        # Only the worker model is measured: no cache hits, governor queueing or connection pool limit
+        overrides = override_settings(
+            OPENAI_BASE_URL=server.base_url,
+            OPENAI_API_KEY='fake-key',
+            OPENAI_MAX_CONNECTIONS=options['concurrency'],
+            OPENAI_MAX_KEEPALIVE_CONNECTIONS=options['concurrency'],
+            LLM_CACHE_ENABLED=False,
+            GOVERNOR_ENABLED=False,
+            SINGLE_FLIGHT_ENABLED=False,
+        )
+        overrides.enable()
+        client_registry._reset_after_fork()
+        user = None
+        try:
+            user, token, note_ids = self.setup_data(options['requests'])
+            self.stdout.write(f"{options['requests']} chat requests, {options['concurrency']} in flight, "
+                              f"fake OpenAI latency {options['latency']}")
+            self.stdout.write(f"{'view':<28} {'wall s':>7} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+            if options['mode'] in ('both', 'sync'):
+                self.report(f"sync, {options['threads']} threads", *self.run_sync(token, note_ids, options))
+            if options['mode'] in ('both', 'async'):
+                self.report('async (ASGI)', *asyncio.run(self.run_async(token, note_ids, options)))
+        finally:
+            if user is not None:
+                user.delete()
+            overrides.disable()
+            client_registry._reset_after_fork()
+            server.shutdown()
+            server.server_close()
+
+    def setup_data(self, count):
+        name = f'benchmark-{uuid.uuid4().hex[:8]}'
+        user = User.objects.create_user(username=name, email=f'{name}@benchmark.invalid', password=uuid.uuid4().hex)
+        token = Token.objects.create(user=user)
+        pdf = uploadPDF.objects.create(pdf_file='benchmark.pdf', pdf_name='benchmark.pdf', user=user)
+        # One note per request, so no conversation grows long enough to be summarized mid-run
+        notes = note.objects.bulk_create([
+            note(note_title=f'Benchmark {index}', note_text='Mitochondria produce ATP.', user=user, note_key=pdf)
+            for index in range(count)
+        ])
+        return user, token.key, [note_obj.id for note_obj in notes]
+
+    def body(self, note_id, index):
+        return {'note_id': note_id, 'message': f'Question {index}: what do mitochondria do?'}
+
+    def run_sync(self, token, note_ids, options):
+        app = get_wsgi_application()
+        # Clients beyond the worker's threads wait for a free one, as they would in the listen backlog
+        worker_threads = threading.Semaphore(options['threads'])
+        local = threading.local()
+
+        def call(index):
+            if not hasattr(local, 'http'):
+                local.http = httpx.Client(transport=httpx.WSGITransport(app=app), base_url='http://localhost',
+                                          headers={'Authorization': f'Token {token}'}, timeout=None)
+            started = time.perf_counter()
+            with worker_threads:
+                response = local.http.post(SYNC_PATH, json=self.body(note_ids[index], index))
+            return time.perf_counter() - started, response.status_code < 400
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(call, range(len(note_ids))))
+        return results, time.perf_counter() - started
+
+    async def run_async(self, token, note_ids, options):
+        app = get_asgi_application()
+        pending = iter(range(len(note_ids)))
+        results = []
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://localhost',
+                                     headers={'Authorization': f'Token {token}'}, timeout=None) as http:
+            async def client():
+                for index in pending:
+                    started = time.perf_counter()
+                    response = await http.post(ASYNC_PATH, json=self.body(note_ids[index], index))
+                    results.append((time.perf_counter() - started, response.status_code < 400))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+            return results, time.perf_counter() - started
+
+    def report(self, label, results, elapsed):
+        latencies = [seconds * 1000 for seconds, _ in results]
+        self.stdout.write(
+            f"{label:<28} {elapsed:>7.1f} {len(results) / elapsed:>7.1f} {percentile(latencies, 0.5):>8.0f} "
+            f"{percentile(latencies, 0.95):>8.0f} {sum(not ok for _, ok in results):>7}"
+        )
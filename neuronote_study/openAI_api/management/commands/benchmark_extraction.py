@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from openAI_api.extractors import EXTRACTORS, extract_pages
+
+SAMPLE_LINE = 'Mitochondria produce ATP through oxidative phosphorylation in the inner membrane. {}'
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def build_sample_pdf(path, page_count, lines_per_page=40):
+    # Minimal hand-written PDF (Helvetica text pages) so the benchmark needs no extra dependencies
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,  # page tree, filled in once the page object numbers are known
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+    ]
+    page_refs = []
+    for page_number in range(1, page_count + 1):
+        lines = [f'BT /F1 10 Tf 50 {780 - i * 18} Td ({_escape(SAMPLE_LINE.format(f"p{page_number} l{i}"))}) Tj ET'
+                 for i in range(lines_per_page)]
+        stream = '\n'.join(lines).encode('latin-1')
+        objects.append(b'<< /Length ' + str(len(stream)).encode() + b' >>\nstream\n' + stream + b'\nendstream')
+        content_ref = len(objects)
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+            f'/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>'.encode()
+        )
+        page_refs.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(page_refs)}] /Count {page_count} >>'.encode()
+
+    with open(path, 'wb') as pdf:
+        pdf.write(b'%PDF-1.4\n')
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(pdf.tell())
+            pdf.write(f'{number} 0 obj\n'.encode() + body + b'\nendobj\n')
+        xref_offset = pdf.tell()
+        pdf.write(f'xref\n0 {len(objects) + 1}\n0000000000 65535 f \n'.encode())
+        for offset in offsets:
+            pdf.write(f'{offset:010d} 00000 n \n'.encode())
+        pdf.write(f'trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n'.encode())
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the PDF extraction backends on locally generated PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 1000], help='Document sizes to generate')
+        parser.add_argument('--backend', action='append', dest='backends', choices=sorted(EXTRACTORS), help='Backends to compare (default: all)')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4], help='Page ranges to split each document into; the pool itself has PDF_EXTRACTION_WORKERS processes')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per configuration, the best one is reported')
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or sorted(EXTRACTORS)
+        work_dir = tempfile.mkdtemp(prefix='extraction-bench-')
+
+        try:
+            self.stdout.write(f"{'pages':>6} {'backend':>10} {'workers':>7} {'seconds':>9} {'pages/s':>9}")
+            for page_count in options['pages']:
+                pdf_path = os.path.join(work_dir, f'sample-{page_count}.pdf')
+                build_sample_pdf(pdf_path, page_count)
+
+                for backend in backends:
+                    for workers in options['workers']:
+                        timings = []
+                        for _ in range(options['repeat']):
+                            started = time.perf_counter()
+                            pages = extract_pages(pdf_path, backend=backend, workers=workers)
+                            timings.append(time.perf_counter() - started)
+                        if len(pages) != page_count:
+                            self.stderr.write(f'{backend} returned {len(pages)} pages for a {page_count} page document')
+                        best = min(timings)
+                        self.stdout.write(f'{page_count:>6} {backend:>10} {workers:>7} {best:>9.3f} {page_count / best:>9.1f}')
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,178 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+from openAI_api.management.commands.benchmark_extraction import build_sample_pdf
+from openAI_api.metrics import percentile
+
+ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+
+class Recorder:
+    """Collects latency, status and server-side query counts per endpoint."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, method, url, response, elapsed):
+        label = f"{method} {ID_PATTERN.sub('/<id>', httpx.URL(url).path)}"
+        queries = response.headers.get('X-DB-Query-Count') if response is not None else None
+        with self._lock:
+            self.samples[label].append({
+                'ms': elapsed * 1000,
+                'ok': response is not None and response.status_code < 400,
+                'queries': int(queries) if queries is not None else None,
+            })
+
+
+class SyntheticUser:
+    """One student going through upload -> note -> flashcards -> chat against a running server."""
+
+    def __init__(self, base_url, recorder, name, password):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.name = name
+        self.password = password
+        self.http = httpx.Client(timeout=300)
+
+    def request(self, method, path, stream=False, **kwargs):
+        url = f'{self.base_url}{path}'
+        started = time.perf_counter()
+        response = None
+        try:
+            if stream:
+                with self.http.stream(method, url, **kwargs) as response:
+                    # Time to the whole reply; the first event arrives much earlier
+                    for _ in response.iter_bytes():
+                        pass
+            else:
+                response = self.http.request(method, url, **kwargs)
+            return response
+        finally:
+            self.recorder.record(method, url, response, time.perf_counter() - started)
+
+    def expect(self, response, action):
+        if response.status_code >= 400:
+            raise RuntimeError(f'{self.name}: {action} failed with {response.status_code}: {response.text[:200]}')
+        return response.json()
+
+    def sign_in(self):
+        self.request('POST', '/api/register/', json={
+            'username': self.name, 'email': f'{self.name}@loadtest.invalid', 'password': self.password,
+            'first_name': 'Load', 'last_name': 'Test',
+        })
+        data = self.expect(self.request('POST', '/api/login/', json={'username': self.name, 'password': self.password}), 'login')
+        self.http.headers['Authorization'] = f"Token {data['token']}"
+
+    def wait_for_job(self, job_id, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.expect(self.request('GET', f'/api/jobs/{job_id}/'), 'job status')['job']
+            if job['status'] == 'succeeded':
+                return job['result']
+            if job['status'] == 'failed':
+                raise RuntimeError(f"{self.name}: job {job_id} failed: {job['error']}")
+            if job['status'] == 'cancelled':
+                raise RuntimeError(f'{self.name}: job {job_id} was cancelled')
+            time.sleep(1)
+        raise RuntimeError(f'{self.name}: job {job_id} did not finish within {timeout}s')
+
+    def run(self, pdf_path, cards, chat_turns, stream_chat, job_timeout):
+        self.sign_in()
+        with open(pdf_path, 'rb') as pdf:
+            upload = self.expect(self.request('POST', '/api/upload-pdf/', files={'pdf_file': (os.path.basename(pdf_path), pdf, 'application/pdf')}), 'upload')
+        note_id = self.wait_for_job(upload['job_id'], job_timeout)['note_id']
+
+        self.expect(self.request('GET', '/openai/notes/'), 'notes')
+        self.expect(self.request('POST', '/openai/generate-flashcard-deck/', json={'note_id': note_id, 'count': cards}), 'flashcard deck')
+        self.expect(self.request('GET', f'/openai/get-flashcards/{note_id}/'), 'flashcards')
+
+        for turn in range(chat_turns):
+            message = {'note_id': note_id, 'message': f'Question {turn + 1}: what are the key points about mitochondria?'}
+            if stream_chat:
+                # The endpoint the frontend streams from
+                response = self.request('POST', '/openai/send-message/stream-async/', stream=True, json=message)
+                if response.status_code >= 400:
+                    raise RuntimeError(f'{self.name}: chat stream failed with {response.status_code}')
+            else:
+                self.expect(self.request('POST', '/openai/send-message/', json=message), 'chat')
+        self.expect(self.request('GET', f'/openai/get-messages/{note_id}/'), 'messages')
+
+    def close(self):
+        self.http.close()
+
+
+class Command(BaseCommand):
+    help = ('Load-tests a running server end to end (upload -> note -> flashcards -> chat) with synthetic users. '
+            'Run the server with OPENAI_USE_FAKE_SERVER=True and QUERY_COUNT_HEADERS=True, next to run_fake_openai and run_job_worker')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=20, help='Synthetic users, each running the whole flow once')
+        parser.add_argument('--concurrency', type=int, default=10, help='Users running at the same time')
+        parser.add_argument('--pages', type=int, default=10, help='Pages in the generated sample PDF')
+        parser.add_argument('--pdf', default=None, help='Upload this PDF instead of a generated one')
+        parser.add_argument('--cards', type=int, default=10)
+        parser.add_argument('--chat-turns', type=int, default=3)
+        parser.add_argument('--stream', action='store_true', help='Use the streaming chat endpoint')
+        parser.add_argument('--job-timeout', type=int, default=300)
+
+    def handle(self, *args, **options):
+        recorder = Recorder()
+        run_id = uuid.uuid4().hex[:8]
+        work_dir = tempfile.mkdtemp(prefix='load-test-')
+        pdf_path = options['pdf']
+        if pdf_path is None:
+            pdf_path = os.path.join(work_dir, 'sample.pdf')
+            build_sample_pdf(pdf_path, options['pages'])
+
+        def run_user(index):
+            user = SyntheticUser(options['base_url'], recorder, f'load-{run_id}-{index}', f'load-test-{run_id}')
+            try:
+                user.run(pdf_path, options['cards'], options['chat_turns'], options['stream'], options['job_timeout'])
+            finally:
+                user.close()
+
+        started = time.perf_counter()
+        failures = []
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as pool:
+                futures = [pool.submit(run_user, index) for index in range(options['users'])]
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failures.append(str(e))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - started
+
+        if not recorder.samples:
+            raise CommandError(f'No requests completed against {options["base_url"]}')
+        self.report(recorder, elapsed, options['users'], failures)
+
+    def report(self, recorder, elapsed, users, failures):
+        total = sum(len(samples) for samples in recorder.samples.values())
+        self.stdout.write(f'{users - len(failures)}/{users} flows completed in {elapsed:.1f}s, '
+                          f'{total / elapsed:.1f} requests/s, {(users - len(failures)) / elapsed * 60:.1f} flows/min')
+        self.stdout.write(f"{'endpoint':<48} {'reqs':>5} {'errors':>6} {'req/s':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}")
+        for label, samples in sorted(recorder.samples.items()):
+            latencies = [sample['ms'] for sample in samples]
+            queries = [sample['queries'] for sample in samples if sample['queries'] is not None]
+            mean_queries = f'{sum(queries) / len(queries):.1f}' if queries else '-'
+            self.stdout.write(
+                f"{label:<48} {len(samples):>5} {sum(not sample['ok'] for sample in samples):>6} {len(samples) / elapsed:>6.2f} "
+                f"{percentile(latencies, 0.5):>8.0f} {percentile(latencies, 0.95):>8.0f} {percentile(latencies, 0.99):>8.0f} {mean_queries:>8}"
+            )
+        for failure in failures[:10]:
+            self.stderr.write(failure)
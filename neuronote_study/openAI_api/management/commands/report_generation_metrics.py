@@ -0,0 +1,40 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import generation_metric
+from openAI_api.metrics import percentile
+
+
+class Command(BaseCommand):
+    help = 'Reports latency and token usage per generation mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operation', default=None, help='Only report this operation (e.g. note)')
+        parser.add_argument('--days', type=int, default=30, help='Only include generations from the last N days')
+
+    def handle(self, *args, **options):
+        metrics = generation_metric.objects.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['operation']:
+            metrics = metrics.filter(operation=options['operation'])
+
+        groups = defaultdict(list)
+        for row in metrics.values('operation', 'mode', 'latency_ms', 'calls', 'prompt_tokens', 'completion_tokens').iterator():
+            groups[(row['operation'], row['mode'])].append(row)
+
+        if not groups:
+            self.stdout.write('No generation metrics recorded')
+            return
+
+        self.stdout.write(f"{'operation':<12} {'mode':<12} {'runs':>6} {'p50 ms':>8} {'p95 ms':>8} {'calls':>6} {'prompt tok':>11} {'compl tok':>10}")
+        for (operation, mode), rows in sorted(groups.items()):
+            latencies = [row['latency_ms'] for row in rows]
+            runs = len(rows)
+            self.stdout.write(
+                f"{operation:<12} {mode:<12} {runs:>6} {percentile(latencies, 0.5):>8} {percentile(latencies, 0.95):>8} "
+                f"{sum(row['calls'] for row in rows) / runs:>6.1f} "
+                f"{sum(row['prompt_tokens'] for row in rows) / runs:>11.0f} "
+                f"{sum(row['completion_tokens'] for row in rows) / runs:>10.0f}"
+            )
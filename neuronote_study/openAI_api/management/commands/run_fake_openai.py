@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from openAI_api.fake_openai import FakeOpenAIServer
+
+
+class Command(BaseCommand):
+    help = 'Serves a fake OpenAI chat completions API for load tests (point the app at it with OPENAI_USE_FAKE_SERVER=True)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=settings.FAKE_OPENAI_PORT)
+        parser.add_argument('--latency', default='lognormal:0.8,0.5',
+                            help='Time to first byte: fixed:S, uniform:MIN,MAX or lognormal:MEDIAN,SIGMA (seconds)')
+        parser.add_argument('--tokens-per-second', type=float, default=80.0, help='Generation speed of replies and streams')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with a 429')
+        parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with injected 429s')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        server = FakeOpenAIServer(
+            (options['host'], options['port']),
+            latency=options['latency'],
+            error_rate=options['error_rate'],
+            tokens_per_second=options['tokens_per_second'],
+            retry_after=options['retry_after'],
+            seed=options['seed'],
+            verbose=options['verbose'],
+        )
+        self.stdout.write(f'Fake OpenAI API listening on {server.base_url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Served {server.stats['requests']} requests ({server.stats['rate_limited']} rate limited)")
@@ -0,0 +1,47 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from api.models import generation_metric
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class UsageTracker:
+    """Wraps an OpenAI client and adds up the calls and tokens of every completion made through it."""
+
+    def __init__(self, client):
+        self.client = client
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        response = self.client.chat.completions.create(**kwargs)
+        self.add(response)
+        return response
+
+    def add(self, response):
+        usage = getattr(response, 'usage', None)
+        with self._lock:
+            self.calls += 1
+            if usage is not None:
+                self.prompt_tokens += usage.prompt_tokens or 0
+                self.completion_tokens += usage.completion_tokens or 0
+
+    def record(self, operation, mode):
+        return generation_metric.objects.create(
+            operation=operation,
+            mode=mode,
+            latency_ms=int((time.perf_counter() - self.started) * 1000),
+            calls=self.calls,
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens
+        )
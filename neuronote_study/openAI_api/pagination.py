@@ -0,0 +1,57 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+# Keyset ("cursor") pagination, newest first. A page is found with a WHERE on the
+# last row seen rather than an OFFSET, so deep pages cost the same as the first
+# and rows created between requests do not shift the pages.
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{pk}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidPage('Invalid cursor') from e
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    if value in (None, ''):
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise InvalidPage('limit must be a number')
+    if size < 1:
+        raise InvalidPage('limit must be at least 1')
+    return min(size, MAX_PAGE_SIZE)
+
+
+def keyset_page(queryset, cursor, limit):
+    """One page of `queryset` ordered by (created_at, id) descending, starting after `cursor`.
+
+    Returns the rows and the cursor for the next page, which is None on the last page.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        # Rows created in the same instant share created_at, so id breaks the tie
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.created_at, last.id)
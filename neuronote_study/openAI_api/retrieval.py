@@ -0,0 +1,193 @@
+import hashlib
+import re
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from api.models import note_chunk
+from .summarize import HEADING_PATTERN
+from .tokens import CHARS_PER_TOKEN, estimate_tokens
+
+# Generated notes mark sections with markdown headings or bold lines ("**Key Points:**")
+BOLD_HEADING_PATTERN = re.compile(r'^\*\*[^*]{2,80}\*\*:?$')
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by can do does for from has have how i in is it its me my of on or so that the '
+    'their them then there these they this to was we what when where which who why will with you your'.split()
+)
+
+
+def is_heading(line):
+    line = line.strip()
+    return bool(line) and bool(HEADING_PATTERN.match(line) or BOLD_HEADING_PATTERN.match(line))
+
+
+def clean_heading(line):
+    return line.strip().lstrip('#').strip().strip('*').rstrip(':').strip()[:255]
+
+
+def outline(note_text, limit=30):
+    return [clean_heading(line) for line in note_text.splitlines() if is_heading(line)][:limit]
+
+
+def split_passages(note_text, budget=None):
+    """Split a note into (heading, passage) pairs of at most `budget` estimated tokens, at paragraph boundaries."""
+    budget = budget or settings.RETRIEVAL_CHUNK_TOKENS
+    max_chars = budget * CHARS_PER_TOKEN
+    passages = []
+    heading = ''
+    current = []
+
+    def close_passage():
+        text = '\n'.join(current).strip()
+        if text:
+            passages.append((heading, text))
+
+    for paragraph in re.split(r'\n\s*\n', note_text):
+        lines = paragraph.strip().splitlines()
+        if lines and is_heading(lines[0]):
+            close_passage()
+            current = []
+            heading = clean_heading(lines[0])
+            lines = lines[1:]
+        paragraph = '\n'.join(lines).strip()
+        if not paragraph:
+            continue
+        if current and estimate_tokens('\n'.join(current + [paragraph])) > budget:
+            close_passage()
+            current = []
+        # A single paragraph over budget is sliced
+        for start in range(0, len(paragraph), max_chars):
+            if current and start:
+                close_passage()
+                current = []
+            current.append(paragraph[start:start + max_chars])
+
+    close_passage()
+    return passages
+
+
+def tokenize(text):
+    return [word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 1 and word not in STOP_WORDS]
+
+
+def _bucket(word, dim):
+    value = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little')
+    # The sign bit keeps colliding words from reinforcing each other
+    return value % dim, 1.0 if (value // dim) & 1 else -1.0
+
+
+def vectorize(texts, dim=None):
+    """Sublinear term frequency hashing vectors, L2 normalised, one row per text."""
+    dim = dim or settings.RETRIEVAL_VECTOR_DIM
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in tokenize(text):
+            index, sign = _bucket(word, dim)
+            matrix[row, index] += sign
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _source_hash(note_text):
+    # The vector size is part of the key, so changing it re-embeds every note
+    return hashlib.sha256(f'{settings.RETRIEVAL_VECTOR_DIM}:{note_text}'.encode('utf-8')).hexdigest()
+
+
+def _chunk_hash(heading, text):
+    return hashlib.sha256(f'{settings.RETRIEVAL_VECTOR_DIM}:{heading}\n{text}'.encode('utf-8')).hexdigest()
+
+
+def index_note(note_obj):
+    """(Re)build a note's passage index, embedding only passages that changed since the last build."""
+    source_hash = _source_hash(note_obj.note_text)
+    passages = split_passages(note_obj.note_text)
+
+    existing = {}
+    for chunk in note_chunk.objects.filter(note=note_obj).defer('vector'):
+        existing.setdefault(chunk.chunk_hash, []).append(chunk)
+
+    kept = []
+    added = []
+    for index, (heading, text) in enumerate(passages):
+        key = _chunk_hash(heading, text)
+        if existing.get(key):
+            chunk = existing[key].pop()
+            chunk.chunk_index = index
+            chunk.source_hash = source_hash
+            kept.append(chunk)
+        else:
+            added.append(note_chunk(
+                note=note_obj, chunk_index=index, chunk_hash=key, source_hash=source_hash, heading=heading, text=text
+            ))
+
+    if added:
+        vectors = vectorize([f'{chunk.heading}\n{chunk.text}' for chunk in added])
+        for chunk, vector in zip(added, vectors):
+            chunk.vector = vector.tobytes()
+
+    stale = [chunk.id for chunks in existing.values() for chunk in chunks]
+    with transaction.atomic():
+        if stale:
+            note_chunk.objects.filter(id__in=stale).delete()
+        if kept:
+            note_chunk.objects.bulk_update(kept, ['chunk_index', 'source_hash'])
+        if added:
+            note_chunk.objects.bulk_create(added)
+    return len(added)
+
+
+def ensure_index(note_obj):
+    # Notes written before the index existed, or changed without index_note(), are (re)built on first use
+    indexed = note_chunk.objects.filter(note=note_obj).values_list('source_hash', flat=True).first()
+    if indexed != _source_hash(note_obj.note_text):
+        index_note(note_obj)
+
+
+def retrieve(note_obj, query, k=None, token_budget=None):
+    """The note's passages most similar to `query`, at most k of them within `token_budget`, in note order."""
+    k = k or settings.RETRIEVAL_TOP_K
+    chunks = list(note_chunk.objects.filter(note=note_obj))
+    if not chunks:
+        return []
+
+    matrix = np.frombuffer(b''.join(bytes(chunk.vector) for chunk in chunks), dtype=np.float32).reshape(len(chunks), -1)
+    # Weight terms by how rare they are within this note, so words shared by every passage count for little
+    document_frequency = (matrix != 0).sum(axis=0)
+    idf = np.log((1 + len(chunks)) / (1 + document_frequency)) + 1
+    weighted = matrix * idf
+    weighted /= np.maximum(np.linalg.norm(weighted, axis=1, keepdims=True), 1e-9)
+    query_vector = vectorize([query], dim=matrix.shape[1])[0] * idf
+    scores = weighted @ (query_vector / max(np.linalg.norm(query_vector), 1e-9))
+
+    selected = []
+    used = 0
+    for position in np.argsort(-scores, kind='stable')[:k]:
+        tokens = estimate_tokens(chunks[position].text)
+        if token_budget is not None and selected and used + tokens > token_budget:
+            break
+        selected.append(chunks[position])
+        used += tokens
+    return sorted(selected, key=lambda chunk: chunk.chunk_index)
+
+
+def note_context(note_obj, query, token_budget):
+    """Note text for a chat prompt: the whole note when it is short, otherwise title, outline and the passages relevant to `query`."""
+    note_text = note_obj.note_text
+    if estimate_tokens(note_text) <= min(settings.RETRIEVAL_FULL_TEXT_TOKENS, token_budget):
+        return note_text
+
+    ensure_index(note_obj)
+    parts = [f"Title: {note_obj.note_title or 'Untitled'}"]
+    headings = outline(note_text)
+    if headings:
+        parts.append("Outline:\n" + '\n'.join(f"- {heading}" for heading in headings))
+    header_tokens = estimate_tokens('\n\n'.join(parts))
+
+    passages = retrieve(note_obj, query, token_budget=max(0, token_budget - header_tokens))
+    parts.append("Relevant passages:\n" + '\n\n'.join(
+        f"[{chunk.heading}]\n{chunk.text}" if chunk.heading else chunk.text for chunk in passages
+    ))
+    return '\n\n'.join(parts)
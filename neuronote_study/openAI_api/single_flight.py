@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from api.idempotency import HEADER, json_response, response_data
+from api.models import inflight_request
+
+# Double-clicks and client retries on the LLM-backed endpoints would start a
+# second completion for the same request while the first is still running.
+# The first request for a (user, endpoint, payload) takes a lease row in the
+# database, so duplicates in any worker process wait for its response instead.
+# Only requests that arrive while it runs share that response: one sent after
+# it finished is a deliberate repeat and runs again. Requests carrying
+# different Idempotency-Keys are different requests and never coalesce.
+
+_finished = 0
+_finished_lock = threading.Lock()
+
+
+def _payload(data):
+    # Form and multipart bodies are QueryDicts; JSON bodies are plain dicts
+    return dict(data.lists()) if hasattr(data, 'lists') else data
+
+
+def flight_key(user_id, endpoint, data, url_kwargs=None, idempotency_key=None):
+    payload = {
+        'user': user_id, 'endpoint': endpoint, 'data': _payload(data), 'kwargs': url_kwargs or {},
+        'idempotency_key': idempotency_key,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _lease_until(now):
+    return now + timedelta(seconds=settings.SINGLE_FLIGHT_LEASE_SECONDS)
+
+
+def try_lead(key, user, endpoint, owner):
+    """Take the lease for `key`; False if another request holds it."""
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            inflight_request.objects.create(
+                flight_key=key, user=user, endpoint=endpoint, owner=owner, lease_expires_at=_lease_until(now)
+            )
+        return True
+    except IntegrityError:
+        pass
+
+    # A leader that died without finishing is taken over, and so is a finished flight: its
+    # response is kept only for the requests that were already waiting on it
+    return inflight_request.objects.filter(flight_key=key).filter(
+        Q(status=inflight_request.STATUS_RUNNING, lease_expires_at__lt=now) |
+        Q(status=inflight_request.STATUS_DONE)
+    ).update(
+        owner=owner,
+        status=inflight_request.STATUS_RUNNING,
+        lease_expires_at=_lease_until(now),
+        response_status=None,
+        response=None,
+        expires_at=None
+    ) == 1
+
+
+RUNNING = object()
+
+
+def check(key):
+    """(status_code, data) once the flight has a response, None when it is gone or its leader died, else RUNNING."""
+    flight = inflight_request.objects.filter(flight_key=key).values(
+        'status', 'lease_expires_at', 'response_status', 'response', 'expires_at'
+    ).first()
+    now = timezone.now()
+    if flight is None:
+        return None
+    if flight['status'] == inflight_request.STATUS_DONE:
+        if flight['expires_at'] < now:
+            return None
+        return flight['response_status'], flight['response']
+    if flight['lease_expires_at'] < now:
+        return None
+    return RUNNING
+
+
+def wait_for(key, timeout):
+    """Poll the flight until its leader finishes.
+
+    Returns (status_code, data) when a response is available, None when the
+    flight is gone or its leader died (the caller should lead), and raises
+    TimeoutError when it is still running at the deadline.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = check(key)
+        if result is not RUNNING:
+            return result
+        if time.monotonic() >= deadline:
+            raise TimeoutError
+        time.sleep(settings.SINGLE_FLIGHT_POLL_SECONDS)
+
+
+async def await_for(key, timeout):
+    # wait_for() for the async views; the sleep between polls holds no thread
+    deadline = time.monotonic() + timeout
+    while True:
+        result = await sync_to_async(check)(key)
+        if result is not RUNNING:
+            return result
+        if time.monotonic() >= deadline:
+            raise TimeoutError
+        await asyncio.sleep(settings.SINGLE_FLIGHT_POLL_SECONDS)
+
+
+def finish(key, owner, response):
+    # Only successful and client-error responses are shared; after a failure the duplicates make their own attempt
+    flights = inflight_request.objects.filter(flight_key=key, owner=owner, status=inflight_request.STATUS_RUNNING)
+    if response is not None and response.status_code < 500:
+        flights.update(
+            status=inflight_request.STATUS_DONE,
+            response_status=response.status_code,
+            response=response_data(response),
+            expires_at=timezone.now() + timedelta(seconds=settings.SINGLE_FLIGHT_RESULT_SECONDS)
+        )
+    else:
+        flights.delete()
+
+    global _finished
+    with _finished_lock:
+        _finished += 1
+        prune_now = _finished % settings.SINGLE_FLIGHT_PRUNE_EVERY == 0
+    if prune_now:
+        prune()
+
+
+def prune():
+    now = timezone.now()
+    return inflight_request.objects.filter(
+        Q(status=inflight_request.STATUS_DONE, expires_at__lt=now) |
+        Q(status=inflight_request.STATUS_RUNNING, lease_expires_at__lt=now)
+    ).delete()[0]
+
+
+def _still_running():
+    response = Response({
+        'status': 'error',
+        'message': 'An identical request is still being processed'
+    }, status=status.HTTP_409_CONFLICT)
+    response['Retry-After'] = '1'
+    return response
+
+
+def _shared(shared):
+    response_status, data = shared
+    response = Response(data, status=response_status)
+    response['X-Single-Flight'] = 'shared'
+    return response
+
+
+def single_flight(endpoint):
+    """Coalesce concurrent identical requests to a view's post(): one runs, the others get its response.
+
+    A waiter holds a worker thread, so it gives up with a 409 after SINGLE_FLIGHT_SYNC_WAIT_SECONDS,
+    well inside the worker timeout; the client's retry joins the flight again.
+    """
+    def decorator(post):
+        @functools.wraps(post)
+        def wrapper(view, request, *args, **kwargs):
+            if not settings.SINGLE_FLIGHT_ENABLED or not request.user.is_authenticated:
+                return post(view, request, *args, **kwargs)
+
+            key = flight_key(request.user.id, endpoint, request.data, kwargs, request.headers.get(HEADER))
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + settings.SINGLE_FLIGHT_SYNC_WAIT_SECONDS
+            while not try_lead(key, request.user, endpoint, owner):
+                try:
+                    shared = wait_for(key, max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    return _still_running()
+                if shared is not None:
+                    return _shared(shared)
+
+            response = None
+            try:
+                response = post(view, request, *args, **kwargs)
+                return response
+            finally:
+                finish(key, owner, response)
+        return wrapper
+    return decorator
+
+
+def asingle_flight(endpoint):
+    """single_flight() for the async views, which are called as view(request, user, data) and return JsonResponses.
+
+    Flights are keyed as for the sync views, so a duplicate may go to either version of a view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, user, data, **kwargs):
+            if not settings.SINGLE_FLIGHT_ENABLED:
+                return await view(request, user, data, **kwargs)
+
+            key = flight_key(user.id, endpoint, data, kwargs, request.headers.get(HEADER))
+            owner = uuid.uuid4().hex
+            deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_SECONDS
+            while not await sync_to_async(try_lead)(key, user, endpoint, owner):
+                try:
+                    shared = await await_for(key, max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    return json_response(_still_running())
+                if shared is not None:
+                    return json_response(_shared(shared))
+
+            response = None
+            try:
+                response = await view(request, user, data, **kwargs)
+                return response
+            finally:
+                await sync_to_async(finish)(key, owner, response)
+        return wrapper
+    return decorator
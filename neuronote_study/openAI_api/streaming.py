@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+from api.models import chat_message
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream until the reply is complete
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _record_interrupted(parts, user, note_obj, question):
+    # The client went away mid-reply. Text already generated (and paid for) is kept so the
+    # conversation reads sensibly; a question that got no reply at all is removed with it
+    logger.info(f"Chat reply for note {note_obj.id} interrupted by the client after {len(parts)} deltas")
+    if parts:
+        chat_message.objects.create(message=''.join(parts), role="assistant", user=user, note=note_obj)
+    elif question is not None:
+        question.delete()
+
+
+def chat_reply_events(deltas, user, note_obj, question=None):
+    """Forward reply deltas as SSE events and persist the assembled reply once the stream completes.
+
+    If the client disconnects, the server closes this generator at its next write; the
+    upstream completion is closed first so generation stops, then the partial reply is recorded.
+    """
+    parts = []
+    try:
+        for delta in deltas:
+            parts.append(delta)
+            yield sse_event('delta', {'content': delta})
+    except GeneratorExit:
+        deltas.close()
+        _record_interrupted(parts, user, note_obj, question)
+        raise
+    except Exception as e:
+        logger.exception("Chat reply stream failed")
+        yield sse_event('error', {'message': str(e)})
+        return
+    finally:
+        deltas.close()
+
+    assistant_message = chat_message.objects.create(message=''.join(parts), role="assistant", user=user, note=note_obj)
+    yield sse_event('done', {'message_id': assistant_message.id, 'message': assistant_message.message})
+
+
+async def achat_reply_events(deltas, user, note_obj, question=None):
+    # Under ASGI a disconnect cancels the request (see api/middleware.py CancelOnDisconnect)
+    parts = []
+    try:
+        async for delta in deltas:
+            parts.append(delta)
+            yield sse_event('delta', {'content': delta})
+    except (GeneratorExit, asyncio.CancelledError):
+        await deltas.aclose()
+        await sync_to_async(_record_interrupted)(parts, user, note_obj, question)
+        raise
+    except Exception as e:
+        logger.exception("Chat reply stream failed")
+        yield sse_event('error', {'message': str(e)})
+        return
+    finally:
+        await deltas.aclose()
+
+    assistant_message = await chat_message.objects.acreate(message=''.join(parts), role="assistant", user=user, note=note_obj)
+    yield sse_event('done', {'message_id': assistant_message.id, 'message': assistant_message.message})
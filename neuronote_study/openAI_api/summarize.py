@@ -0,0 +1,172 @@
+import contextvars
+import hashlib
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import IntegrityError
+
+from api.models import chunk_summary
+from .completions import create_chat_completion
+from .tokens import CHARS_PER_TOKEN, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Bump when the map prompt changes so stale chunk summaries are not reused
+MAP_PROMPT_VERSION = 1
+
+# Markdown headings, numbered headings ("2.3 Cell respiration"), chapter markers and short all-caps lines
+HEADING_PATTERN = re.compile(
+    r'^(#{1,6}\s+\S.*'
+    r'|(?i:chapter|section|part)\s+[\dIVXLC]+\b.{0,80}'
+    r'|\d+(\.\d+)*\.?\s+[A-Z].{0,60}'
+    r'|[A-Z][A-Z0-9 ,:&/\-]{3,80})$'
+)
+
+
+def split_sections(text):
+    # Split text at heading lines so oversized pages break at topic boundaries
+    sections = []
+    current = []
+    for line in text.splitlines(keepends=True):
+        if current and HEADING_PATTERN.match(line.strip()):
+            sections.append(''.join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append(''.join(current))
+    return sections
+
+
+def _pieces(text, budget):
+    if estimate_tokens(text) <= budget:
+        yield text
+        return
+    max_chars = budget * CHARS_PER_TOKEN
+    for section in split_sections(text):
+        if estimate_tokens(section) <= budget:
+            yield section
+            continue
+        # No usable heading: fall back to paragraphs, then to fixed-size slices
+        for paragraph in re.split(r'(?<=\n)\s*\n', section):
+            for start in range(0, len(paragraph), max_chars):
+                yield paragraph[start:start + max_chars]
+
+
+def chunk_pages(pages, budget=None):
+    """Pack pages into chunks of at most `budget` estimated tokens, splitting only oversized pages."""
+    budget = budget or settings.SUMMARY_CHUNK_TOKENS
+    chunks = []
+    current = []
+    current_tokens = 0
+    first_page = last_page = 1
+
+    def close_chunk():
+        chunks.append({'text': '\n\n'.join(current), 'first_page': first_page, 'last_page': last_page})
+
+    for page_number, page_text in enumerate(pages, start=1):
+        for piece in _pieces(page_text, budget):
+            if not piece.strip():
+                continue
+            piece_tokens = estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > budget:
+                close_chunk()
+                current = []
+                current_tokens = 0
+            if not current:
+                first_page = page_number
+            current.append(piece)
+            current_tokens += piece_tokens
+            last_page = page_number
+
+    if current:
+        close_chunk()
+    return chunks
+
+
+def chunk_key(text, model):
+    return hashlib.sha256(f'{MAP_PROMPT_VERSION}:{model}:{text}'.encode('utf-8')).hexdigest()
+
+
+def _map_chunk(client, model, text):
+    # Map results are persisted in chunk_summary, so they skip the response cache
+    response = create_chat_completion(
+        client,
+        cache=False,
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that summarizes one section of a longer document for a student's study notes."},
+            {"role": "user", "content": f"Summarize the following section and list its key points, facts, definitions and formulas. Keep it dense, it will be merged with the summaries of the other sections:\n\n{text}"}
+        ],
+        max_tokens=settings.SUMMARY_MAP_MAX_TOKENS,
+        temperature=0.3
+    )
+    return response.choices[0].message.content
+
+
+def summarize_chunks(client, chunks, content_hash=None, model=None):
+    """Summarize each chunk concurrently, reusing any summaries persisted by an earlier run."""
+    model = model or settings.OPENAI_CHAT_MODEL
+    keys = [chunk_key(chunk['text'], model) for chunk in chunks]
+    summaries = dict(chunk_summary.objects.filter(chunk_hash__in=keys).values_list('chunk_hash', 'summary'))
+    missing = [(index, key, chunk) for index, (key, chunk) in enumerate(zip(keys, chunks)) if key not in summaries]
+
+    errors = []
+    if missing:
+        workers = max(1, min(settings.SUMMARY_MAP_CONCURRENCY, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # copy_context() carries the caller's governor priority into the worker threads
+            futures = {
+                pool.submit(contextvars.copy_context().run, _map_chunk, client, model, chunk['text']): (index, key)
+                for index, key, chunk in missing
+            }
+            # Persist every finished map call, even if others fail, so a retry only pays for the failures
+            for future in as_completed(futures):
+                index, key = futures[future]
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                try:
+                    chunk_summary.objects.create(chunk_hash=key, content_hash=content_hash, chunk_index=index, summary=summary)
+                except IntegrityError:
+                    pass
+                summaries[key] = summary
+
+    if errors:
+        logger.error(f"{len(errors)} of {len(chunks)} chunk summaries failed")
+        raise errors[0]
+    return [summaries[key] for key in keys]
+
+
+def reduce_summaries(client, summaries, content_hash=None, model=None):
+    model = model or settings.OPENAI_CHAT_MODEL
+    budget = settings.SUMMARY_CHUNK_TOKENS
+
+    # Summaries that still don't fit are merged in rounds, reusing the map step (and its persistence)
+    while len(summaries) > 1 and estimate_tokens('\n\n'.join(summaries)) > budget:
+        merged = summarize_chunks(client, chunk_pages(summaries, budget), content_hash, model)
+        if len(merged) >= len(summaries):
+            break
+        summaries = merged
+
+    sections = '\n\n'.join(f"Section {index}:\n{summary}" for index, summary in enumerate(summaries, start=1))
+    response = create_chat_completion(
+        client,
+        model=model,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that summarizes documents and provides a list of key points on the given document's main topic."},
+            {"role": "user", "content": f"The following are summaries of consecutive sections of one document. Please combine them into a single summary of the whole document and provide key points:\n\n{sections}\n\nFeel free to add your own notes to the text when needed. Also feel free to add emojis to the text when needed for better readability and comprehension."}
+        ],
+        max_tokens=1000,
+        temperature=0.7
+    )
+    return response.choices[0].message.content
+
+
+def map_reduce_summary(client, pages, content_hash=None, model=None):
+    chunks = chunk_pages(pages)
+    summaries = summarize_chunks(client, chunks, content_hash, model)
+    return reduce_summaries(client, summaries, content_hash, model)
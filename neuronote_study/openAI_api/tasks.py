@@ -0,0 +1,167 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+from api.jobs import PermanentJobError, cancellation_check, enqueue_job, report_progress
+from api.models import flashcard, note, notebook_note, uploadPDF
+from .flashcards import existing_questions, generate_flashcard_deck, save_flashcard_deck
+from .governor import PRIORITY_BULK, PRIORITY_NOTES, RequestCancelled, cancel_when, request_context
+from .retrieval import ensure_index
+from .util import PDFTextError, create_note_from_pdf
+
+logger = logging.getLogger(__name__)
+
+# Queue priority of pre-generation jobs; anything a user is waiting on is claimed first
+PREGENERATION_JOB_PRIORITY = -10
+
+
+def process_pdf_job(job):
+    try:
+        pdf = uploadPDF.objects.get(id=job.payload.get('pdf_id'), user=job.user)
+    except uploadPDF.DoesNotExist:
+        raise PermanentJobError('PDF not found')
+
+    # A retry, or a worker that took over an expired lease, must not generate (and pay for)
+    # the note again: a note made for this PDF since the job was queued is its result
+    new_note = note.objects.filter(note_key=pdf, user=job.user, created_at__gte=job.created_at).order_by('id').first()
+    if new_note is not None:
+        # The earlier attempt may have stopped before indexing it
+        ensure_index(new_note)
+    else:
+        try:
+            # Completions renew the lease as they go; once the job is cancelled (or its lease lost)
+            # no further completions are sent, and map summaries already paid for are kept
+            with request_context(PRIORITY_NOTES, job.user_id), cancel_when(cancellation_check(job)):
+                new_note = create_note_from_pdf(pdf, job.user)
+        except PDFTextError as e:
+            raise PermanentJobError(str(e))
+        except RequestCancelled:
+            logger.info(f"Job {job.id} was cancelled or lost its lease, no note created")
+            return {'cancelled': True}
+
+    pregeneration_job = schedule_note_pregeneration(new_note)
+    return {
+        'note_id': new_note.id,
+        'note_title': new_note.note_title,
+        'pdf_id': pdf.pdf_key,
+        'pregeneration_job_id': pregeneration_job.id if pregeneration_job else None
+    }
+
+
+def schedule_note_pregeneration(note_obj):
+    # Opt-in: queue the starter deck and chat index for a new note, behind everything else
+    if not settings.NOTE_PREGENERATION:
+        return None
+    return enqueue_job(
+        'pregenerate_note',
+        payload={'note_id': note_obj.id},
+        user=note_obj.user,
+        priority=PREGENERATION_JOB_PRIORITY
+    )
+
+
+def pregenerate_note_job(job):
+    """Prepare what the flashcards and chat screens of a new note need before they are opened.
+
+    Steps already done (by an earlier attempt or by the user) are skipped, and
+    the job stops at the next step once it is cancelled.
+    """
+    progress = dict(job.progress or {})
+    note_obj = note.objects.filter(id=job.payload.get('note_id'), user=job.user).only('id', 'note_title', 'note_text').first()
+    if note_obj is None:
+        # Deleted before the job ran; nothing left to prepare
+        return dict(progress, skipped='note deleted')
+
+    if not report_progress(job, progress):
+        return progress
+    ensure_index(note_obj)
+    progress['chat_index'] = 'ready'
+
+    if not report_progress(job, progress):
+        return progress
+    if flashcard.objects.filter(note=note_obj).exists():
+        progress['starter_deck'] = 'skipped'
+    else:
+        try:
+            # Renews the lease while the completion waits its turn, and is refused once the job is cancelled
+            with request_context(PRIORITY_BULK, job.user_id), cancel_when(cancellation_check(job)):
+                deck = generate_flashcard_deck(note_obj.note_text, settings.NOTE_PREGENERATION_DECK_SIZE)
+        except RequestCancelled:
+            logger.info(f"Job {job.id} was cancelled or lost its lease, no starter deck generated")
+            return progress
+        # The user may have cancelled, or made a deck of their own, while the completion ran
+        if not report_progress(job, progress):
+            return progress
+        if flashcard.objects.filter(note=note_obj).exists():
+            progress['starter_deck'] = 'skipped'
+        else:
+            progress['starter_deck'] = len(save_flashcard_deck(job.user, note_obj, deck))
+
+    report_progress(job, progress)
+    return progress
+
+
+def deck_note_ids(user, note_ids=None, notebook_page_id=None):
+    # The user's notes named directly or pinned to one of their notebook pages, in a stable order
+    if notebook_page_id is not None:
+        note_ids = notebook_note.objects.filter(
+            notebook_page_id=notebook_page_id, notebook_page__user=user
+        ).values_list('note_id', flat=True)
+    return list(note.objects.filter(id__in=list(note_ids or []), user=user).order_by('id').values_list('id', flat=True))
+
+
+def generate_decks_job(job):
+    """Generate a flashcard deck for each note, `DECK_GENERATION_CONCURRENCY` completions at a time.
+
+    Each deck is saved as soon as it is generated and recorded in the job's
+    progress, so a retried or restarted job only generates the missing ones.
+    """
+    note_ids = job.payload.get('note_ids') or []
+    count = job.payload.get('count', 10)
+    progress = dict(job.progress or {})
+    completed = set(progress.get('completed', []))
+    progress.update({'total': len(note_ids), 'completed': sorted(completed), 'failed': {}, 'cards': progress.get('cards', 0)})
+
+    notes = list(note.objects.filter(id__in=note_ids, user=job.user).exclude(id__in=completed).only('id', 'note_title', 'note_text'))
+    report_progress(job, progress)
+    if not notes:
+        return progress
+
+    # Questions to avoid are read up front; the worker threads only talk to the API
+    avoid = {note_obj.id: existing_questions(note_obj) for note_obj in notes}
+    workers = max(1, min(settings.DECK_GENERATION_CONCURRENCY, len(notes)))
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        with request_context(PRIORITY_BULK, job.user_id), cancel_when(cancellation_check(job)):
+            # Each call runs in a copy of this context, so the governor sees it as bulk work for this user
+            # and refuses the calls not yet sent once the job is cancelled
+            futures = {
+                pool.submit(contextvars.copy_context().run, generate_flashcard_deck, note_obj.note_text, count, avoid[note_obj.id]): note_obj
+                for note_obj in notes
+            }
+        for future in as_completed(futures):
+            note_obj = futures[future]
+            try:
+                cards = save_flashcard_deck(job.user, note_obj, future.result())
+            except RequestCancelled:
+                # Not sent, the job was cancelled; decks that finished meanwhile are still saved
+                continue
+            except Exception as e:
+                logger.error(f"Deck generation for note {note_obj.id} failed: {str(e)}")
+                progress['failed'][str(note_obj.id)] = str(e)
+            else:
+                completed.add(note_obj.id)
+                progress['completed'] = sorted(completed)
+                progress['cards'] += len(cards)
+            if not report_progress(job, progress):
+                # Cancelled, or the lease passed to another worker; either way this outcome is not recorded
+                return progress
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    if progress['failed']:
+        # Retried with backoff by the queue; finished decks are skipped next time
+        raise RuntimeError(f"{len(progress['failed'])} of {len(note_ids)} decks failed")
+    return progress
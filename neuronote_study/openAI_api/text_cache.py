@@ -0,0 +1,65 @@
+from django.db import IntegrityError, transaction
+
+from api.models import extracted_text, extracted_text_page
+from api.storage import hash_stored_file, local_copy
+from .extractors import extract_pages
+
+# Pages are joined the same way the text of a PDF always has been
+PAGE_SEPARATOR = "\n\n"
+
+
+def get_content_hash(pdf):
+    # Uploads from before content addressing get their digest filled in lazily
+    if not pdf.content_hash:
+        pdf.content_hash, pdf.byte_size = hash_stored_file(pdf.pdf_file)
+        pdf.save(update_fields=['content_hash', 'byte_size'])
+    return pdf.content_hash
+
+
+def _store_pages(content_hash, pages):
+    page_rows = []
+    offset = 0
+    for page_number, page_text in enumerate(pages, start=1):
+        length = len((page_text + PAGE_SEPARATOR).encode('utf-8'))
+        page_rows.append(extracted_text_page(
+            page_number=page_number,
+            text=page_text,
+            byte_offset=offset,
+            byte_length=length
+        ))
+        offset += length
+
+    try:
+        with transaction.atomic():
+            document = extracted_text.objects.create(
+                content_hash=content_hash,
+                page_count=len(page_rows),
+                byte_size=offset
+            )
+            for page in page_rows:
+                page.document = document
+            extracted_text_page.objects.bulk_create(page_rows)
+    except IntegrityError:
+        # Another worker extracted the same document first, its copy is identical
+        pass
+
+
+def get_pdf_pages(pdf):
+    """Return the text of each page of the PDF, extracting it only the first time its contents are seen."""
+    content_hash = get_content_hash(pdf)
+    cached = extracted_text_page.objects.filter(
+        document__content_hash=content_hash
+    ).order_by('page_number').values_list('text', flat=True)
+    pages = list(cached)
+    if pages or extracted_text.objects.filter(content_hash=content_hash).exists():
+        return pages
+
+    with local_copy(pdf.pdf_file.name) as path:
+        pages = extract_pages(path)
+    _store_pages(content_hash, pages)
+    return pages
+
+
+def get_pdf_text(pdf):
+    return "".join(page + PAGE_SEPARATOR for page in get_pdf_pages(pdf))
+
@@ -0,0 +1,15 @@
+# Rough token accounting without a tokenizer dependency: English text averages
+# about four characters per token for the GPT-4o family
+CHARS_PER_TOKEN = 4
+# Per-message overhead added by the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS for message in messages) + 2
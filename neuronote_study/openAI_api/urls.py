@@ -1,13 +1,22 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('pdfs/', views.GetUserPDFsView.as_view(), name='get-user-pdfs'),
     path('process-pdfs/', views.ProcessPDFsView.as_view(), name='process-pdfs'),
     path('notes/', views.GetNotesView.as_view(), name='get-notes'),
+    path('notes/<int:note_id>/', views.GetNoteView.as_view(), name='get-note'),
     path('generate-flashcards/', views.generateFlashcardsView.as_view(), name='generate-flashcards'),
+    path('generate-flashcard-deck/', views.generateFlashcardDeckView.as_view(), name='generate-flashcard-deck'),
+    path('generate-decks/', views.generateDecksView.as_view(), name='generate-decks'),
     path('get-flashcards/', views.getFlashcardsView.as_view(), name='get-flashcards'),
     path('get-flashcards/<int:note_id>/', views.getFlashcardsView.as_view(), name='get-note-flashcards'),
     path('get-messages/<int:note_id>/', views.getMessagesView.as_view(), name='get-messages'),
     path('send-message/', views.sendMessageView.as_view(), name='send-message'),
+    path('send-message/stream/', views.sendMessageStreamView.as_view(), name='send-message-stream'),
+    path('send-message/stream-async/', async_views.send_message_stream, name='send-message-stream-async'),
+    # Async versions of the LLM-bound endpoints, for ASGI workers (see gunicorn.conf.py)
+    path('send-message/async/', async_views.send_message, name='send-message-async'),
+    path('generate-flashcards/async/', async_views.generate_flashcards, name='generate-flashcards-async'),
+    path('create-note/async/', async_views.create_note, name='create-note-async'),
 ]
@@ -1,7 +1,23 @@
-import openai
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
 from api.models import *
 import os
-import pdfplumber
+from .text_cache import get_pdf_pages, get_pdf_text
+from .summarize import map_reduce_summary
+from .tokens import estimate_tokens
+from .metrics import UsageTracker
+from .client import get_async_client, get_client
+from .context import build_chat_context
+from .retrieval import index_note
+from .completions import acreate_chat_completion, astream_chat_completion, create_chat_completion, stream_chat_completion
+from django.conf import settings
+
+
+class PDFTextError(Exception):
+    pass
 
 
 def getPDFInfo(user_key):
@@ -13,113 +29,173 @@ def getPDFInfo(user_key):
         pdf_info.append({"pdf_file": pdf.pdf_file, "pdf_name": pdf.pdf_name, "key": pdf.pdf_key})
     return pdf_info
 
-def extract_text_from_pdf(pdf_path):
-    text = ""
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n\n"
-    return text
-
-def generate_summary_and_title(pdf):
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    # Get the absolute path of the PDF file
-    pdf_path = pdf.pdf_file.path
-
-    # Extract text from PDF
-    pdf_text = extract_text_from_pdf(pdf_path)
-    
-    if not pdf_text.strip():
-        raise Exception("Could not extract text from PDF")
-
-    # Create the completion
-    text_response = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that summarizes documents and provides a list of key points on the given document's main topic."},
-            {"role": "user", "content": f"Please summarize the following document and provide key points:\n\n{pdf_text}, feel free to add your own notes to the text when needed. Also feel free to add emojis to the text when needed for better readability and comprehension."}
-        ],
+NOTE_GENERATION_MODES = ('sequential', 'structured', 'derived', 'first_page', 'concurrent')
+
+def summary_messages(text):
+    return [
+        {"role": "system", "content": "You are a helpful assistant that summarizes documents and provides a list of key points on the given document's main topic."},
+        {"role": "user", "content": f"Please summarize the following document and provide key points:\n\n{text}, feel free to add your own notes to the text when needed. Also feel free to add emojis to the text when needed for better readability and comprehension."}
+    ]
+
+def title_messages(text):
+    return [
+        {"role": "system", "content": "You are a helpful assistant that generates titles for documents."},
+        {"role": "user", "content": f"Please generate a title for the following document:\n\n{text}, please generate a title that sums up the main topic of the document and that is a plain string of text with no headings or other formatting."}
+    ]
+
+def generate_summary(client, text):
+    response = create_chat_completion(
+        client,
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=summary_messages(text),
         max_tokens=1000,
         temperature=0.7
     )
+    return response.choices[0].message.content
 
-    title_response = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that generates titles for documents."},
-            {"role": "user", "content": f"Please generate a title for the following document:\n\n{pdf_text}, please generate a title that sums up the main topic of the document and that is a plain string of text with no headings or other formatting."}
-        ],
+def generate_title(client, text):
+    response = create_chat_completion(
+        client,
+        cache=False,
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=title_messages(text),
         max_tokens=30,
         temperature=1.2
     )
+    return response.choices[0].message.content
 
-    return {
-        "text": text_response.choices[0].message.content,
-        "title": title_response.choices[0].message.content
-        }
-
-def generate_flashcards(note_text):
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    flashcard_question = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
+def generate_structured_summary_and_title(client, text):
+    # One completion returns both, so the document is only sent once
+    response = create_chat_completion(
+        client,
+        model=settings.OPENAI_CHAT_MODEL,
         messages=[
-            {"role": "system", "content": "You are a helpful assistant that generates questions for a given text of summary notes."},
-            {"role": "user", "content": f"Please generate a purposeful question for studying the following text, only use what is provided in the text with small variations:\n\n{note_text}"}
+            {"role": "system", "content": "You are a helpful assistant that summarizes documents and provides a list of key points on the given document's main topic. You always answer with a JSON object."},
+            {"role": "user", "content": f"Please summarize the following document and provide key points, feel free to add your own notes to the text when needed. Also feel free to add emojis to the text when needed for better readability and comprehension. Also generate a title that sums up the main topic of the document as a plain string of text with no headings or other formatting.\n\nAnswer with a JSON object of the form {{\"title\": \"...\", \"summary\": \"...\"}}.\n\nDocument:\n\n{text}"}
         ],
-        max_tokens=100,
-        temperature=0.7
+        max_tokens=1100,
+        temperature=0.7,
+        response_format={"type": "json_object"}
     )
-    
-    flashcard_answers = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that generates answers for a given text of summary notes."},
-            {"role": "user", "content": f"""
-                                        You are a multiple-choice quiz generator.
-
-                                        Task:
-                                        Generate one multiple-choice question using the provided question and reference text.
-
-                                        Inputs:
-                                        - Question: {flashcard_question.choices[0].message.content}
-                                        - Reference Text: {note_text}
-
-                                        Output Format (strict):
-                                        1. Provide 5 answer options labeled A–E.
-                                        2. Mark exactly ONE correct answer with a leading asterisk (*).
-                                        3. Do NOT explain the answer.
-                                        4. Follow this exact format with no additional text:
-
-                                        Q: <question text>
-                                        A. <option>
-                                        B. <option>
-                                        C. <option>
-                                        D. <option>
-                                        E. <option>
-
-                                        Example (format only):
-                                        Q: What is 2 + 2?
-                                        A. 3
-                                        B. 5
-                                        C. *4
-                                        D. 6
-                                        E. 9
-
-                                        Begin:
-                                        """
-                                        }
-        ],
-        max_tokens=300,
-        temperature=1.2
+    data = json.loads(response.choices[0].message.content)
+    if not isinstance(data, dict) or not data.get("summary") or not data.get("title"):
+        raise ValueError("Structured completion did not return a summary and a title")
+    return data["summary"], data["title"]
+
+def generate_summary_and_title_concurrently(client, text):
+    # Two threads on the shared client and its connection pool; copy_context() carries
+    # the caller's governor priority and cancellation check into them
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        summary = pool.submit(contextvars.copy_context().run, generate_summary, client, text)
+        title = pool.submit(contextvars.copy_context().run, generate_title, client, text)
+        return summary.result(), title.result()
+
+async def agenerate_summary_and_title(tracker, text):
+    client = get_async_client()
+    summary_response, title_response = await asyncio.gather(
+        acreate_chat_completion(
+            client,
+            model=settings.OPENAI_CHAT_MODEL,
+            messages=summary_messages(text),
+            max_tokens=1000,
+            temperature=0.7
+        ),
+        acreate_chat_completion(
+            client,
+            cache=False,
+            model=settings.OPENAI_CHAT_MODEL,
+            messages=title_messages(text),
+            max_tokens=30,
+            temperature=1.2
+        )
     )
+    # Cache hits carry no usage and cost nothing
+    for response in (summary_response, title_response):
+        if response.usage is not None:
+            tracker.add(response)
+    return summary_response.choices[0].message.content, title_response.choices[0].message.content
+
+def generate_summary_and_title(pdf, pdf_text=None, mode=None):
+    mode = mode or settings.NOTE_GENERATION_MODE
+    if mode not in NOTE_GENERATION_MODES:
+        raise ValueError(f"Unknown note generation mode: {mode}")
+    client = UsageTracker(get_client())
+
+    # Extracted text is cached per file contents
+    if pdf_text is None:
+        pdf_text = get_pdf_text(pdf)
+    
+    if not pdf_text.strip():
+        raise Exception("Could not extract text from PDF")
 
-    print(flashcard_answers.choices[0].message.content)
+    if estimate_tokens(pdf_text) > settings.SUMMARY_SINGLE_PASS_TOKENS:
+        # Too long for one prompt: summarize chunks concurrently, then combine the chunk summaries
+        mode = 'map_reduce'
+        summary = map_reduce_summary(client, get_pdf_pages(pdf), pdf.content_hash)
+        title = generate_title(client, summary)
+    elif mode == 'structured':
+        summary, title = generate_structured_summary_and_title(client, pdf_text)
+    elif mode == 'concurrent':
+        summary, title = generate_summary_and_title_concurrently(client, pdf_text)
+    else:
+        summary = generate_summary(client, pdf_text)
+        if mode == 'derived':
+            title_source = summary
+        elif mode == 'first_page':
+            title_source = next((page for page in get_pdf_pages(pdf) if page.strip()), pdf_text)
+        else:
+            title_source = pdf_text
+        title = generate_title(client, title_source)
+
+    # Latency and tokens per mode, so the default can be chosen from real numbers
+    client.record('note', mode)
 
     return {
-        "flashcard_question": flashcard_question.choices[0].message.content,
-        "flashcard_answers": flashcard_answers.choices[0].message.content
-    }
+        "text": summary,
+        "title": title
+        }
+
+def create_note_from_pdf(pdf, user):
+    # First check if we can extract text from the PDF
+    pdf_text = get_pdf_text(pdf)
+    if not pdf_text.strip():
+        raise PDFTextError("Could not extract text from PDF")
+
+    note_data = generate_summary_and_title(pdf, pdf_text)
+
+    note_obj = note.objects.create(
+        note_title=note_data["title"],
+        note_text=note_data["text"],
+        user=user,
+        note_key=pdf
+    )
+    # Build the chat retrieval index now rather than on the first question
+    index_note(note_obj)
+    return note_obj
+
+async def acreate_note_from_pdf(pdf, user):
+    # Extraction, map-reduce summaries and indexing stay on worker threads; short documents
+    # are summarized on the event loop, with summary and title requested concurrently
+    pdf_text = await sync_to_async(get_pdf_text)(pdf)
+    if not pdf_text.strip():
+        raise PDFTextError("Could not extract text from PDF")
+
+    if estimate_tokens(pdf_text) > settings.SUMMARY_SINGLE_PASS_TOKENS:
+        note_data = await sync_to_async(generate_summary_and_title)(pdf, pdf_text)
+    else:
+        tracker = UsageTracker(None)
+        summary, title = await agenerate_summary_and_title(tracker, pdf_text)
+        await sync_to_async(tracker.record)('note', 'concurrent')
+        note_data = {"text": summary, "title": title}
+
+    note_obj = await note.objects.acreate(
+        note_title=note_data["title"],
+        note_text=note_data["text"],
+        user=user,
+        note_key=pdf
+    )
+    await sync_to_async(index_note)(note_obj)
+    return note_obj
 
 def get_previous_messages(note_id):
     fetched_results = chat_message.objects.filter(note_id=note_id).order_by('created_at')
@@ -133,35 +209,45 @@ def get_previous_messages(note_id):
 
     return old_messages
 
-def generate_assistant_chat_message(old_messages, new_message, note_text):
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    # Create a system message that includes the note text as context
-    system_message = {
-        "role": "system",
-        "content": f"""You are a helpful assistant discussing the following note:
-        
-        {note_text}
-
-        Please use this information to provide relevant and contextual responses. 
-        If the user's question is not related to the note content, you can still help but make it clear that you're going beyond the note's scope.
-        """
-    }
-
-    # Combine system message with conversation history
-    full_messages = [system_message] + old_messages + [{"role": "user", "content": new_message}]
+def generate_assistant_chat_message(messages):
+    client = get_client()
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini-2024-07-18",
-        messages=full_messages,
+    response = create_chat_completion(
+        client,
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=messages,
         max_tokens=1000,
         temperature=0.7
     )
 
     return response.choices[0].message.content
 
+async def agenerate_assistant_chat_message(messages):
+    response = await acreate_chat_completion(
+        get_async_client(),
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=messages,
+        max_tokens=1000,
+        temperature=0.7
+    )
 
+    return response.choices[0].message.content
 
-    
-    
+def stream_assistant_chat_message(messages):
+    # Same request as generate_assistant_chat_message, yielding the reply as it is generated
+    return stream_chat_completion(
+        get_client(),
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=messages,
+        max_tokens=1000,
+        temperature=0.7
+    )
 
+def astream_assistant_chat_message(messages):
+    return astream_chat_completion(
+        get_async_client(),
+        model=settings.OPENAI_CHAT_MODEL,
+        messages=messages,
+        max_tokens=1000,
+        temperature=0.7
+    )
@@ -1,10 +1,21 @@
 from django.shortcuts import render
+from django.conf import settings
+from django.db.models import Prefetch
+from django.urls import reverse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from api.models import *
 from .util import *
+from api.idempotency import idempotent
+from api.jobs import enqueue_job
+from .flashcards import FlashcardFormatError, create_flashcard_deck
+from .tasks import deck_note_ids, schedule_note_pregeneration
+from .governor import PRIORITY_INTERACTIVE, PRIORITY_NOTES, request_context
+from .pagination import InvalidPage, decode_cursor, keyset_page, page_size
+from .single_flight import single_flight
+from .streaming import chat_reply_events, sse_response
 import openai
 
 # Create your views here.
@@ -55,39 +66,30 @@ class createNoteView(APIView):
             # Get the PDF object
             pdf = uploadPDF.objects.get(pdf_key=pdf_key, user=request.user)
             
-            # Generate summary using OpenAI
+            # Generate summary using OpenAI and create the note
             try:
-                # First check if we can extract text from the PDF
-                pdf_text = extract_text_from_pdf(pdf.pdf_file.path)
-                if not pdf_text.strip():
-                    return Response({
-                        'status': 'error',
-                        'message': 'Could not extract text from PDF'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-
-                note_data = generate_summary_and_title(pdf)
-                note_text = note_data["text"]
-                note_title = note_data["title"]
+                with request_context(PRIORITY_NOTES, request.user.id):
+                    new_note = create_note_from_pdf(pdf, request.user)
+            except PDFTextError as e:
+                return Response({
+                    'status': 'error',
+                    'message': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
             except Exception as e:
                 return Response({
                     'status': 'error',
                     'message': f'Failed to generate summary or title: {str(e)}'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-            # Create the note
-            new_note = note.objects.create(
-                note_title=note_title,
-                note_text=note_text,
-                user=request.user,
-                note_key=pdf
-            )
+
+            pregeneration_job = schedule_note_pregeneration(new_note)
             
             return Response({
                 'status': 'success',
                 'message': 'Note created successfully',
                 'note_id': new_note.id,
-                'note_text': note_text,
-                'note_title': note_title
+                'note_text': new_note.note_text,
+                'note_title': new_note.note_title,
+                'pregeneration_job_id': pregeneration_job.id if pregeneration_job else None
             }, status=status.HTTP_201_CREATED)
             
         except uploadPDF.DoesNotExist:
@@ -105,12 +107,18 @@ class createNoteView(APIView):
 class ProcessPDFsView(APIView):
     permission_classes = [IsAuthenticated]
     
+    @idempotent('process-pdfs')
+    @single_flight('process-pdfs')
     def post(self, request):
         try:
-            # Get the PDFs that were just uploaded
-            pdfs = uploadPDF.objects.filter(
-                user=request.user
-            ).order_by('-created_at')[:1]  # Get only the most recently uploaded PDF
+            pdf_key = request.data.get('pdf_key')
+            pdfs = uploadPDF.objects.filter(user=request.user)
+
+            if pdf_key:
+                pdfs = pdfs.filter(pdf_key=pdf_key)
+            else:
+                # Fall back to the most recently uploaded PDF for older clients
+                pdfs = pdfs.order_by('-created_at')[:1]
             
             if not pdfs.exists():
                 return Response({
@@ -118,24 +126,21 @@ class ProcessPDFsView(APIView):
                     'message': 'No PDFs found to process'
                 }, status=status.HTTP_404_NOT_FOUND)
             
-            # Process each PDF and create notes
+            # Queue note generation for each PDF, a worker picks the jobs up
             results = []
             for pdf in pdfs:
-                # Create note for the PDF
-                note_request = request._request
-                note_request.data = {'pdf_key': pdf.pdf_key}
-                note_response = createNoteView().post(note_request)
+                job = enqueue_job('process_pdf', payload={'pdf_id': pdf.id}, user=request.user)
                 results.append({
                     'pdf_id': pdf.pdf_key,
                     'pdf_name': pdf.pdf_name,
-                    'status': 'success' if note_response.status_code == status.HTTP_201_CREATED else 'failed',
-                    'message': note_response.data.get('message', '')
+                    'job_id': job.id,
+                    'status': job.status
                 })
             
             return Response({
                 'status': 'success',
                 'results': results
-            }, status=status.HTTP_200_OK)
+            }, status=status.HTTP_202_ACCEPTED)
             
         except Exception as e:
             return Response({
@@ -144,38 +149,77 @@ class ProcessPDFsView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def serialize_note_summary(note_obj):
+    return {
+        'note_title': note_obj.note_title,
+        'note_id': note_obj.id,
+        'pdf_id': note_obj.note_key.pdf_key,
+        'pdf_name': note_obj.note_key.pdf_name,
+        'note_preview': note_obj.note_preview,
+        'word_count': note_obj.word_count,
+        'reading_time_minutes': note_obj.reading_time_minutes,
+        'created_at': note_obj.created_at
+    }
+
 class GetNotesView(APIView):
     permission_classes = [IsAuthenticated]
-    
+
     def get(self, request):
+        # The list carries previews only; the text itself comes from GetNoteView.
+        # One page at a time (DEFAULT_PAGE_SIZE unless ?limit=); ?cursor= is the next_cursor of the last page
+        cursor = request.query_params.get('cursor')
         try:
-            # Get all notes for the current user
-            user_notes = note.objects.filter(user=request.user).order_by('-created_at')
-            
-            notes_data = [{
-                'note_title': note_obj.note_title,
-                'note_id': note_obj.id,
-                'pdf_id': note_obj.note_key.pdf_key,
-                'pdf_name': note_obj.note_key.pdf_name,
-                'note_text': note_obj.note_text,
-                'created_at': note_obj.created_at
-            } for note_obj in user_notes]
-            
+            page_limit = page_size(request.query_params.get('limit'))
+            if cursor:
+                decode_cursor(cursor)
+        except InvalidPage as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # One query, joined to the PDF and without note_text
+            user_notes = note.objects.filter(user=request.user).select_related('note_key').only(
+                'id', 'note_title', 'note_preview', 'word_count', 'reading_time_minutes', 'created_at',
+                'note_key__pdf_key', 'note_key__pdf_name'
+            )
+            notes, next_cursor = keyset_page(user_notes, cursor, page_limit)
+
             return Response({
                 'status': 'success',
-                'notes': notes_data
+                'notes': [serialize_note_summary(note_obj) for note_obj in notes],
+                'next_cursor': next_cursor
             }, status=status.HTTP_200_OK)
-            
+
         except Exception as e:
             return Response({
                 'status': 'error',
                 'message': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class GetNoteView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, note_id):
+        note_obj = note.objects.filter(id=note_id, user=request.user).select_related('note_key').first()
+        if note_obj is None:
+            return Response({
+                'status': 'error',
+                'message': 'Note not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'status': 'success',
+            'note': {**serialize_note_summary(note_obj), 'note_text': note_obj.note_text}
+        }, status=status.HTTP_200_OK)
+
 
 class generateFlashcardsView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent('generate-flashcards')
+    @single_flight('generate-flashcards')
     def post(self, request):
         try:
             note_id = request.data.get('note_id')
@@ -186,53 +230,68 @@ class generateFlashcardsView(APIView):
                     'message': 'Note ID is required'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            note_obj = note.objects.get(id=note_id)
-            note_text = note_obj.note_text
+            note_obj = note.objects.get(id=note_id, user=request.user)
 
-            flashcard_data = generate_flashcards(note_text)
-            flashcard_question = flashcard_data.get("flashcard_question")
-            flashcard_answers = flashcard_data.get("flashcard_answers")
+            # A deck of one
+            with request_context(PRIORITY_NOTES, request.user.id):
+                new_flashcard = create_flashcard_deck(request.user, note_obj, 1)[0]
+
+            return Response({
+                'status': 'success',
+                'flashcard': new_flashcard
+            }, status=status.HTTP_200_OK)
+
+        except note.DoesNotExist:
+            return Response({
+                'status': 'error',
+                'message': 'Note not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        except FlashcardFormatError as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_502_BAD_GATEWAY)
+            
+        except Exception as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            new_flashcard = flashcard.objects.create(
-                flashcard_title=note_obj.note_title,
-                flashcard_question=flashcard_question,
-                user=request.user,
-                note=note_obj
-            )
 
-            # Parse the lettered format answers
-            formatted_answers = []
-            for line in flashcard_answers.split('\n'):
-                line = line.strip()
-                if line and line[0] in 'ABCDE' and '. ' in line:
-                    # Extract the answer text after the letter and dot
-                    answer_text = line.split('. ', 1)[1].strip()
-                    is_correct = answer_text.startswith('*') or '*' in answer_text
-                    if is_correct:
-                        # Remove the asterisk from the answer text
-                        answer_text = answer_text.replace('*', '')
-                    
-                    new_flashcard_answer = flashcard_answer.objects.create(
-                        flashcard_answer=new_flashcard,
-                        answer_text=answer_text,
-                        is_correct=is_correct
-                    )
-                    new_flashcard_answer.save()
-                    formatted_answers.append({
-                        'text': answer_text,
-                        'is_correct': is_correct
-                    })
-
-            new_flashcard.save()
+class generateFlashcardDeckView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @idempotent('generate-flashcard-deck')
+    @single_flight('generate-flashcard-deck')
+    def post(self, request):
+        note_id = request.data.get('note_id')
+        try:
+            count = int(request.data.get('count', 10))
+        except (TypeError, ValueError):
+            count = 0
+
+        if not note_id:
+            return Response({
+                'status': 'error',
+                'message': 'Note ID is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not 1 <= count <= settings.FLASHCARD_MAX_DECK_SIZE:
+            return Response({
+                'status': 'error',
+                'message': f'count must be between 1 and {settings.FLASHCARD_MAX_DECK_SIZE}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            note_obj = note.objects.get(id=note_id, user=request.user)
+            with request_context(PRIORITY_NOTES, request.user.id):
+                flashcards = create_flashcard_deck(request.user, note_obj, count)
 
             return Response({
                 'status': 'success',
-                'flashcard': {
-                    'id': new_flashcard.id,
-                    'title': new_flashcard.flashcard_title,
-                    'question': new_flashcard.flashcard_question,
-                    'answers': formatted_answers
-                }
+                'flashcards': flashcards
             }, status=status.HTTP_200_OK)
 
         except note.DoesNotExist:
@@ -240,7 +299,13 @@ class generateFlashcardsView(APIView):
                 'status': 'error',
                 'message': 'Note not found'
             }, status=status.HTTP_404_NOT_FOUND)
-            
+
+        except FlashcardFormatError as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_502_BAD_GATEWAY)
+
         except Exception as e:
             return Response({
                 'status': 'error',
@@ -248,41 +313,105 @@ class generateFlashcardsView(APIView):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class generateDecksView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        note_ids = request.data.get('note_ids')
+        notebook_page_id = request.data.get('notebook_page_id')
+        try:
+            count = int(request.data.get('count', 10))
+        except (TypeError, ValueError):
+            count = 0
+
+        if not note_ids and not notebook_page_id:
+            return Response({
+                'status': 'error',
+                'message': 'note_ids or notebook_page_id is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not 1 <= count <= settings.FLASHCARD_MAX_DECK_SIZE:
+            return Response({
+                'status': 'error',
+                'message': f'count must be between 1 and {settings.FLASHCARD_MAX_DECK_SIZE}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            if note_ids is not None and not isinstance(note_ids, list):
+                raise TypeError
+            note_ids = deck_note_ids(request.user, note_ids=note_ids, notebook_page_id=notebook_page_id)
+        except (TypeError, ValueError):
+            return Response({
+                'status': 'error',
+                'message': 'Invalid note ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if not note_ids:
+            return Response({
+                'status': 'error',
+                'message': 'No notes found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if len(note_ids) > settings.DECK_GENERATION_MAX_NOTES:
+            return Response({
+                'status': 'error',
+                'message': f'At most {settings.DECK_GENERATION_MAX_NOTES} notes per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # One job for the whole set; its progress is reported on the job status endpoint
+        job = enqueue_job('generate_decks', payload={'note_ids': note_ids, 'count': count}, user=request.user)
+        return Response({
+            'status': 'success',
+            'job_id': job.id,
+            'note_count': len(note_ids),
+            'status_url': reverse('job-status', kwargs={'job_id': job.id})
+        }, status=status.HTTP_202_ACCEPTED)
+
+
 class getFlashcardsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, note_id=None):
+        # One page of the deck at a time (DEFAULT_PAGE_SIZE unless ?limit=); ?cursor= is the next_cursor of the last page
+        cursor = request.query_params.get('cursor')
         try:
-            # Get flashcards for the current user
-            user_flashcards = flashcard.objects.filter(user=request.user)
-            
+            page_limit = page_size(request.query_params.get('limit'))
+            if cursor:
+                decode_cursor(cursor)
+        except InvalidPage as e:
+            return Response({
+                'status': 'error',
+                'message': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Get flashcards for the current user, with all their answers in one more query
+            user_flashcards = flashcard.objects.filter(user=request.user).prefetch_related(
+                Prefetch('flashcard_answers', queryset=flashcard_answer.objects.order_by('id'))
+            )
+
             # If note_id is provided, filter flashcards by note
             if note_id:
                 user_flashcards = user_flashcards.filter(note_id=note_id)
-            
-            user_flashcards = user_flashcards.order_by('-created_at')
-            
-            flashcards_data = []
-            for flashcard_obj in user_flashcards:
-                # Get all answers for this flashcard
-                answers = flashcard_obj.flashcard_answers.all()
-                formatted_answers = [{
+
+            cards, next_cursor = keyset_page(user_flashcards, cursor, page_limit)
+
+            flashcards_data = [{
+                'id': flashcard_obj.id,
+                'title': flashcard_obj.flashcard_title,
+                'question': flashcard_obj.flashcard_question,
+                'answers': [{
                     'text': answer.answer_text,
                     'is_correct': answer.is_correct
-                } for answer in answers]
-                
-                flashcards_data.append({
-                    'id': flashcard_obj.id,
-                    'title': flashcard_obj.flashcard_title, 
-                    'question': flashcard_obj.flashcard_question,
-                    'answers': formatted_answers,
-                    'created_at': flashcard_obj.created_at,
-                    'note': flashcard_obj.note.id
-                })
+                } for answer in flashcard_obj.flashcard_answers.all()],
+                'created_at': flashcard_obj.created_at,
+                'note': flashcard_obj.note_id
+            } for flashcard_obj in cards]
 
             return Response({
                 'status': 'success',
-                'flashcards': flashcards_data
+                'flashcards': flashcards_data,
+                'next_cursor': next_cursor
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
@@ -319,11 +448,12 @@ class getMessagesView(APIView):
 class sendMessageView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent('send-message')
+    @single_flight('send-message')
     def post(self, request):
         try:
             message = request.data.get('message')
             note_id = request.data.get('note_id')
-            note_text = request.data.get('note_text')
 
             if not note_id:
                 return Response({
@@ -331,36 +461,30 @@ class sendMessageView(APIView):
                     'message': 'Note ID is required'
                 }, status=status.HTTP_400_BAD_REQUEST)
                 
-            note_obj = note.objects.get(id=note_id)
+            try:
+                # The prompt is built from the stored note, so only its owner may chat over it
+                note_obj = note.objects.get(id=note_id, user=request.user)
+            except note.DoesNotExist:
+                return Response({
+                    'status': 'error',
+                    'message': 'Note not found'
+                }, status=status.HTTP_404_NOT_FOUND)
 
-            # Get previous messages, excluding any with null roles
-            previous_messages = chat_message.objects.filter(
-                note_id=note_id,
-                role__isnull=False
-            ).order_by('created_at')
-            
-            old_messages = [{
-                'role': msg.role,
-                'content': msg.message
-            } for msg in previous_messages]
+            # Bounded context: recent messages verbatim, older ones folded into the running summary
+            with request_context(PRIORITY_INTERACTIVE, request.user.id):
+                messages = build_chat_context(note_obj, message)
 
             # Add the new user message to the database
-            new_message = chat_message.objects.create(
+            chat_message.objects.create(
                 message=message,
                 role="user",
                 user=request.user,
                 note=note_obj
             )
-            new_message.save()
-
-            # Add the user message to the conversation history
-            old_messages.append({
-                'role': 'user',
-                'content': message
-            })
 
             # Get the response from OpenAI
-            assistant_message = generate_assistant_chat_message(old_messages, message, note_text)
+            with request_context(PRIORITY_INTERACTIVE, request.user.id):
+                assistant_message = generate_assistant_chat_message(messages)
 
             # Add the assistant message to the database
             assistant_message_obj = chat_message.objects.create(
@@ -380,4 +504,36 @@ class sendMessageView(APIView):
             return Response({
                 'status': 'error',
                 'message': str(e)
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class sendMessageStreamView(APIView):
+    # For WSGI deployments. Under ASGI Django reads a synchronous stream to the end before
+    # sending any of it, so the frontend uses async_views.send_message_stream instead
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        message = request.data.get('message')
+        note_id = request.data.get('note_id')
+
+        if not note_id or not message:
+            return Response({
+                'status': 'error',
+                'message': 'Note ID and message are required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            note_obj = note.objects.get(id=note_id, user=request.user)
+        except note.DoesNotExist:
+            return Response({
+                'status': 'error',
+                'message': 'Note not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        with request_context(PRIORITY_INTERACTIVE, request.user.id):
+            messages = build_chat_context(note_obj, message)
+            question = chat_message.objects.create(message=message, role="user", user=request.user, note=note_obj)
+
+            # Deltas are sent as server-sent events; the reply is saved once the stream completes
+            deltas = stream_assistant_chat_message(messages)
+        return sse_response(chat_reply_events(deltas, request.user, note_obj, question))